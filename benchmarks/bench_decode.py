@@ -0,0 +1,73 @@
+"""Benchmark decoding large ANSI command output, as done by RichImg.render_command_output().
+
+Compares the current single-pass decode against decoding the output twice, which is
+what rich-codex used to do: once to count the lines, then again to print them.
+
+Run with: python benchmarks/bench_decode.py [NUM_LINES]
+"""
+
+import sys
+import time
+from collections.abc import Callable
+from io import StringIO
+
+from rich.ansi import AnsiDecoder
+from rich.console import Console
+
+from rich_codex.rich_img import RichImg
+
+
+def ansi_output(num_lines: int) -> str:
+    """Make coloured test-log style output, with a style that changes every few lines."""
+    colours = [31, 32, 33, 34, 35, 36]
+    return "".join(
+        f"\x1b[{colours[i % len(colours)]}mPASSED\x1b[0m tests/test_{i}.py::test_case_{i} \x1b[2m[{i % 100}%]\x1b[0m\n"
+        for i in range(num_lines)
+    )
+
+
+def two_pass(output: str, tail: int) -> None:
+    """Decode once to count the lines, then again to print them, as rich-codex used to."""
+    decoder = AnsiDecoder()
+    print_lines = []
+    max_line_length = 0
+    for line in decoder.decode(output):
+        print_lines.append(True)
+        max_line_length = max(len(line), max_line_length)
+    console = Console(file=StringIO(), record=True, width=max(80, max_line_length))
+    print_lines = [False] * len(print_lines)
+    print_lines[len(print_lines) - tail :] = [True] * tail
+    for idx, line in enumerate(decoder.decode(output)):
+        if print_lines[idx]:
+            console.print(line)
+
+
+def single_pass(output: str, tail: int) -> None:
+    """Decode once, with RichImg.render_command_output()."""
+    img = RichImg(command="pytest", tail=tail, console=Console(file=StringIO()))
+    img.render_command_output(output)
+
+
+def best_of(func: Callable[..., None], *args: object, repeats: int = 3) -> float:
+    """Time the fastest of a few runs, in seconds."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    output = ansi_output(num_lines)
+    print(f"Decoding {num_lines:,} lines ({len(output) / 1024 / 1024:.1f} MB) of ANSI output, showing the last 20")
+    before = best_of(two_pass, output, 20)
+    after = best_of(single_pass, output, 20)
+    print(f"  Two passes:  {before:.3f}s")
+    print(f"  Single pass: {after:.3f}s ({before / after:.2f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
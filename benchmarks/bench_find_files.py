@@ -0,0 +1,94 @@
+"""Benchmark finding the files to search, as done by CodexSearch.find_files().
+
+Builds a synthetic repository with a .gitignore and a node_modules directory, then
+compares the single directory walk against globbing each include and exclude
+pattern separately, which is what rich-codex used to do.
+
+Run with: python benchmarks/bench_find_files.py [NUM_FILES]
+"""
+
+import inspect
+import os
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from rich_codex.codex_search import CodexSearch
+
+GITIGNORE = """
+*.pyc
+*.log
+__pycache__/
+build/
+dist/
+.venv/
+*.egg-info/
+.coverage
+htmlcov/
+.mypy_cache/
+.pytest_cache/
+.ruff_cache/
+site/
+*.tmp
+.DS_Store
+"""
+
+
+def make_tree(root: Path, num_files: int) -> None:
+    """Write a tree of small files: 60% in node_modules, the rest in source and docs."""
+    files_per_dir = 100
+    for dir_idx in range(num_files // files_per_dir):
+        if dir_idx % 5 < 3:
+            directory = root / "node_modules" / f"pkg_{dir_idx}" / "lib"
+        elif dir_idx % 5 == 3:
+            directory = root / "docs" / f"section_{dir_idx}"
+        else:
+            directory = root / "src" / f"module_{dir_idx}"
+        directory.mkdir(parents=True)
+        for file_idx in range(files_per_dir):
+            suffix = ".md" if file_idx % 10 == 0 else ".py"
+            (directory / f"file_{file_idx}{suffix}").write_text("")
+    (root / ".gitignore").write_text(GITIGNORE)
+
+
+def glob_each_pattern(cs: CodexSearch) -> list[Path]:
+    """Glob each include and exclude pattern separately, as rich-codex used to."""
+    matched_files: set[Path] = set()
+    for pattern in cs.search_include:
+        for search_file in Path.cwd().glob(pattern):
+            matched_files.add(search_file.resolve())
+    for pattern in cs.search_exclude:
+        if pattern.endswith("/"):
+            pattern += "**/*"
+        try:
+            for exclude_file in Path.cwd().glob(pattern):
+                matched_files.discard(exclude_file.resolve())
+        except (ValueError, NotImplementedError):
+            pass
+    return sorted(matched_files, key=lambda x: str(x).lower())
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with TemporaryDirectory() as tmp_dir:
+        make_tree(Path(tmp_dir), num_files)
+        os.chdir(tmp_dir)
+        # Only the search patterns matter here, and they default to the same as the CLI
+        cs = CodexSearch(**dict.fromkeys(inspect.signature(CodexSearch).parameters))
+        print(f"Finding files in a tree of {num_files:,} files, with {len(cs.search_exclude)} exclude patterns")
+
+        start = time.perf_counter()
+        before = glob_each_pattern(cs)
+        before_time = time.perf_counter() - start
+        start = time.perf_counter()
+        after = cs.find_files()
+        after_time = time.perf_counter() - start
+
+        print(f"  Glob each pattern: {before_time:.3f}s ({len(before):,} files)")
+        print(f"  Single walk:       {after_time:.3f}s ({len(after):,} files, {before_time / after_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
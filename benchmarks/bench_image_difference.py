@@ -0,0 +1,54 @@
+"""Benchmark comparing rendered PNGs, as done by RichImg._enough_image_difference().
+
+Renders two versions of a terminal screenshot, one word apart, to multi-megabyte PNGs
+with CairoSVG. Then compares them with the full Levenshtein ratio, which is what
+rich-codex used to do, and with the bounds in pct_change_bounds().
+
+Needs CairoSVG: pip install rich-codex[cairo]
+
+Run with: python benchmarks/bench_image_difference.py [OUTPUT_WIDTH]
+"""
+
+import sys
+import time
+from io import StringIO
+
+from cairosvg import svg2png
+from Levenshtein import ratio
+from rich.console import Console
+
+from rich_codex.rich_img import pct_change_bounds
+
+
+def render_png(word: str, output_width: int) -> bytes:
+    """Render some coloured terminal output to a PNG."""
+    console = Console(file=StringIO(), record=True, width=100)
+    for i in range(60):
+        console.print(f"[green]PASSED[/] tests/test_{i}.py::test_case_{i} [dim]\\[{i}%][/]")
+    console.print(f"[bold red]{word}[/] 60 passed in 1.23s")
+    return svg2png(bytestring=console.export_svg(title="pytest").encode("utf-8"), output_width=output_width)
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    output_width = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    old = render_png("DONE", output_width)
+    new = render_png("DONE!", output_width)
+    print(f"Comparing PNGs of {len(old) / 1024 / 1024:.1f} MB and {len(new) / 1024 / 1024:.1f} MB")
+
+    cases = [("identical", old, old, 0.0), ("changed", new, old, 0.0), ("changed", new, old, 5.0)]
+    for name, first, second, min_pct_diff in cases:
+        start = time.perf_counter()
+        low, high = pct_change_bounds(first, second, min_pct_diff)
+        seconds = time.perf_counter() - start
+        print(f"  Bounds, {name}, min_pct_diff={min_pct_diff:g}: {seconds:.3f}s ({low:.2f}% - {high:.2f}%)")
+
+    print("  Full ratio, changed (this can take minutes)...")
+    start = time.perf_counter()
+    pct_change = (1 - ratio(new, old)) * 100.0
+    seconds = time.perf_counter() - start
+    print(f"  Full ratio, changed: {seconds:.3f}s ({pct_change:.2f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark running a Python command-line tool with and without --preload.
+
+Captures `rich-codex --help` a number of times, as RichImg.capture_command() does for
+a screenshot. rich-codex is built with rich-click, so most of each run is spent
+starting Python and importing it. The first way starts a new process for every
+command, which is what rich-codex does by default. The second runs every command
+in a fork of a preload server that has already imported it.
+
+Run with: python benchmarks/bench_preload.py [NUM_COMMANDS]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from rich_codex.preload import PreloadServer
+from rich_codex.rich_img import RichImg
+
+COMMAND = "rich-codex --help"
+
+
+def capture_all(num_commands: int, preload_server: PreloadServer | None) -> list[str | None]:
+    """Capture the output of the command the given number of times."""
+    outputs = []
+    for _ in range(num_commands):
+        img = RichImg(command=COMMAND)
+        img.preload_server = preload_server
+        asyncio.run(img.capture_command())
+        outputs.append(img.command_output)
+    return outputs
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    num_commands = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f"Capturing '{COMMAND}' {num_commands} times")
+
+    start = time.perf_counter()
+    before = capture_all(num_commands, None)
+    before_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preload_server = PreloadServer({"rich-codex": None}, {**os.environ, "RICH_CODEX": "1"})
+    startup_time = time.perf_counter() - start
+    start = time.perf_counter()
+    after = capture_all(num_commands, preload_server)
+    after_time = time.perf_counter() - start
+    preload_server.close()
+
+    assert before == after
+    print(f"  New process: {before_time / num_commands * 1000:.1f}ms per command")
+    print(
+        f"  Preloaded:   {after_time / num_commands * 1000:.1f}ms per command "
+        f"({before_time / after_time:.1f}x faster, plus {startup_time:.2f}s to start the server)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Benchmark how the full rich-codex pipeline scales with the size of the docs.
+
+Builds a synthetic repository for each number of markdown files, N, and runs the
+rich-codex CLI on it in a new process, as a user would. Every file has the same mix of
+command images, snippets and config outputs in `.rich-codex.yml`, and every image is
+saved in each of the output formats. Commands run a small fake script with a set
+runtime and number of lines of coloured output, so that the cost of running commands
+can be kept out of the way or made to dominate.
+
+For each N, prints the wall time and peak memory (RSS) of a first run that generates
+every image, and of a second run on the unchanged tree. Each is the fastest of a few
+repeats, on a new repository every time. The scaling exponent between one N and the
+next is the slope of log(time) against log(N), after taking off the time of a run with
+no files at all: about 1 for linear scaling, 2 for quadratic. The run fails if the
+overall exponent is above --max-exponent.
+
+At small sizes the time taken by the files can be lost in the noise of the fixed time,
+which makes the exponent meaningless. If the smallest size spends less than
+--min-variable of its time on the files, the exponent is only printed, with a warning,
+and doesn't fail the run. Use bigger sizes to gate on it.
+
+Run with: python benchmarks/bench_scaling.py [--sizes 25,50,100,200] [--commands 2] [--snippets 1] \
+    [--config-outputs 1] [--formats svg] [--runtime 0] [--output-lines 20] [--repeats 3] [-- RICH_CODEX_ARGS ...]
+"""
+
+import argparse
+import csv
+import math
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from rich.console import Console
+from rich.table import Table
+
+# Sleeps, then prints numbered lines of coloured output
+FAKE_COMMAND = r"""#!/bin/sh
+sleep "$1"
+awk -v n="$2" -v id="$3" 'BEGIN {
+    for (i = 0; i < n; i++) printf "\033[32mPASSED\033[0m %s line %d \033[2m[%d%%]\033[0m\n", id, i, i % 100
+}'
+"""
+
+
+def fake_command(root: Path, args: argparse.Namespace, image_id: str) -> str:
+    """Command for an image: unique, so that images aren't merged with each other.
+
+    The script's path is absolute, as markdown images run in the directory of their file.
+    """
+    return f"sh {root / 'fake_command.sh'} {args.runtime:g} {args.output_lines} {image_id}"
+
+
+def img_paths(name: str, formats: list[str]) -> list[str]:
+    """Paths to save an image to, relative to the repository, one for each format."""
+    return [f"docs/img/{name}.{fmt}" for fmt in formats]
+
+
+def config_comment(lines: list[str], extra_paths: list[str]) -> str:
+    """Config comment for an image, adding any paths after the one in its markdown tag."""
+    if len(extra_paths) > 0:
+        lines = [*lines, "img_paths:", *(f"  - {path}" for path in extra_paths)]
+    if len(lines) == 0:
+        return ""
+    return "<!-- RICH-CODEX\n" + "".join(f"{line}\n" for line in lines) + "-->\n"
+
+
+def make_repo(root: Path, num_files: int, args: argparse.Namespace) -> int:
+    """Write a synthetic repository with markdown files and a config file, returning the number of images."""
+    (root / "fake_command.sh").write_text(FAKE_COMMAND)
+    (root / "docs").mkdir()
+    num_images = 0
+    config_outputs = []
+    for file_idx in range(num_files):
+        parts = [f"# Page {file_idx}\n\nSome text about rich-codex, to be skipped when searching.\n\n"]
+        for cmd_idx in range(args.commands):
+            name = f"page_{file_idx}_command_{cmd_idx}"
+            paths = img_paths(name, args.formats)
+            parts.append(config_comment([], paths[1:]))
+            parts.append(f"![`{fake_command(root, args, name)}`]({Path(paths[0]).relative_to('docs')})\n\n")
+            num_images += 1
+        for snippet_idx in range(args.snippets):
+            name = f"page_{file_idx}_snippet_{snippet_idx}"
+            paths = img_paths(name, args.formats)
+            snippet = f'{{"page": {file_idx}, "snippet": {snippet_idx}, "words": ["rich", "codex"]}}'
+            parts.append(config_comment([f"snippet: '{snippet}'"], paths[1:]))
+            parts.append(f"![]({Path(paths[0]).relative_to('docs')})\n\n")
+            num_images += 1
+        (root / "docs" / f"page_{file_idx}.md").write_text("".join(parts))
+        for output_idx in range(args.config_outputs):
+            name = f"page_{file_idx}_config_{output_idx}"
+            config_outputs.append(
+                f"  - command: {fake_command(root, args, name)}\n"
+                + "    img_paths:\n"
+                + "".join(f"      - {path}\n" for path in img_paths(name, args.formats))
+            )
+            num_images += 1
+    if config_outputs:
+        (root / ".rich-codex.yml").write_text("outputs:\n" + "".join(config_outputs))
+    return num_images
+
+
+def run_rich_codex(root: Path, rich_codex_args: list[str]) -> tuple[float, float]:
+    """Run the rich-codex CLI in the repository, returning the wall time in seconds and peak RSS in MB."""
+    env = {key: value for key, value in os.environ.items() if key != "GITHUB_ACTIONS"}
+    command = [sys.executable, "-m", "rich_codex", "--skip-git-checks", "--no-confirm", *rich_codex_args]
+    with open(root / "rich-codex.log", "w") as log_fh:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=root, env=env, stdout=log_fh, stderr=subprocess.STDOUT)
+        # wait4() gives the resource usage of this process alone
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        print((root / "rich-codex.log").read_text()[-3000:])
+        sys.exit(f"rich-codex exited with code {process.returncode}")
+    # Kilobytes on Linux, bytes on macOS
+    max_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return seconds, max_rss
+
+
+def best_run(root: Path, rich_codex_args: list[str], repeats: int) -> tuple[float, float]:
+    """Run the rich-codex CLI a number of times in the repository, returning the time and RSS of the fastest run."""
+    return min(run_rich_codex(root, rich_codex_args) for _ in range(repeats))
+
+
+def check_output(root: Path, args: argparse.Namespace) -> None:
+    """Make sure that the images hold the fake command's output, so that the benchmark times what it says."""
+    if "svg" not in args.formats or args.output_lines == 0:
+        return
+    names = ["page_0_command_0"] if args.commands > 0 else []
+    names += ["page_0_config_0"] if args.config_outputs > 0 else []
+    for name in names:
+        svg = (root / "docs" / "img" / f"{name}.svg").read_text()
+        if "PASSED" not in svg:
+            print((root / "rich-codex.log").read_text()[-3000:])
+            sys.exit(f"Image '{name}' doesn't have the output of the fake command")
+
+
+def exponent(n1: float, t1: float, n2: float, t2: float, fixed: float) -> float:
+    """Slope of log(time) against log(N) between two points, leaving out the time that doesn't depend on N."""
+    # At least a millisecond, as small runs can come in under the fixed time
+    return math.log(max(t2 - fixed, 1e-3) / max(t1 - fixed, 1e-3)) / math.log(n2 / n1)
+
+
+def main() -> None:
+    """Run rich-codex on repositories of each size and print the scaling."""
+    parser = argparse.ArgumentParser(description="End-to-end scaling benchmark of the rich-codex CLI")
+    parser.add_argument("--sizes", default="25,50,100,200", help="Numbers of markdown files, comma separated")
+    parser.add_argument("--commands", type=int, default=2, help="Command images in each markdown file")
+    parser.add_argument("--snippets", type=int, default=1, help="Snippet images in each markdown file")
+    parser.add_argument("--config-outputs", type=int, default=1, help="Config file outputs for each markdown file")
+    parser.add_argument("--formats", default="svg", help="Formats to save every image in: svg, png, pdf")
+    parser.add_argument("--runtime", type=float, default=0, help="Seconds that each fake command takes")
+    parser.add_argument("--output-lines", type=int, default=20, help="Lines of output from each fake command")
+    parser.add_argument("--max-exponent", type=float, default=1.3, help="Fail if time grows faster than N to this")
+    parser.add_argument(
+        "--min-variable",
+        type=float,
+        default=0.25,
+        help="Only fail on the exponent if the smallest size spends at least this fraction of its time on the files",
+    )
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of each size, taking the fastest")
+    parser.add_argument("--csv", type=Path, help="Save the results to this CSV file")
+    parser.add_argument("rich_codex_args", nargs="*", help="Extra arguments for rich-codex, after '--'")
+    args = parser.parse_args()
+    args.formats = [fmt.strip().lower() for fmt in args.formats.split(",")]
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    if "png" in args.formats or "pdf" in args.formats:
+        try:
+            import cairosvg  # noqa: F401
+        except ImportError:
+            sys.exit("Saving PNG or PDF images needs CairoSVG: pip install rich-codex[cairo]")
+
+    # Start-up and everything else that's the same however many files there are
+    with TemporaryDirectory() as tmp_dir:
+        fixed_seconds, fixed_rss = best_run(Path(tmp_dir).resolve(), args.rich_codex_args, args.repeats)
+    print(f"Run with no files: {fixed_seconds:.2f}s, {fixed_rss:.0f} MB peak RSS")
+
+    title = f"rich-codex {' '.join(args.rich_codex_args)}".strip() + f", fastest of {args.repeats} runs"
+    table = Table(title=title, title_justify="left")
+    for column in ["Files", "Images", "First run (s)", "Exponent", "Peak RSS (MB)", "Re-run (s)", "Peak RSS (MB)"]:
+        table.add_column(column, justify="right")
+    results: list[dict[str, float]] = []
+    for num_files in sizes:
+        firsts = []
+        reruns = []
+        for _ in range(args.repeats):
+            # A new repository each time, so that every first run has all the images to generate
+            with TemporaryDirectory() as tmp_dir:
+                root = Path(tmp_dir).resolve()
+                num_images = make_repo(root, num_files, args)
+                firsts.append(run_rich_codex(root, args.rich_codex_args))
+                check_output(root, args)
+                reruns.append(run_rich_codex(root, args.rich_codex_args))
+        first_seconds, first_rss = min(firsts)
+        rerun_seconds, rerun_rss = min(reruns)
+        result = {
+            "files": num_files,
+            "images": num_images,
+            "first_seconds": first_seconds,
+            "first_rss_mb": first_rss,
+            "rerun_seconds": rerun_seconds,
+            "rerun_rss_mb": rerun_rss,
+        }
+        step = "-"
+        if results:
+            previous = results[-1]
+            step = (
+                f"{exponent(previous['files'], previous['first_seconds'], num_files, first_seconds, fixed_seconds):.2f}"
+            )
+        results.append(result)
+        table.add_row(
+            f"{num_files:,}",
+            f"{num_images:,}",
+            f"{first_seconds:.2f}",
+            step,
+            f"{first_rss:.0f}",
+            f"{rerun_seconds:.2f}",
+            f"{rerun_rss:.0f}",
+        )
+    Console().print(table)
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"Saved results to {args.csv}")
+
+    if len(results) > 1:
+        first, last = results[0], results[-1]
+        failed = []
+        for label, column in (("first run", "first_seconds"), ("re-run", "rerun_seconds")):
+            scaling = exponent(first["files"], first[column], last["files"], last[column], fixed_seconds)
+            print(f"Scaling exponent of the {label} from {first['files']:g} to {last['files']:g} files: {scaling:.2f}")
+            variable = (first[column] - fixed_seconds) / first[column]
+            if variable < args.min_variable:
+                print(
+                    f"Warning: only {max(variable, 0):.0%} of the {label} time for {first['files']:g} files is spent on"
+                    " the files, not gating on its exponent, try bigger --sizes"
+                )
+            elif scaling > args.max_exponent:
+                failed.append(label)
+        if failed:
+            sys.exit(
+                f"Time of the {' and '.join(failed)} grows faster than N^{args.max_exponent:g},"
+                " check for a quadratic step in the pipeline"
+            )
+
+
+if __name__ == "__main__":
+    main()
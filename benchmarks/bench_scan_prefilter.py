@@ -0,0 +1,66 @@
+"""Benchmark searching markdown files, as done by CodexSearch.search_files().
+
+Writes a synthetic corpus of docs where only a few use rich-codex. Then it compares
+two ways of scanning every file. The first decodes each file and runs scan_file() on
+every line, which is what rich-codex used to do. The second is scan_path(), which skips
+files without any of the byte markers.
+
+Run with: python benchmarks/bench_scan_prefilter.py [NUM_DOCS]
+"""
+
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+from rich_codex.codex_search import scan_file, scan_path
+
+PARAGRAPH = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt\n"
+    "ut labore et dolore magna aliqua. See [the docs](https://example.com) and `some_code()`.\n"
+    "\n"
+)
+
+
+def make_corpus(root: Path, num_docs: int) -> list[Path]:
+    """Write markdown docs of a few KB each, with one in fifty using rich-codex."""
+    docs = []
+    for doc_idx in range(num_docs):
+        lines = [f"# Document {doc_idx}\n\n", PARAGRAPH * 20, "![diagram](img/diagram.png)\n\n", PARAGRAPH * 20]
+        if doc_idx % 50 == 0:
+            lines.insert(2, "<!-- RICH-CODEX terminal_width: 80 -->\n![`my-tool --help`](img/help.svg)\n\n")
+        doc = root / f"section_{doc_idx // 100}" / f"doc_{doc_idx}.md"
+        doc.parent.mkdir(exist_ok=True)
+        doc.write_text("".join(lines))
+        docs.append(doc)
+    return docs
+
+
+def commands_found(results: list[list[dict[str, Any]]]) -> list[str]:
+    """List the commands of the images found in each file."""
+    return [item["match"]["cmd"] for found in results for item in found if item["match"].get("cmd")]
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    with TemporaryDirectory() as tmp_dir:
+        docs = make_corpus(Path(tmp_dir), num_docs)
+        print(f"Scanning {num_docs:,} docs, {sum(doc.stat().st_size for doc in docs) / 1e6:.1f}MB in total")
+
+        start = time.perf_counter()
+        before = [scan_file(doc.read_text(encoding="utf-8")) for doc in docs]
+        before_time = time.perf_counter() - start
+        start = time.perf_counter()
+        after = [scan_path(doc) for doc in docs]
+        after_time = time.perf_counter() - start
+
+        # Files that were skipped only had plain images, which don't become rich-codex images
+        assert commands_found(before) == commands_found(after)
+        print(f"  Scan every line: {before_time:.3f}s")
+        print(f"  Prefilter bytes: {after_time:.3f}s ({before_time / after_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
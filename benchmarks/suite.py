@@ -0,0 +1,310 @@
+"""Microbenchmarks of rich-codex's hot paths, compared against a saved baseline.
+
+Each benchmark builds synthetic input from a fixed random seed, so that every run times
+exactly the same work, and then times the fastest of a few repeats. The input is built
+again before each repeat and isn't included in the timing.
+
+Save a baseline before making changes, then run the suite again to compare against it.
+Anything slower than the baseline by more than the threshold is flagged as a regression,
+and the exit code is 1. Timings depend on the machine, so only compare against a
+baseline saved on the same one.
+
+Run with: python benchmarks/suite.py [--save] [--baseline FILE] [--threshold PCT] [--repeats N] [--scale X] [NAME ...]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections.abc import Callable
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+from rich.console import Console
+from rich.table import Table
+
+from rich_codex.codex_search import CodexSearch
+from rich_codex.rich_img import RichImg
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+# Builds the input for a benchmark in a temporary working directory, and returns the code to time
+Setup = Callable[[Path, int, random.Random], Callable[[], Any]]
+
+# Name: default size and setup function
+BENCHMARKS: dict[str, tuple[int, Setup]] = {}
+
+WORDS = "rich codex terminal image command output snippet config theme render search".split()
+
+
+def benchmark(name: str, size: int) -> Callable[[Setup], Setup]:
+    """Add a benchmark to the suite, with the size of its input."""
+
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS[name] = (size, setup)
+        return setup
+
+    return register
+
+
+# Same as the CLI's defaults, without the caches, shell sessions and other extras that its options turn on
+CODEX_SEARCH_DEFAULTS: dict[str, Any] = {
+    "search_include": None,
+    "search_exclude": None,
+    "configs": None,
+    "no_confirm": True,
+    "no_dedupe": False,
+    "jobs": 1,
+    "convert_workers": 0,
+    "render_cache": None,
+    "search_index": None,
+    "shell_sessions": None,
+    "preload_server": None,
+    "record_cassette": None,
+    "replay_cassette": None,
+    "timing_history": None,
+    "extra_env": None,
+    "snippet_syntax": None,
+    "timeout": 5,
+    "working_dir": None,
+    "before_command": None,
+    "after_command": None,
+    "hide_command": False,
+    "title_command": False,
+    "head": None,
+    "tail": None,
+    "trim_after": None,
+    "truncated_text": "[..truncated..]",
+    "min_pct_diff": 0,
+    "skip_change_regex": None,
+    "terminal_width": None,
+    "terminal_min_width": 80,
+    "notrim": False,
+    "terminal_theme": None,
+    "snippet_theme": None,
+    "use_pty": False,
+    "console": None,
+}
+
+
+def codex_search() -> CodexSearch:
+    """Make a CodexSearch in the working directory, with the same defaults as the CLI, one job at a time."""
+    return CodexSearch(**CODEX_SEARCH_DEFAULTS)
+
+
+def ansi_output(num_lines: int, rng: random.Random) -> str:
+    """Make coloured test-log style output."""
+    lines = []
+    for i in range(num_lines):
+        colour = rng.choice([31, 32, 33, 34, 35, 36])
+        words = " ".join(rng.choices(WORDS, k=rng.randint(2, 8)))
+        lines.append(f"\x1b[{colour}mPASSED\x1b[0m tests/test_{i}.py::{words} \x1b[2m[{i % 100}%]\x1b[0m\n")
+    return "".join(lines)
+
+
+def python_code(num_lines: int, rng: random.Random) -> str:
+    """Make Python source code, a function every few lines."""
+    lines: list[str] = []
+    while len(lines) < num_lines:
+        name = "_".join(rng.choices(WORDS, k=2))
+        lines += [
+            f"def {name}_{len(lines)}(value: int, label: str = {rng.choice(WORDS)!r}) -> dict:",
+            f'    """Return the {" ".join(rng.choices(WORDS, k=5))}."""',
+            f"    result = {{'value': value * {rng.randint(1, 99)}, 'label': label.upper()}}",
+            f"    if value > {rng.randint(0, 1000)}:  # {rng.choice(WORDS)}",
+            "        result['big'] = True",
+            "    return result",
+            "",
+        ]
+    return "\n".join(lines[:num_lines])
+
+
+def markdown_file(rng: random.Random) -> str:
+    """Make a markdown page with prose, command images, snippets and config comments."""
+    parts = []
+    for section in range(rng.randint(3, 8)):
+        parts.append(f"## Section {section}\n\n" + " ".join(rng.choices(WORDS, k=60)) + "\n\n")
+        choice = rng.random()
+        if choice < 0.4:
+            parts.append(f"![`echo {rng.choice(WORDS)} {section}`](img/{rng.choice(WORDS)}_{section}.svg)\n\n")
+        elif choice < 0.6:
+            parts.append(f"<!-- RICH-CODEX\nterminal_width: {rng.randint(60, 120)}\nhead: {rng.randint(5, 20)}\n-->\n")
+            parts.append(f"![`echo {rng.choice(WORDS)}`](img/config_{section}.svg)\n\n")
+        elif choice < 0.7:
+            parts.append(f"<!-- RICH-CODEX snippet: {rng.choice(WORDS)} -->\n![](img/snippet_{section}.svg)\n\n")
+        else:
+            parts.append("```bash\n" + " ".join(rng.choices(WORDS, k=10)) + "\n```\n\n")
+    return "".join(parts)
+
+
+def svg_lines(num_lines: int, rng: random.Random) -> list[str]:
+    """Make lines that look like the text of a rendered SVG."""
+    return [
+        f'<text class="r{rng.randint(1, 9)}" x="{rng.randint(0, 1000)}" y="{i * 24}">'
+        f"{'&#160;'.join(rng.choices(WORDS, k=6))}</text>"
+        for i in range(num_lines)
+    ]
+
+
+@benchmark("search_files", 1000)
+def search_files(tmp_dir: Path, size: int, rng: random.Random) -> Callable[[], Any]:
+    """Search a tree of markdown files, as CodexSearch.search_files() does for every run."""
+    for i in range(size):
+        path = tmp_dir / "docs" / f"section_{i % 20}" / f"page_{i}.md"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(markdown_file(rng))
+    cs = codex_search()
+    return cs.search_files
+
+
+@benchmark("decode_output", 10_000)
+def decode_output(tmp_dir: Path, size: int, rng: random.Random) -> Callable[[], Any]:
+    """Decode lines of ANSI command output and print them, as RichImg.run_command() does."""
+    output = ansi_output(size, rng)
+    img = RichImg(command="pytest", console=Console(file=StringIO()))
+    return lambda: img.render_command_output(output)
+
+
+@benchmark("format_snippet", 2000)
+def format_snippet(tmp_dir: Path, size: int, rng: random.Random) -> Callable[[], Any]:
+    """Highlight lines of Python code, as RichImg.format_snippet() does."""
+    img = RichImg(snippet=python_code(size, rng), snippet_syntax="python", console=Console(file=StringIO()))
+    return img.format_snippet
+
+
+@benchmark("save_svg", 500)
+def save_svg(tmp_dir: Path, size: int, rng: random.Random) -> Callable[[], Any]:
+    """Export lines of rendered output to a new SVG, as RichImg.save_images() does."""
+    img = RichImg(command="pytest", img_paths=[str(tmp_dir / "out.svg")], console=Console(file=StringIO()))
+    img.render_command_output(ansi_output(size, rng))
+    return img.save_images
+
+
+@benchmark("image_difference", 50_000)
+def image_difference(tmp_dir: Path, size: int, rng: random.Random) -> Callable[[], Any]:
+    """Compare two large SVGs with a few changed lines, as RichImg._enough_image_difference() does.
+
+    A regex to skip changes is set, so the line diff is timed as well as the change bounds.
+    """
+    old_lines = svg_lines(size, rng)
+    new_lines = list(old_lines)
+    for i in rng.sample(range(size), max(1, size // 1000)):
+        new_lines[i] = f'<text class="r1" x="0" y="{i * 24}">timestamp {rng.random()}</text>'
+    (tmp_dir / "old.svg").write_text("\n".join(old_lines))
+    (tmp_dir / "new.svg").write_text("\n".join(new_lines))
+    img = RichImg(command="pytest", skip_change_regex="timestamp", console=Console(file=StringIO()))
+    return lambda: img._enough_image_difference(str(tmp_dir / "new.svg"), str(tmp_dir / "old.svg"))
+
+
+@benchmark("collapse_duplicates", 10_000)
+def collapse_duplicates(tmp_dir: Path, size: int, rng: random.Random) -> Callable[[], Any]:
+    """Collapse image requests, some exact duplicates and some sharing a command, as CodexSearch does."""
+    cs = codex_search()
+    commands = [f"echo {' '.join(rng.choices(WORDS, k=3))} {i}" for i in range(size // 4)]
+    for _ in range(size):
+        command = rng.choice(commands)
+        cs.rich_imgs.append(
+            RichImg(
+                command=command,
+                img_paths=[str(tmp_dir / f"img_{rng.randint(0, size // 2)}.svg")],
+                head=rng.choice([None, None, 10, 20]),
+                terminal_width=rng.choice([80, 100]),
+            )
+        )
+    return cs.collapse_duplicates
+
+
+def run_benchmark(name: str, size: int, repeats: int) -> float:
+    """Time the fastest of a number of repeats of a benchmark, in seconds."""
+    setup = BENCHMARKS[name][1]
+    cwd = os.getcwd()
+    timings = []
+    for _ in range(repeats):
+        with TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                # Same input every time, from a seed for each benchmark
+                func = setup(Path(tmp_dir).resolve(), size, random.Random(name))
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+            finally:
+                os.chdir(cwd)
+    return min(timings)
+
+
+def load_baseline(path: Path) -> dict[str, dict[str, Any]]:
+    """Read the results saved in a baseline file, or nothing if there isn't one."""
+    try:
+        baseline = json.loads(path.read_text())
+    except FileNotFoundError:
+        return {}
+    if baseline.get("python") != platform.python_version():
+        print(f"Baseline was saved with Python {baseline.get('python')}, this is {platform.python_version()}")
+    return dict(baseline["results"])
+
+
+def save_baseline(path: Path, results: dict[str, dict[str, Any]]) -> None:
+    """Write the results to a baseline file, keeping any benchmarks that weren't run this time."""
+    saved = load_baseline(path) if path.exists() else {}
+    saved.update(results)
+    baseline = {"python": platform.python_version(), "platform": platform.platform(), "results": saved}
+    path.write_text(json.dumps(baseline, indent=2) + "\n")
+    print(f"Saved baseline to {path}")
+
+
+def main() -> None:
+    """Run the benchmarks, print the results and compare them against the baseline."""
+    parser = argparse.ArgumentParser(description="Microbenchmarks of rich-codex's hot paths")
+    parser.add_argument("names", nargs="*", metavar="NAME", help=f"Benchmarks to run: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Baseline file to compare against")
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=20, help="Percent slower than the baseline to flag")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of times to run each benchmark")
+    parser.add_argument("--scale", type=float, default=1, help="Multiply the size of every input by this")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    baseline = load_baseline(args.baseline)
+    table = Table(title=f"Fastest of {args.repeats} runs", title_justify="left")
+    for column in ["Benchmark", "Size", "Time (ms)", "Baseline (ms)", "Change"]:
+        table.add_column(column, justify="left" if column == "Benchmark" else "right")
+    results: dict[str, dict[str, Any]] = {}
+    regressions = []
+    for name in args.names or BENCHMARKS:
+        size = max(1, int(BENCHMARKS[name][0] * args.scale))
+        seconds = run_benchmark(name, size, args.repeats)
+        results[name] = {"size": size, "seconds": seconds}
+        previous = baseline.get(name)
+        if previous is None:
+            table.add_row(name, f"{size:,}", f"{seconds * 1000:.1f}", "-", "-")
+        elif previous["size"] != size:
+            table.add_row(name, f"{size:,}", f"{seconds * 1000:.1f}", f"size {previous['size']:,}", "-")
+        else:
+            change = (seconds / previous["seconds"] - 1) * 100
+            style = ""
+            if change > args.threshold:
+                regressions.append(name)
+                style = "bold red"
+            elif change < -args.threshold:
+                style = "green"
+            change_text = f"[{style}]{change:+.1f}%[/]" if style else f"{change:+.1f}%"
+            table.add_row(name, f"{size:,}", f"{seconds * 1000:.1f}", f"{previous['seconds'] * 1000:.1f}", change_text)
+    Console().print(table)
+
+    if args.save:
+        save_baseline(args.baseline, results)
+    if regressions:
+        print(f"Slower than the baseline by more than {args.threshold:g}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
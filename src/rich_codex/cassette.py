@@ -0,0 +1,168 @@
+"""Cassettes of command output, to render images again without running the commands.
+
+A cassette holds the raw output of each command, keyed by RichImg.exec_key(). Output is
+split into chunks that are compressed on their own, followed by an index of where each
+command's chunks are and a fixed-size footer pointing to the index:
+
+    MAGIC | chunk | chunk | ... | compressed JSON index | index offset, index length, MAGIC
+
+Only the footer and index are read when a cassette is opened. The chunks for a command
+are read and decompressed when it is replayed.
+"""
+
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from rich_codex import __version__
+
+log = logging.getLogger("rich-codex")
+
+MAGIC = b"RCXCASS1"
+FOOTER = struct.Struct(f"!QQ{len(MAGIC)}s")
+# Raw bytes of output in each chunk
+CHUNK_SIZE = 1024 * 1024
+
+
+class CassetteRecorder:
+    """Write command output to a new cassette.
+
+    The cassette is written to a temporary file next to it, and only replaces any
+    existing cassette once it's closed. The temporary file is removed if recording is
+    aborted, or if the cassette can't be closed.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        """Start a new cassette."""
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        self._file: BinaryIO = self._tmp_path.open("wb")
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._pending: dict[str, bytearray] = {}
+        self.records: dict[str, dict[str, Any]] = {}
+
+    def start(self, key: str) -> bool:
+        """Start recording a command, unless its output has already been recorded."""
+        with self._lock:
+            if key in self.records:
+                return False
+            self.records[key] = {"size": 0, "chunks": []}
+            self._pending[key] = bytearray()
+            return True
+
+    def write(self, key: str, data: bytes) -> None:
+        """Add output for a command, writing a chunk whenever there's enough of it."""
+        with self._lock:
+            pending = self._pending[key]
+            pending += data
+            while len(pending) >= CHUNK_SIZE:
+                self._write_chunk(key, pending[:CHUNK_SIZE])
+                del pending[:CHUNK_SIZE]
+
+    def finish(self, key: str) -> None:
+        """Write the last of a command's output."""
+        with self._lock:
+            pending = self._pending.pop(key)
+            if len(pending) > 0:
+                self._write_chunk(key, pending)
+
+    def _write_chunk(self, key: str, data: bytes | bytearray) -> None:
+        compressed = zlib.compress(data)
+        self.records[key]["chunks"].append([self._file.tell(), len(compressed)])
+        self.records[key]["size"] += len(data)
+        self._file.write(compressed)
+
+    def close(self) -> None:
+        """Write the index and footer, and move the cassette into place.
+
+        Commands that didn't finish, for example because rich-codex was interrupted, are left out.
+        """
+        with self._lock:
+            if self._file.closed:
+                return
+            try:
+                for key in self._pending:
+                    del self.records[key]
+                self._pending = {}
+                index = zlib.compress(json.dumps({"version": __version__, "records": self.records}).encode("utf-8"))
+                index_offset = self._file.tell()
+                self._file.write(index)
+                self._file.write(FOOTER.pack(index_offset, len(index), MAGIC))
+                self._file.close()
+                os.replace(self._tmp_path, self.path)
+            finally:
+                self._file.close()
+                self._tmp_path.unlink(missing_ok=True)
+        log.info(f"Recorded the output of {len(self.records)} commands to [magenta]{self.path}[/]")
+
+    def abort(self) -> None:
+        """Stop recording without saving the cassette, leaving any existing one in place."""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.close()
+            self._tmp_path.unlink(missing_ok=True)
+        log.debug(f"Stopped recording to '{self.path}' before the end, nothing was saved")
+
+
+class CassettePlayer:
+    """Read command output from a cassette, one command at a time."""
+
+    def __init__(self, path: str | Path) -> None:
+        """Open a cassette and read its index, raising ValueError if it isn't a complete cassette."""
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        try:
+            self._file: BinaryIO = self.path.open("rb")
+        except OSError as e:
+            raise ValueError(f"Couldn't open cassette '{self.path}': {e}") from e
+        try:
+            if self._file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"'{self.path}' is not a rich-codex cassette")
+            self._file.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, index_length, end_magic = FOOTER.unpack(self._file.read(FOOTER.size))
+            if end_magic != MAGIC:
+                raise ValueError(f"Cassette '{self.path}' is incomplete, was it recorded to the end?")
+            self._file.seek(index_offset)
+            index = json.loads(zlib.decompress(self._file.read(index_length)))
+        except (OSError, struct.error, zlib.error, json.JSONDecodeError) as e:
+            self._file.close()
+            raise ValueError(f"Couldn't read cassette '{self.path}': {e}") from e
+        except ValueError:
+            self._file.close()
+            raise
+        if not isinstance(index, dict) or "version" not in index or "records" not in index:
+            self._file.close()
+            raise ValueError(f"Cassette '{self.path}' has an index that this version of rich-codex can't read")
+        if index["version"] != __version__:
+            # Commands are keyed on their config, which can change between versions
+            log.warning(
+                f"Cassette '{self.path}' was recorded with rich-codex {index['version']}, this is {__version__}. "
+                "Commands that aren't found in it will be run instead."
+            )
+        self.records: dict[str, dict[str, Any]] = index["records"]
+        log.debug(f"Cassette '{self.path}' has the output of {len(self.records)} commands")
+
+    def __contains__(self, key: str) -> bool:
+        """Whether the cassette has output for a command."""
+        return key in self.records
+
+    def read(self, key: str) -> Iterator[bytes]:
+        """Output of a command, one chunk at a time."""
+        for offset, length in self.records[key]["chunks"]:
+            with self._lock:
+                self._file.seek(offset)
+                compressed = self._file.read(length)
+            yield zlib.decompress(compressed)
+
+    def close(self) -> None:
+        """Close the cassette file."""
+        self._file.close()
@@ -1,13 +1,23 @@
 import logging
+from collections.abc import Iterable
 from datetime import datetime
-from os import getenv
-from sys import exit
+from os import environ, getenv
+from pathlib import Path
+from sys import exit, platform
 
-from jsonschema.exceptions import ValidationError
 from rich.console import Console
 from rich.logging import RichHandler
 
-from rich_codex import __version__, codex_search, rich_img, utils
+from rich_codex import (
+    __version__,
+    codex_search,
+    profiling,
+    render_cache,
+    rich_img,
+    search_index,
+    timing_history,
+    utils,
+)
 
 import rich_click as click
 
@@ -16,7 +26,15 @@ click.rich_click.OPTION_GROUPS = {
     "rich-codex": [
         {
             "name": "Inputs",
-            "options": ["--search-include", "--search-exclude", "--no-search", "--configs", "--command", "--snippet"],
+            "options": [
+                "--search-include",
+                "--search-exclude",
+                "--no-search",
+                "--since",
+                "--configs",
+                "--command",
+                "--snippet",
+            ],
         },
         {
             "name": "Outputs",
@@ -31,7 +49,13 @@ click.rich_click.OPTION_GROUPS = {
                 "--after-command",
                 "--extra-env",
                 "--no-dedupe",
+                "--jobs",
+                "--convert-workers",
                 "--use-pty",
+                "--shell-sessions",
+                "--preload",
+                "--record",
+                "--replay",
             ],
         },
         {
@@ -59,11 +83,21 @@ click.rich_click.OPTION_GROUPS = {
         },
         {
             "name": "Updating images",
-            "options": ["--min-pct-diff", "--skip-change-regex", "--skip-git-checks", "--no-confirm"],
+            "options": [
+                "--min-pct-diff",
+                "--skip-change-regex",
+                "--skip-git-checks",
+                "--scoped-git-checks",
+                "--no-confirm",
+            ],
+        },
+        {
+            "name": "Caching",
+            "options": ["--no-cache", "--cache-dir", "--cache-inputs", "--cache-max-size"],
         },
         {
             "name": "Logging",
-            "options": ["--verbose", "--save-log", "--log-file", "--help"],
+            "options": ["--verbose", "--save-log", "--log-file", "--profile", "--help"],
         },
     ]
 }
@@ -71,6 +105,18 @@ click.rich_click.OPTION_GROUPS = {
 log = logging.getLogger()
 
 
+def _check_git_status(skip_git_checks: bool, paths: Iterable[str | Path] | None = None) -> None:
+    """Exit if the git repo has uncommitted changes that could be lost, unless told to skip the checks."""
+    with profiling.span("git checks"):
+        git_status, git_status_msg = utils.check_git_status(paths)
+    if skip_git_checks or git_status:
+        log.debug(f"Git status check: {git_status_msg} (skip_git_checks: {skip_git_checks})")
+    elif not git_status:
+        log.error(f"[bright_red]Error with git:[/] [red]{git_status_msg}")
+        log.info("Please resolve and run again, or use '--skip-git-checks'")
+        exit(1)
+
+
 @click.command()
 @click.option(
     "--search-include",
@@ -91,6 +137,12 @@ log = logging.getLogger()
     show_envvar=True,
     help="Set to disable searching for rich-codex comments",
 )
+@click.option(
+    "--since",
+    envvar="SINCE",
+    show_envvar=True,
+    help="Only generate images from files changed since this git commit, or that depend on changed files",
+)
 @click.option(
     "--command",
     envvar="COMMAND",
@@ -137,6 +189,24 @@ log = logging.getLogger()
     show_envvar=True,
     help="Run duplicate commands separately, instead of once with a shared screenshot",
 )
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    envvar="JOBS",
+    show_envvar=True,
+    show_default=True,
+    help="Number of images to generate in parallel",
+)
+@click.option(
+    "--convert-workers",
+    type=click.IntRange(min=0),
+    default=0,
+    envvar="CONVERT_WORKERS",
+    show_envvar=True,
+    show_default=True,
+    help="Number of processes to convert PNG / PDF images in, while commands run",
+)
 @click.option(
     "--snippet",
     envvar="SNIPPET",
@@ -221,6 +291,13 @@ log = logging.getLogger()
     show_envvar=True,
     help="Skip safety checks for git repos",
 )
+@click.option(
+    "--scoped-git-checks",
+    is_flag=True,
+    envvar="SCOPED_GIT_CHECKS",
+    show_envvar=True,
+    help="Only check git status of the files that are read and written, instead of the whole repo",
+)
 @click.option(
     "--no-confirm",
     is_flag=True,
@@ -285,6 +362,61 @@ log = logging.getLogger()
     show_envvar=True,
     help="Use a pseudo-terminal for commands (may capture coloured output)",
 )
+@click.option(
+    "--shell-sessions",
+    is_flag=True,
+    envvar="SHELL_SESSIONS",
+    show_envvar=True,
+    help="Run commands in long-lived shells, one per working directory and environment",
+)
+@click.option(
+    "--preload",
+    envvar="PRELOAD",
+    show_envvar=True,
+    help="Python tools to import once and run in forks: console script names or 'name=module:function', one per line",
+)
+@click.option(
+    "--record",
+    envvar="RECORD",
+    show_envvar=True,
+    help="Record the output of every command to this cassette file",
+)
+@click.option(
+    "--replay",
+    envvar="REPLAY",
+    show_envvar=True,
+    help="Replay the output of commands from this cassette file, instead of running them",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    envvar="NO_CACHE",
+    show_envvar=True,
+    help="Don't reuse or save renders and search results in the cache",
+)
+@click.option(
+    "--cache-dir",
+    default=render_cache.DEFAULT_CACHE_DIR,
+    envvar="CACHE_DIR",
+    show_envvar=True,
+    show_default=True,
+    help="Directory for the render cache",
+)
+@click.option(
+    "--cache-inputs",
+    envvar="CACHE_INPUTS",
+    show_envvar=True,
+    help="Inputs that commands depend on, needed to cache them: file globs, '$ENV_VARS' or '!commands'",
+)
+@click.option(
+    "--cache-max-size",
+    type=click.FloatRange(min=0),
+    default=500,
+    envvar="CACHE_MAX_SIZE",
+    show_envvar=True,
+    show_default=True,
+    help="Maximum size of the render cache (MB)",
+)
 @click.option(
     "--created-files",
     envvar="CREATED_FILES",
@@ -323,10 +455,18 @@ log = logging.getLogger()
     help="Save a verbose log to a file (specific filename).",
     metavar="FILENAME",
 )
+@click.option(
+    "--profile",
+    envvar="PROFILE",
+    show_envvar=True,
+    help="Time each phase of the run, print a summary and save a Chrome trace to this file",
+    metavar="FILENAME",
+)
 def main(
     search_include: str | None,
     search_exclude: str | None,
     no_search: bool,
+    since: str | None,
     command: str | None,
     timeout: int,
     working_dir: str | None,
@@ -334,6 +474,8 @@ def main(
     after_command: str | None,
     extra_env: str | None,
     no_dedupe: bool,
+    jobs: int,
+    convert_workers: int,
     snippet: str | None,
     snippet_syntax: str | None,
     img_paths: str | None,
@@ -347,6 +489,7 @@ def main(
     trim_after: str | None,
     truncated_text: str,
     skip_git_checks: bool,
+    scoped_git_checks: bool,
     no_confirm: bool,
     min_pct_diff: float,
     skip_change_regex: str | None,
@@ -356,11 +499,20 @@ def main(
     terminal_theme: str | None,
     snippet_theme: str | None,
     use_pty: bool,
+    shell_sessions: bool,
+    preload: str | None,
+    record: str | None,
+    replay: str | None,
+    no_cache: bool,
+    cache_dir: str,
+    cache_inputs: str | None,
+    cache_max_size: float,
     created_files: str | None,
     deleted_files: str | None,
     verbose: bool,
     save_log: bool,
     log_file: str | None,
+    profile: str | None,
 ) -> None:
     """Create rich code images for your docs."""
     # Sensible defaults
@@ -405,14 +557,14 @@ def main(
 
     log.info(f"[bold]rich-codex[/] ⚡️📖⚡️ [dim]version {__version__}[/dim]")
 
-    # Check git status
-    git_status, git_status_msg = utils.check_git_status()
-    if skip_git_checks or git_status:
-        log.debug(f"Git status check: {git_status_msg} (skip_git_checks: {skip_git_checks})")
-    elif not git_status:
-        log.error(f"[bright_red]Error with git:[/] [red]{git_status_msg}")
-        log.info("Please resolve and run again, or use '--skip-git-checks'")
-        exit(1)
+    # Time each phase of the run, from here to the end
+    profiler = profiling.start() if profile else None
+
+    # Check git status, or wait until we know which files are used
+    if scoped_git_checks:
+        log.debug("Checking git status of the files that are used, once they're known")
+    else:
+        _check_git_status(skip_git_checks)
 
     if no_confirm:
         log.debug("Skipping confirmation of commands")
@@ -445,6 +597,67 @@ def main(
             raise click.BadOptionUsage("--extra-env", str(e))
         log.debug(f"Setting extra environment variables for all commands: {parsed_extra_env}")
 
+    # Reuse renders and search results from previous runs
+    img_cache = None
+    file_index = None
+    timings = None
+    if no_cache:
+        log.debug("Caching disabled")
+    else:
+        img_cache = render_cache.RenderCache(cache_dir, cache_inputs, cache_max_size)
+        file_index = search_index.SearchIndex(cache_dir)
+        # Only used to order the images when running several at once
+        if jobs > 1:
+            timings = timing_history.TimingHistory(cache_dir)
+        if not cache_inputs:
+            log.debug("No cache inputs given, so only snippets will be cached")
+        if record:
+            log.info("Not using the render cache when recording, so that every command is run")
+            img_cache = None
+
+    # Run commands in shells that are started once, instead of a new shell for every command
+    sessions = None
+    if shell_sessions and platform == "win32":
+        log.warning("Shell sessions aren't supported on Windows, starting a new shell for each command instead")
+    elif shell_sessions:
+        from rich_codex.shell_session import ShellSessions
+
+        sessions = ShellSessions()
+
+    # Import Python tools once, then run them in forks instead of starting a new interpreter each time
+    preload_server = None
+    if preload and platform == "win32":
+        log.warning("Preloading isn't supported on Windows, running preloaded tools as normal instead")
+    elif preload:
+        from rich_codex.preload import PreloadServer, parse_preload
+
+        try:
+            preload_targets = parse_preload(preload)
+        except ValueError as e:
+            raise click.BadOptionUsage("--preload", str(e))
+        preload_server = PreloadServer(preload_targets, {**environ, "RICH_CODEX": "1"})
+
+    # Record command output to a cassette, or replay it from one
+    record_cassette = None
+    replay_cassette = None
+    if record and replay:
+        raise click.BadOptionUsage("--record", "Please use either --record OR --replay but not both")
+    if replay:
+        from rich_codex.cassette import CassettePlayer
+
+        try:
+            replay_cassette = CassettePlayer(replay)
+        except ValueError as e:
+            raise click.BadOptionUsage("--replay", str(e))
+    if record:
+        from rich_codex.cassette import CassetteRecorder
+
+        record_cassette = CassetteRecorder(record)
+        # Closed at the end of a successful run, otherwise the temporary file is removed
+        ctx = click.get_current_context()
+        assert ctx is not None
+        ctx.call_on_close(record_cassette.abort)
+
     # Check for mutually exclusive options
     if command and snippet:
         raise click.BadOptionUsage("--command", "Please use either --command OR --snippet but not both")
@@ -486,9 +699,15 @@ def main(
             log.info(f"Snippet: [white on black] {log_snippet}... [/]")
             img_obj.snippet = snippet
         img_obj.img_paths = utils.clean_list(img_paths.splitlines()) if img_paths else []
+        img_obj.render_cache = img_cache
+        img_obj.shell_sessions = sessions
+        img_obj.preload_server = preload_server
+        img_obj.record_cassette = record_cassette
+        img_obj.replay_cassette = replay_cassette
+        if scoped_git_checks:
+            _check_git_status(skip_git_checks, img_obj.img_paths)
         if img_obj.confirm_command():
-            img_obj.get_output()
-            img_obj.save_images()
+            img_obj.generate()
             saved_image_paths += img_obj.saved_img_paths
             num_saved_images += img_obj.num_img_saved
             num_skipped_images += img_obj.num_img_skipped
@@ -502,6 +721,15 @@ def main(
         configs=configs,
         no_confirm=no_confirm,
         no_dedupe=no_dedupe,
+        jobs=jobs,
+        convert_workers=convert_workers,
+        render_cache=img_cache,
+        search_index=file_index,
+        shell_sessions=sessions,
+        preload_server=preload_server,
+        record_cassette=record_cassette,
+        replay_cassette=replay_cassette,
+        timing_history=timings,
         extra_env=parsed_extra_env,
         snippet_syntax=snippet_syntax,
         timeout=timeout,
@@ -524,19 +752,42 @@ def main(
         console=console,
         working_dir=working_dir,
     )
+    from jsonschema.exceptions import ValidationError
+
     try:
         codex_obj.parse_configs()
     except ValidationError as e:
         log.critical(e)
         exit(1)
+    changed_files = None
+    if since:
+        try:
+            changed_files = utils.changed_files(since)
+        except ValueError as e:
+            raise click.BadOptionUsage("--since", str(e))
+        log.debug(f"Found {len(changed_files)} files changed since '{since}'")
     if no_search:
         log.info("Skipping file search")
     else:
-        num_errors = codex_obj.search_files()
+        # Only files that could hold images affected by the changes are scanned
+        num_errors = codex_obj.search_files(changed_files)
         if num_errors > 0:
             log.error("Found errors whilst running")
             exit(1)
+    if since:
+        assert changed_files is not None
+        codex_obj.filter_changed(changed_files, since)
     codex_obj.collapse_duplicates()
+    if scoped_git_checks:
+        # Sources that images were found in, the images they write and any images that could be cleaned
+        used_paths: list[str | Path] = []
+        for img in codex_obj.rich_imgs:
+            if img.source is not None:
+                used_paths.append(img.source)
+            used_paths += img.img_paths
+        for pattern in utils.clean_list(clean_img_paths.splitlines()) if clean_img_paths and not since else []:
+            used_paths += Path.cwd().glob(pattern)
+        _check_git_status(skip_git_checks, used_paths)
     codex_obj.confirm_commands()
     codex_obj.check_duplicate_paths()
     codex_obj.save_all_images()
@@ -544,8 +795,27 @@ def main(
     num_saved_images += codex_obj.num_img_saved
     num_skipped_images += codex_obj.num_img_skipped
 
-    # Clean unrecognised images
-    if clean_img_paths:
+    if sessions is not None:
+        sessions.close()
+    if preload_server is not None:
+        preload_server.close()
+    if record_cassette is not None:
+        record_cassette.close()
+    if replay_cassette is not None:
+        replay_cassette.close()
+
+    if timings is not None:
+        timings.save()
+
+    if img_cache is not None:
+        if img_cache.num_hits or img_cache.num_misses:
+            log.debug(f"Render cache: {img_cache.num_hits} hits, {img_cache.num_misses} misses")
+        img_cache.evict()
+
+    # Clean unrecognised images, unless only some images were generated
+    if clean_img_paths and since:
+        log.warning("Not cleaning images with '--since', as only images affected by changes are generated")
+    elif clean_img_paths:
         generated_img_paths = list(img_obj.img_paths) if img_obj else []
         if codex_obj:
             generated_img_paths += [path for img in codex_obj.rich_imgs for path in img.img_paths]
@@ -572,6 +842,12 @@ def main(
     if num_skipped_images == 0 and num_saved_images == 0:
         log.warning("Couldn't find anything to do 🙄")
 
+    if profiler is not None and profile:
+        profiler.finish()
+        profiling.stop()
+        console.print(profiler.summary_table())
+        profiler.save_trace(profile)
+
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,39 @@
+import io
 import logging
+import mmap
+import os
 import re
+from contextlib import ExitStack, nullcontext
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 import yaml
-from jsonschema.exceptions import ValidationError
 from rich import box
 from rich.console import Console
 from rich.prompt import Prompt
 from rich.table import Table
 
-from rich_codex import rich_img
-from rich_codex.utils import clean_list, relative_path, validate_config
+from rich_codex import profiling, rich_img
+from rich_codex.render_cache import RenderCache
+from rich_codex.utils import (
+    CONFIG_SCHEMA,
+    buffered_logs,
+    clean_list,
+    compile_globs,
+    relative_path,
+    replay_logs,
+    validate_config,
+    validate_outputs,
+)
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+    from rich_codex.cassette import CassettePlayer, CassetteRecorder
+    from rich_codex.preload import PreloadServer
+    from rich_codex.search_index import SearchIndex
+    from rich_codex.shell_session import ShellSessions
+    from rich_codex.timing_history import TimingHistory
 
 log = logging.getLogger("rich-codex")
 
@@ -21,10 +43,135 @@ log = logging.getLogger("rich-codex")
 # eg. {/* RICH-CODEX terminal_width: 60 */}
 CONFIG_COMMENT_STYLES = {"<!--": "-->", "{/*": "*/}"}
 
-# Parse the config schema file once, it's the same for every search
-config_schema_fn = Path(__file__).parent / "config-schema.yml"
-with config_schema_fn.open() as fh:
-    CONFIG_SCHEMA = yaml.safe_load(fh)
+# eg. <!-- RICH-CODEX TERMINAL_WIDTH=60 -->
+# eg. <!-- RICH-CODEX
+# eg. {/* RICH-CODEX TERMINAL_WIDTH=60 */}  (MDX files can't use HTML comments)
+CONFIG_COMMENT_RE = re.compile(
+    rf"\s*(?P<comment_start>{'|'.join(re.escape(start) for start in CONFIG_COMMENT_STYLES)})"
+    r"\s*RICH-CODEX\s*(?P<config_str>.*)"
+)
+
+# eg. ![`rich --help`](rich-cli-help.svg)
+IMG_CMD_RE = re.compile(r"\s*!\[`(?P<cmd>[^`]+)`\]\((?P<img_path>.*?)(?=\"|\))(?P<title>[\"'].*[\"'])?\)")
+
+# eg. ![custom text](img/example.svg)
+# eg. ![](img/example-named.svg)
+IMG_SNIPPET_RE = re.compile(r"\s*!\[.*\]\((?P<img_path>.*?)(?=\"|\))(?P<title>[\"'].*[\"'])?\)")
+
+# A file can only define an image with a config comment or a command image, so files
+# without either are skipped without decoding them or looking at each line
+SCAN_MARKERS = (b"RICH-CODEX", b"![`")
+
+# Images can only depend on other files if their config says so. With --since, unchanged
+# files are only scanned if they contain this, in case their images depend on changed files.
+DEPENDS_ON_MARKER = b"depends_on"
+
+# Starting a pool of processes takes longer than scanning a few hundred files
+PARALLEL_SCAN_MIN_FILES = 2000
+
+# Files at least this big are memory-mapped to look for the markers, instead of read into memory
+MMAP_MIN_SIZE = 64 * 1024
+
+
+def scan_file(text: str) -> list[dict[str, Any]]:
+    """Find markdown images and the rich-codex config comments before them, in the text of a file.
+
+    Only depends on the text, so that the results can be kept in the search index and
+    reused until the file changes. Returns what was found, in order of line number:
+
+    - {"line_number", "config", "match"} for an image, with the local config that came
+      before it and the named groups of the image regex
+    - {"line_number", "error", "config_str"} for config YAML that couldn't be parsed
+    """
+    found: list[dict[str, Any]] = []
+    local_config: dict[str, Any] = {}
+    in_config = False
+    comment_end: str | None = None
+    local_config_str = ""
+    # Universal newlines, same as reading the file in text mode
+    for line_number, line in enumerate(io.StringIO(text, newline=None), start=1):
+        # Keep saving config if we're in a config block
+        if in_config:
+            local_config_str += line
+            if comment_end is not None and comment_end in line:
+                in_config = False
+                local_config_str = local_config_str.split(comment_end)[0]
+                continue
+
+        # Parse config yaml
+        if local_config_str != "" and not in_config:
+            try:
+                with profiling.span("parse yaml"):
+                    local_config = yaml.safe_load(local_config_str)
+                if not isinstance(local_config, dict):
+                    raise ValueError("config YAML is not a dictionary")
+            except (yaml.YAMLError, ValueError) as e:
+                found.append({"line_number": line_number, "error": str(e), "config_str": local_config_str})
+                local_config = {}
+            local_config_str = ""
+
+        # Look for images
+        # Both patterns capture 'img_path' and 'title'; only the command one has 'cmd'
+        img_match = IMG_CMD_RE.match(line) or IMG_SNIPPET_RE.match(line)
+        if img_match and not local_config.get("skip"):
+            found.append({"line_number": line_number, "config": local_config, "match": img_match.groupdict()})
+            local_config = {}
+            local_config_str = ""
+            continue
+
+        # Look for a local config
+        config_match = CONFIG_COMMENT_RE.match(line)
+        if config_match:
+            m = config_match.groupdict()
+            comment_end = CONFIG_COMMENT_STYLES[m["comment_start"]]
+
+            # If we don't end the comment on this line, must be a snippet
+            if comment_end not in line:
+                in_config = True
+
+            # Save config
+            local_config_str = m.get("config_str", "").split(comment_end)[0] + "\n"
+
+    return found
+
+
+def has_scan_markers(contents: bytes | mmap.mmap) -> bool:
+    """Check whether the raw contents of a file could define any images."""
+    return any(contents.find(marker) != -1 for marker in SCAN_MARKERS)
+
+
+def mentions_depends_on(path: Path) -> bool:
+    """Check whether the raw contents of a file could give an image 'depends_on' files."""
+    with path.open("rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size == 0:
+            return False
+        if size < MMAP_MIN_SIZE:
+            return fh.read().find(DEPENDS_ON_MARKER) != -1
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped.find(DEPENDS_ON_MARKER) != -1
+
+
+def scan_path(path: Path) -> list[dict[str, Any]]:
+    """Find markdown images and their config in a file, as scan_file() does.
+
+    Files that don't contain any of the SCAN_MARKERS are skipped, as most markdown
+    files don't use rich-codex at all.
+    """
+    with path.open("rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size == 0:
+            return []
+        if size < MMAP_MIN_SIZE:
+            contents = fh.read()
+            if not has_scan_markers(contents):
+                return []
+        else:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if not has_scan_markers(mapped):
+                    return []
+                contents = mapped.read()
+    return scan_file(contents.decode("utf-8"))
 
 
 class CodexSearch:
@@ -41,6 +188,15 @@ class CodexSearch:
         configs: str | None,
         no_confirm: bool,
         no_dedupe: bool,
+        jobs: int,
+        convert_workers: int,
+        render_cache: RenderCache | None,
+        search_index: "SearchIndex | None",
+        shell_sessions: "ShellSessions | None",
+        preload_server: "PreloadServer | None",
+        record_cassette: "CassetteRecorder | None",
+        replay_cassette: "CassettePlayer | None",
+        timing_history: "TimingHistory | None",
         extra_env: dict[str, str] | None,
         snippet_syntax: str | None,
         timeout: int,
@@ -83,6 +239,15 @@ class CodexSearch:
             self.configs.extend(clean_list(configs.splitlines()))
         self.no_confirm = no_confirm
         self.no_dedupe = no_dedupe
+        self.jobs = jobs
+        self.convert_workers = convert_workers
+        self.render_cache = render_cache
+        self.search_index = search_index
+        self.shell_sessions = shell_sessions
+        self.preload_server = preload_server
+        self.record_cassette = record_cassette
+        self.replay_cassette = replay_cassette
+        self.timing_history = timing_history
         self.extra_env = extra_env
         self.snippet_syntax = snippet_syntax
         self.timeout = timeout
@@ -164,157 +329,160 @@ class CodexSearch:
         """Combine two dicts of config values, with keys in 'override' winning."""
         return {**(base or {}), **(override or {})}
 
-    def search_files(self) -> int:
-        """Search through a set of files for codex strings."""
+    def find_files(self) -> list[Path]:
+        """Find the files to search, in a single walk of the working directory.
+
+        Directories that match an exclude pattern are skipped without looking inside,
+        as are directories too deep for any include pattern to match.
+        """
+        include_re = compile_globs(self.search_include)
+        # A trailing slash means everything in a directory, same as .gitignore
+        exclude_re = compile_globs(
+            [pattern + "**" if pattern.endswith("/") else pattern for pattern in self.search_exclude]
+        )
+        if include_re is None:
+            return []
+        max_depth = None
+        if not any("**" in pattern for pattern in self.search_include):
+            max_depth = max(len(Path(pattern).parts) for pattern in self.search_include) - 1
+
         matched_files: set[Path] = set()
-        for pattern in self.search_include:
-            for search_file in Path.cwd().glob(pattern):
-                matched_files.add(search_file.resolve())
-        for pattern in self.search_exclude:
-            if pattern.endswith("/"):
-                pattern += "**/*"
-            try:
-                for exclude_file in Path.cwd().glob(pattern):
-                    matched_files.discard(exclude_file.resolve())
-            except (ValueError, NotImplementedError):
-                pass
-        files_to_search = sorted(matched_files, key=lambda x: str(x).lower())
-        if len(files_to_search) == 0:
+        cwd = Path.cwd()
+        for root, dir_names, file_names in os.walk(cwd):
+            rel_root = Path(root).relative_to(cwd)
+            prefix = "" if rel_root == Path(".") else f"{rel_root.as_posix()}/"
+            if max_depth is not None and len(rel_root.parts) >= max_depth:
+                dir_names.clear()
+            elif exclude_re is not None:
+                dir_names[:] = [name for name in dir_names if not exclude_re.fullmatch(prefix + name)]
+            for file_name in file_names:
+                rel_path = prefix + file_name
+                if include_re.fullmatch(rel_path) and (exclude_re is None or not exclude_re.fullmatch(rel_path)):
+                    matched_files.add(Path(root, file_name).resolve())
+        return sorted(matched_files, key=lambda x: str(x).lower())
+
+    def search_files(self, changed_files: set[Path] | None = None) -> int:
+        """Search through a set of files for codex strings.
+
+        Given the files changed since a commit, for --since, only the files that have
+        changed or that give images 'depends_on' files are scanned, as images in other
+        files are dropped by filter_changed() anyway. Every file is scanned if a config
+        file has changed.
+        """
+        with profiling.span("find files"):
+            files_to_search = self.find_files()
+        files_to_scan = files_to_search
+        if changed_files is not None and not self.configs_changed(changed_files):
+            changed_files = {path.resolve() for path in changed_files}
+            with profiling.span("find changed files"):
+                files_to_scan = [file for file in files_to_search if file in changed_files or mentions_depends_on(file)]
+        if len(files_to_scan) == 0:
             log.debug("No files found to search")
+        elif len(files_to_scan) < len(files_to_search):
+            log.info(f"Searching {len(files_to_scan)} of {len(files_to_search)} files, skipping unchanged files")
         else:
-            log.info(f"Searching {len(files_to_search)} files")
-
-        # eg. <!-- RICH-CODEX TERMINAL_WIDTH=60 -->
-        # eg. <!-- RICH-CODEX
-        # eg. {/* RICH-CODEX TERMINAL_WIDTH=60 */}  (MDX files can't use HTML comments)
-        comment_starts = "|".join(re.escape(start) for start in CONFIG_COMMENT_STYLES)
-        config_comment_re = re.compile(rf"\s*(?P<comment_start>{comment_starts})\s*RICH-CODEX\s*(?P<config_str>.*)")
+            log.info(f"Searching {len(files_to_scan)} files")
 
-        # eg. ![`rich --help`](rich-cli-help.svg)
-        img_cmd_re = re.compile(r"\s*!\[`(?P<cmd>[^`]+)`\]\((?P<img_path>.*?)(?=\"|\))(?P<title>[\"'].*[\"'])?\)")
-
-        # eg. ![custom text](img/example.svg)
-        # eg. ![](img/example-named.svg)
-        img_snippet_re = re.compile(r"\s*!\[.*\]\((?P<img_path>.*?)(?=\"|\))(?P<title>[\"'].*[\"'])?\)")
-        local_config: dict[str, Any] = {}
         num_errors = 0
         num_commands = 0
         num_snippets = 0
-        for file in files_to_search:
+        # Config, filename, line number and log message for each image, to validate all at once.
+        # Config YAML that couldn't be parsed has no config and an error message instead, so that
+        # errors are reported in the order of the files and lines, along with validation errors.
+        found_imgs: list[tuple[dict[str, Any] | None, Path, int, str]] = []
+        # Config block that couldn't be parsed, by index in found_imgs
+        parse_error_blocks: dict[int, str] = {}
+        with profiling.span("scan files"):
+            scanned = self._scan_files(files_to_scan)
+        for file, found in zip(files_to_scan, scanned):
             file_rel_fn = file.relative_to(self.cwd)
             log.debug(f"Searching: [magenta]{file_rel_fn}[/]")
-            with open(file) as fh:
-                line_number = 0
-                in_config = False
-                comment_end: str | None = None
-                local_config_str = ""
-                for line in fh:
-                    line_number += 1
-
-                    # Keep saving config if we're in a config block
-                    if in_config:
-                        local_config_str += line
-                        if comment_end is not None and comment_end in line:
-                            in_config = False
-                            local_config_str = local_config_str.split(comment_end)[0]
-                            continue
-
-                    # Parse +  validate config yaml
-                    if local_config_str != "" and not in_config:
-                        try:
-                            local_config = yaml.safe_load(local_config_str)
-                            if not isinstance(local_config, dict):
-                                raise ValueError("config YAML is not a dictionary")
-                        except (yaml.YAMLError, ValueError) as e:
-                            log.error(f"[red][✗] Error parsing config YAML in '{file_rel_fn}' line {line_number}: {e}")
-                            log.debug(f"Config block:\n{local_config_str}")
-                            local_config = {}
-                            num_errors += 1
-                        local_config_str = ""
-
-                    # Look for images
-                    # Both patterns capture 'img_path' and 'title'; only the command one has 'cmd'
-                    img_cmd_match = img_cmd_re.match(line)
-                    img_match = img_cmd_match or img_snippet_re.match(line)
-                    if img_match and not local_config.get("skip"):
-                        # Logging string of original local config
-                        local_config_logmsg = f" with config: {local_config}" if len(local_config) > 0 else ""
-
-                        m = img_match.groupdict()
-
-                        # Get the command and title from a command regex match
-                        if img_cmd_match:
-                            local_config["command"] = m["cmd"]
-                            # Save the title if set
-                            if m["title"]:
-                                local_config["title"] = m["title"].strip("'\" ")
-
-                        # Counters for commands / snippets
-                        if "command" in local_config:
-                            num_commands += 1
-                            img_type = "[blue]command[/]"
-                        elif local_config.get("snippet", "") != "":
-                            num_snippets += 1
-                            img_type = "[red]snippet[/]"
-                        # Just a regular image with no command / snippet - carry on
-                        else:
-                            log.debug(f"[dim]Skipped markdown image, line {line_number}: {m}")
-                            if len(local_config) > 0:
-                                log.warning(f"Skipped image but local_config was not empty: {local_config}")
-                            local_config = {}
-                            local_config_str = ""
-                            continue
-
-                        # Set the image path (append in case any others were in the config)
-                        img_path = Path(file).parent / Path(m["img_path"].strip())
-                        local_config["img_paths"] = local_config.get("img_paths", []) + [str(img_path.resolve())]
-
-                        # Set other config defaults if not supplied
-                        local_config["working_dir"] = local_config.get("working_dir", str(Path(file).parent))
-                        local_config["source_type"] = local_config.get("source_type", "search")
-                        local_config["source"] = local_config.get("source", str(file))
-                        local_config["source_line"] = line_number
-
-                        local_config = self._merge_local_class_attrs(local_config)
-
-                        # Validate the config we have via the schema
-                        try:
-                            validate_config(self.config_schema, {"outputs": [local_config]}, file_rel_fn, line_number)
-                        except ValidationError as e:
-                            log.error(e)
-                            local_config_str = ""
-                            local_config = {}
-                            num_errors += 1
-                            continue
-
-                        quote = "'" if local_config.get("command") else ""
-                        log.debug(
-                            f"Found markdown {img_type}, line {line_number}: "
-                            f"{quote}{local_config.get('command', '')}{quote}{local_config_logmsg}"
-                        )
-                        img_obj = rich_img.RichImg(**local_config)
-
-                        # Save the image object
-                        self.rich_imgs.append(img_obj)
-
-                        # Clear local config
-                        local_config = {}
-                        local_config_str = ""
-
-                        continue
-
-                    # Look for a local config
-                    config_match = config_comment_re.match(line)
-                    if config_match:
-                        m = config_match.groupdict()
-                        comment_end = CONFIG_COMMENT_STYLES[m["comment_start"]]
-
-                        # If we don't end the comment on this line, must be a snippet
-                        if comment_end not in line:
-                            in_config = True
-
-                        # Save config
-                        local_config_str = m.get("config_str", "").split(comment_end)[0] + "\n"
+            for item in found:
+                line_number = item["line_number"]
+                if "error" in item:
+                    error_msg = (
+                        f"[red][✗] Error parsing config YAML in '{file_rel_fn}' line {line_number}: {item['error']}"
+                    )
+                    parse_error_blocks[len(found_imgs)] = item["config_str"]
+                    found_imgs.append((None, file_rel_fn, line_number, error_msg))
+                    continue
+
+                local_config = dict(item["config"])
+                m = item["match"]
+
+                # Logging string of original local config
+                local_config_logmsg = f" with config: {local_config}" if len(local_config) > 0 else ""
+
+                # Get the command and title from a command regex match
+                if m.get("cmd"):
+                    local_config["command"] = m["cmd"]
+                    # Save the title if set
+                    if m["title"]:
+                        local_config["title"] = m["title"].strip("'\" ")
+
+                # Counters for commands / snippets
+                if "command" in local_config:
+                    num_commands += 1
+                    img_type = "[blue]command[/]"
+                elif local_config.get("snippet", "") != "":
+                    num_snippets += 1
+                    img_type = "[red]snippet[/]"
+                # Just a regular image with no command / snippet - carry on
+                else:
+                    log.debug(f"[dim]Skipped markdown image, line {line_number}: {m}")
+                    if len(local_config) > 0:
+                        log.warning(f"Skipped image but local_config was not empty: {local_config}")
+                    continue
+
+                # Set the image path (append in case any others were in the config)
+                img_path = Path(file).parent / Path(m["img_path"].strip())
+                local_config["img_paths"] = local_config.get("img_paths", []) + [str(img_path.resolve())]
+
+                # Set other config defaults if not supplied
+                local_config["working_dir"] = local_config.get("working_dir", str(Path(file).parent))
+                local_config["source_type"] = local_config.get("source_type", "search")
+                local_config["source"] = local_config.get("source", str(file))
+                local_config["source_line"] = line_number
+
+                local_config = self._merge_local_class_attrs(local_config)
+
+                quote = "'" if local_config.get("command") else ""
+                found_msg = (
+                    f"Found markdown {img_type}, line {line_number}: "
+                    f"{quote}{local_config.get('command', '')}{quote}{local_config_logmsg}"
+                )
+                found_imgs.append((local_config, file_rel_fn, line_number, found_msg))
+
+        # Validate the config we have via the schema, for every image in one go
+        with profiling.span("validate"):
+            validation_errors = iter(
+                validate_outputs(
+                    self.config_schema,
+                    [
+                        (img_config, img_file, img_line)
+                        for img_config, img_file, img_line, _ in found_imgs
+                        if img_config is not None
+                    ],
+                )
+            )
+        for idx, (img_config, _, _, found_msg) in enumerate(found_imgs):
+            if img_config is None:
+                log.error(found_msg)
+                log.debug(f"Config block:\n{parse_error_blocks[idx]}")
+                num_errors += 1
+                continue
+            validation_error = next(validation_errors)
+            if validation_error is not None:
+                log.error(validation_error)
+                num_errors += 1
+                continue
+            log.debug(found_msg)
+
+            # Save the image object
+            self.rich_imgs.append(rich_img.RichImg(**img_config))
+
+        if self.search_index is not None:
+            self.search_index.save(files_to_search)
 
         if num_commands > 0:
             log.info(f"Search: Found {num_commands} commands")
@@ -322,6 +490,32 @@ class CodexSearch:
             log.info(f"Search: Found {num_snippets} snippets")
         return num_errors
 
+    def _scan_files(self, files_to_search: list[Path]) -> list[list[dict[str, Any]]]:
+        """Scan each file for images, in order.
+
+        With more than one job and enough files to make it worthwhile, the files are
+        scanned in a pool of processes. Results come back in the same order as the
+        files, so the images found are the same as for a serial search.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Scanning is CPU-bound, so more processes than CPUs don't help
+        workers = min(self.jobs, os.cpu_count() or 1)
+        if workers <= 1 or len(files_to_search) < PARALLEL_SCAN_MIN_FILES:
+            if self.search_index is not None:
+                return self.search_index.scan_all(files_to_search)
+            return [scan_path(file) for file in files_to_search]
+
+        log.debug(f"Scanning {len(files_to_search)} files with {workers} processes")
+        # A few chunks per process, to spread the work evenly without sending every file separately
+        chunksize = max(1, len(files_to_search) // (workers * 4))
+        # Spawned, as for the convert pool, since forking a process that's running threads can deadlock
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            if self.search_index is not None:
+                return self.search_index.scan_all(files_to_search, pool, chunksize)
+            return list(pool.map(scan_path, files_to_search, chunksize=chunksize))
+
     def parse_configs(self) -> None:
         """Loop through rich-codex config files to send for parsing."""
         configs: list[Path] = []
@@ -336,13 +530,15 @@ class CodexSearch:
         if len(configs) > 0:
             log.info(f"Found {len(configs)} config file{'s' if len(configs) > 1 else ''}")
         for config in configs:
-            with config.open() as fh:
+            with config.open() as fh, profiling.span("parse yaml", str(config)):
                 # An empty config file is valid, it just doesn't configure anything
-                self.parse_config(config, yaml.safe_load(fh) or {})
+                parsed = yaml.safe_load(fh) or {}
+            self.parse_config(config, parsed)
 
     def parse_config(self, config_fn: Path, config: dict[str, Any]) -> None:
         """Parse a single rich-codex config file."""
-        validate_config(self.config_schema, config, config_fn)
+        with profiling.span("validate", str(config_fn)):
+            validate_config(self.config_schema, config, config_fn)
 
         # Overwrite class-level configs
         for cls in self.class_config_attrs:
@@ -365,6 +561,37 @@ class CodexSearch:
             local_config = self._merge_local_class_attrs(output)
             self.rich_imgs.append(rich_img.RichImg(**local_config))
 
+    def configs_changed(self, changed_files: set[Path]) -> bool:
+        """Whether any of the rich-codex config files are among the changed files."""
+        changed_files = {path.resolve() for path in changed_files}
+        return any(Path(config_fn).resolve() in changed_files for config_fn in self.configs if Path(config_fn).exists())
+
+    def filter_changed(self, changed_files: set[Path], since: str) -> None:
+        """Only keep the images that changes since a commit could have affected.
+
+        That's images whose source file or any of whose 'depends_on' files have changed.
+        A changed config file can change any image, so then they're all kept.
+        """
+        changed_files = {path.resolve() for path in changed_files}
+        if self.configs_changed(changed_files):
+            log.info(f"Config files have changed since '{since}', keeping all images")
+            return
+        kept_imgs = []
+        for img_obj in self.rich_imgs:
+            affected = img_obj.source is not None and img_obj.source.resolve() in changed_files
+            if not affected:
+                affected = any(
+                    path.resolve() in changed_files
+                    for pattern in img_obj.depends_on
+                    for path in img_obj.dependency_files(pattern)
+                )
+            if affected:
+                kept_imgs.append(img_obj)
+            else:
+                log.debug(f"[dim]Skipping '{img_obj.command or 'snippet'}', unchanged since '{since}'")
+        log.info(f"Generating {len(kept_imgs)} of {len(self.rich_imgs)} images, affected by changes since '{since}'")
+        self.rich_imgs = kept_imgs
+
     def collapse_duplicates(self) -> None:
         """Collapse duplicate commands."""
         # Remove exact duplicates - identical requests would only overwrite one another
@@ -387,6 +614,22 @@ class CodexSearch:
         log.debug(f"Collapsing {len(self.rich_imgs)} image requests to {len(merged_imgs)} deduplicated")
         self.rich_imgs = list(merged_imgs.values())
 
+        # Images of the same command that only differ in how the output is shown share one run of it
+        exec_groups: dict[int, list[rich_img.RichImg]] = {}
+        for ri in self.rich_imgs:
+            if ri.command is not None:
+                exec_groups.setdefault(ri._hash_exec(), []).append(ri)
+        shared_groups = [group for group in exec_groups.values() if len(group) > 1]
+        for group in shared_groups:
+            shared_capture = rich_img.SharedCapture()
+            for ri in group:
+                ri.shared_capture = shared_capture
+                # Each image can show different lines, so all of the output is kept
+                ri.stream_output = False
+        if len(shared_groups) > 0:
+            num_shared = sum(len(group) for group in shared_groups)
+            log.debug(f"Running {len(shared_groups)} commands once each for {num_shared} images")
+
     def _relative_path(self, path: str | Path | None) -> str:
         """Path relative to the working directory, if it's inside it."""
         return relative_path(path, self.cwd)
@@ -455,10 +698,154 @@ class CodexSearch:
                 log.warning(f"Duplicate output file path '{img_path_rel}' found in '{src_paths}'")
 
     def save_all_images(self) -> None:
-        """Save the images that we have collected."""
+        """Save the images that we have collected.
+
+        With more than one job, commands are run concurrently on an asyncio event loop.
+        Each image is rendered in a pool of threads as soon as its command has finished,
+        while other commands are still running. With convert workers, PNG and PDF
+        conversions also run in a pool of processes. Counters, saved paths and log messages
+        are merged back in the original order, so that the results are the same as for a
+        serial run.
+        """
+        import asyncio
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
         for img_obj in self.rich_imgs:
-            img_obj.get_output()
-            img_obj.save_images()
-            self.saved_img_paths += img_obj.saved_img_paths
-            self.num_img_saved += img_obj.num_img_saved
-            self.num_img_skipped += img_obj.num_img_skipped
+            img_obj.render_cache = self.render_cache
+            img_obj.shell_sessions = self.shell_sessions
+            img_obj.preload_server = self.preload_server
+            img_obj.record_cassette = self.record_cassette
+            img_obj.replay_cassette = self.replay_cassette
+
+        converts = self.convert_workers > 0 and any(
+            Path(img_path).suffix.lower() in [".png", ".pdf"]
+            for img_obj in self.rich_imgs
+            for img_path in img_obj.img_paths
+        )
+        if (self.jobs <= 1 and not converts) or len(self.rich_imgs) <= 1:
+            for img_obj in self.rich_imgs:
+                img_obj.generate()
+                self._add_image_totals(img_obj)
+                if self.timing_history is not None:
+                    self.timing_history.record(img_obj)
+            return
+
+        log.debug(
+            f"Generating {len(self.rich_imgs)} images with {self.jobs} parallel jobs"
+            + (f" and {self.convert_workers} convert workers" if converts else "")
+        )
+        log_records: list[list[logging.LogRecord]] = [[] for _ in self.rich_imgs]
+
+        # Images already in the render cache don't need running or rendering
+        to_render: list[bool] = []
+        for img_obj, records in zip(self.rich_imgs, log_records):
+            with buffered_logs(records):
+                to_render.append(img_obj.render_cache is None or not img_obj.render_cache.restore(img_obj))
+
+        with ExitStack() as stack:
+            if converts:
+                # Spawned, as forking a process that's running threads can deadlock
+                convert_pool = ProcessPoolExecutor(
+                    self.convert_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                stack.enter_context(convert_pool)
+                for img_obj in self.rich_imgs:
+                    img_obj.convert_pool = convert_pool
+            # Enough threads to keep every convert worker busy, as each one waits for its conversion
+            pool = stack.enter_context(ThreadPoolExecutor(max_workers=max(self.jobs, self.convert_workers)))
+            futures = asyncio.run(
+                self._capture_and_save(
+                    pool,
+                    [
+                        (img_obj, records) if render else None
+                        for img_obj, records, render in zip(self.rich_imgs, log_records, to_render)
+                    ],
+                )
+            )
+            for img_obj, future, records in zip(self.rich_imgs, futures, log_records):
+                # Wait for each job in turn, logging whatever it said before any exception is raised
+                exception = future.exception() if future is not None else None
+                replay_logs(records)
+                if exception is not None:
+                    raise exception
+                self._add_image_totals(img_obj)
+                if self.timing_history is not None:
+                    self.timing_history.record(img_obj)
+
+    async def _capture_and_save(
+        self,
+        pool: "ThreadPoolExecutor",
+        jobs: list[tuple[rich_img.RichImg, list[logging.LogRecord]] | None],
+    ) -> list["Future[None] | None"]:
+        """Run commands at the same time, up to the maximum number of jobs, saving each image once it's done."""
+        import asyncio
+
+        limit = asyncio.Semaphore(self.jobs)
+
+        # Images sharing a capture wait for each other, so that only the first runs the command
+        shared_locks: dict[int, asyncio.Lock] = {}
+
+        async def capture_and_save(img_obj: rich_img.RichImg, records: list[logging.LogRecord]) -> "Future[None]":
+            if img_obj.command is not None:
+                shared_lock = (
+                    shared_locks.setdefault(id(img_obj.shared_capture), asyncio.Lock())
+                    if img_obj.shared_capture is not None
+                    else nullcontext()
+                )
+                async with shared_lock, limit:
+                    # Each task has its own context, so its logs are held back separately
+                    with buffered_logs(records):
+                        await img_obj.capture_command()
+            return pool.submit(self._save_image_buffered, img_obj, records)
+
+        async def no_job() -> None:
+            return None
+
+        # Tasks start in the order they're made, but results are gathered in the original order
+        tasks: list[asyncio.Future[Future[None] | None] | None] = [None] * len(jobs)
+        for idx in self.schedule([job[0] if job is not None else None for job in jobs]):
+            job = jobs[idx]
+            tasks[idx] = asyncio.ensure_future(capture_and_save(*job) if job is not None else no_job())
+        return await asyncio.gather(*(task for task in tasks if task is not None))
+
+    def schedule(self, imgs: list[rich_img.RichImg | None]) -> list[int]:
+        """Order to start images in, slowest first according to the timing history.
+
+        With several jobs, a slow command started last would be left running on its own at
+        the end. Commands with no history come first, as they could be the slowest, then
+        the rest longest first. Snippets and images that don't need rendering come last, to
+        fill the gaps, as they don't wait for a job.
+        """
+        if self.timing_history is None:
+            return list(range(len(imgs)))
+        history = self.timing_history
+
+        def priority(idx: int) -> tuple[int, float]:
+            img_obj = imgs[idx]
+            if img_obj is None or img_obj.command is None:
+                return (2, 0.0)
+            predicted = history.predict(img_obj)
+            return (0, 0.0) if predicted is None else (1, -predicted)
+
+        order = sorted(range(len(imgs)), key=priority)
+        if order != list(range(len(imgs))):
+            log.debug("Starting the slowest images first, from the timing history")
+        return order
+
+    @staticmethod
+    def _save_image(img_obj: rich_img.RichImg) -> None:
+        """Render the output for one image and save it."""
+        img_obj.get_output()
+        img_obj.save_images()
+
+    def _save_image_buffered(self, img_obj: rich_img.RichImg, records: list[logging.LogRecord]) -> None:
+        """Save one image, holding back its log messages so that they can be replayed in order."""
+        with buffered_logs(records):
+            self._save_image(img_obj)
+
+    def _add_image_totals(self, img_obj: rich_img.RichImg) -> None:
+        """Add the results for one image to the running totals."""
+        self.saved_img_paths += img_obj.saved_img_paths
+        self.num_img_saved += img_obj.num_img_saved
+        self.num_img_skipped += img_obj.num_img_skipped
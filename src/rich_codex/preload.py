@@ -0,0 +1,238 @@
+"""Fork server, to run Python command-line tools without starting a new interpreter each time.
+
+The server is a Python process that imports each preloaded tool once. Every command for
+one of these tools is then run in a fork of the server, with file descriptors passed from
+rich-codex for its input and output, so that it's wired up just like a normal process.
+"""
+
+import importlib
+import json
+import logging
+import os
+import re
+import shlex
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import traceback
+from collections.abc import Callable
+from pathlib import Path
+from shutil import which
+from typing import Any
+
+log = logging.getLogger("rich-codex")
+
+# Commands using any of these need a shell, so are always run in one
+SHELL_CHARS = set("|&;<>()$`\\*?[]{}~#\n")
+
+# 'name' for a console script, or 'name=module:function'
+PRELOAD_PATTERN = re.compile(r"^(?P<name>[^\s=]+)(?:\s*=\s*(?P<target>[\w.]+:[\w.]+))?$")
+
+HEADER = struct.Struct("!I")
+
+SERVER_CODE = "from rich_codex.preload import main; main()"
+
+
+def parse_preload(preload: str) -> dict[str, str | None]:
+    """Parse the tools to preload, one per line, into names and their 'module:function' targets.
+
+    Names without a target are looked up in the console scripts of installed packages.
+    """
+    targets: dict[str, str | None] = {}
+    for line in preload.splitlines():
+        line = line.strip()
+        if line == "":
+            continue
+        match = PRELOAD_PATTERN.match(line)
+        if match is None:
+            raise ValueError(f"Can't preload '{line}': use 'name' for a console script or 'name=module:function'")
+        targets[match["name"]] = match["target"]
+    return targets
+
+
+def send_message(sock: socket.socket, message: dict[str, Any], fds: list[int] | None = None) -> None:
+    """Send a JSON message with a length header, and any file descriptors along with it."""
+    payload = json.dumps(message).encode("utf-8")
+    data = HEADER.pack(len(payload)) + payload
+    if fds:
+        socket.send_fds(sock, [data], fds)
+    else:
+        sock.sendall(data)
+
+
+def recv_message(sock: socket.socket) -> tuple[dict[str, Any], list[int]]:
+    """Receive a message sent by send_message(), raising EOFError if the other end has closed."""
+    header, fds, _, _ = socket.recv_fds(sock, HEADER.size, 3)
+    while 0 < len(header) < HEADER.size:
+        header += sock.recv(HEADER.size - len(header))
+    if len(header) == 0:
+        raise EOFError("Connection closed")
+    (length,) = HEADER.unpack(header)
+    payload = b""
+    while len(payload) < length:
+        chunk = sock.recv(length - len(payload))
+        if not chunk:
+            raise EOFError("Connection closed")
+        payload += chunk
+    return json.loads(payload), fds
+
+
+class PreloadServer:
+    """Client for a fork server that has imported the preloaded tools.
+
+    Only commands that start with a preloaded tool and don't need a shell are run in the
+    server. Everything else is run as normal.
+    """
+
+    def __init__(self, targets: dict[str, str | None], env: dict[str, str]) -> None:
+        """Start the server and wait for it to import the tools."""
+        self._sock, server_sock = socket.socketpair()
+        self._lock = threading.Lock()
+        self.process = subprocess.Popen(
+            # Not run with -m, which tools like Click would see and show in their usage
+            [sys.executable, "-c", SERVER_CODE, str(server_sock.fileno()), json.dumps(targets)],
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            pass_fds=[server_sock.fileno()],
+        )
+        server_sock.close()
+        try:
+            ready, _ = recv_message(self._sock)
+        except EOFError:
+            ready = {"loaded": [], "errors": {name: "preload server failed to start" for name in targets}}
+        for name, error in ready["errors"].items():
+            log.warning(f"Couldn't preload '{name}', running it as normal: {error}")
+        self.names = set(ready["loaded"])
+        log.debug(f"Preloaded {', '.join(sorted(self.names)) or 'nothing'}")
+
+    def preload_argv(self, command: str) -> list[str] | None:
+        """Split a command into arguments if it can run in the server, otherwise return None."""
+        if any(char in SHELL_CHARS for char in command):
+            return None
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            return None
+        return argv if len(argv) > 0 and argv[0] in self.names else None
+
+    def spawn(self, argv: list[str], cwd: Path, env: dict[str, str], fds: tuple[int, int, int]) -> int:
+        """Run a preloaded tool in a fork of the server, with the given stdin, stdout and stderr.
+
+        Returns the process ID of the fork, which leads its own process group. Raises
+        OSError if the server can't be reached.
+        """
+        with self._lock:
+            try:
+                send_message(self._sock, {"argv": argv, "cwd": str(cwd), "env": env}, list(fds))
+                reply, _ = recv_message(self._sock)
+            except EOFError as e:
+                raise OSError("Preload server has stopped") from e
+        if "error" in reply:
+            raise OSError(reply["error"])
+        return int(reply["pid"])
+
+    def close(self) -> None:
+        """Stop the server. Commands that are still running carry on."""
+        self._sock.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def load_target(name: str, target: str | None) -> Callable[[], Any]:
+    """Import a tool and return the function to call, like a console script does."""
+    if target is None:
+        from importlib.metadata import entry_points
+
+        scripts = entry_points(group="console_scripts", name=name)
+        if len(scripts) == 0:
+            raise LookupError(f"no console script called '{name}' is installed")
+        return next(iter(scripts)).load()
+    module_name, _, attrs = target.partition(":")
+    obj: Any = importlib.import_module(module_name)
+    for attr in attrs.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def run_child(func: Callable[[], Any], request: dict[str, Any], fds: list[int]) -> None:
+    """Set up a fork to look like a new process running the tool, then run it and exit."""
+    exit_code = 1
+    try:
+        os.setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for target_fd, fd in enumerate(fds):
+            os.dup2(fd, target_fd)
+        for fd in set(fds):
+            if fd > 2:
+                os.close(fd)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        # Same buffering as a new interpreter: stdout is only line-buffered for a terminal
+        sys.stdin = open(0, closefd=False)
+        sys.stdout = open(1, "w", closefd=False)
+        sys.stderr = open(2, "w", buffering=1, errors="backslashreplace", closefd=False)
+        script = request["argv"][0]
+        sys.argv = [which(script, path=request["env"].get("PATH")) or script, *request["argv"][1:]]
+        try:
+            # As a console script would run it
+            sys.exit(func())
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                exit_code = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(exit_code)
+
+
+def serve(sock: socket.socket, targets: dict[str, str | None]) -> None:
+    """Import the tools, then fork a process to run each command sent until the socket is closed."""
+    # Forks are never waited for, so stop them becoming zombies
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    loaded = {}
+    errors = {}
+    for name, target in targets.items():
+        try:
+            loaded[name] = load_target(name, target)
+        except Exception as e:
+            errors[name] = f"{type(e).__name__}: {e}"
+    send_message(sock, {"loaded": list(loaded), "errors": errors})
+
+    while True:
+        try:
+            request, fds = recv_message(sock)
+        except EOFError:
+            break
+        try:
+            pid = os.fork()
+        except OSError as e:
+            send_message(sock, {"error": str(e)})
+        else:
+            if pid == 0:
+                sock.close()
+                run_child(loaded[request["argv"][0]], request, fds)
+            send_message(sock, {"pid": pid})
+        for fd in fds:
+            os.close(fd)
+
+
+def main() -> None:
+    """Run the server, as started by PreloadServer."""
+    # Tools are imported as they would be by a console script, not from the working directory
+    sys.path[0] = os.path.dirname(sys.executable)
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    serve(sock, json.loads(sys.argv[2]))
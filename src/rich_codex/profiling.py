@@ -0,0 +1,152 @@
+"""Spans of time spent in each phase of a run, for --profile.
+
+Code marks a phase with `with profiling.span("name"):`. When profiling is off, that's a
+global lookup and a shared null context manager, so spans are left in place everywhere.
+When it's on, each span is saved with the thread or asyncio task that it ran in, and
+can be exported as a Chrome trace, to open in Perfetto (https://ui.perfetto.dev) or
+chrome://tracing.
+
+Work done in other processes, by --convert-workers or a parallel search, is shown as
+the time spent waiting for it.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from rich.table import Table
+
+log = logging.getLogger("rich-codex")
+
+_profiler: "Profiler | None" = None
+_NO_SPAN: AbstractContextManager[None] = nullcontext()
+
+
+def span(name: str, detail: str | None = None) -> AbstractContextManager[None]:
+    """Time a phase of the run, if profiling is on, with an optional detail such as a command or filename."""
+    if _profiler is None:
+        return _NO_SPAN
+    return _profiler.span(name, detail)
+
+
+def start() -> "Profiler":
+    """Turn on profiling for the rest of the run."""
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def stop() -> None:
+    """Turn off profiling, keeping any spans recorded so far in the profiler."""
+    global _profiler
+    _profiler = None
+
+
+class Profiler:
+    """Spans recorded while profiling is on, as (name, detail, track, start, end) with times in seconds."""
+
+    def __init__(self) -> None:
+        """Start the clock."""
+        self.start_time = time.perf_counter()
+        self.end_time: float | None = None
+        self.spans: list[tuple[str, str | None, int, float, float]] = []
+        # Thread and asyncio task IDs, and their names, by track number
+        self._tracks: dict[tuple[str, int], int] = {}
+        self.track_names: list[str] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, detail: str | None = None) -> Iterator[None]:
+        """Save how long the body takes, on the track for the current thread or asyncio task."""
+        track = self._track()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, detail, track, start, time.perf_counter()))
+
+    def _track(self) -> int:
+        """Get the track for the current asyncio task, or the current thread outside of one."""
+        task = None
+        # Only look for a task if asyncio has been imported by something else
+        asyncio = sys.modules.get("asyncio")
+        if asyncio is not None:
+            try:
+                task = asyncio.current_task()
+            except RuntimeError:
+                pass
+        key = ("task", id(task)) if task is not None else ("thread", threading.get_ident())
+        with self._lock:
+            track = self._tracks.get(key)
+            if track is None:
+                track = len(self.track_names)
+                self._tracks[key] = track
+                self.track_names.append(task.get_name() if task is not None else threading.current_thread().name)
+            return track
+
+    def finish(self) -> None:
+        """Stop the clock for the whole run."""
+        self.end_time = time.perf_counter()
+
+    def summary(self) -> list[tuple[str, int, float, float]]:
+        """Count the spans and add up the total and longest seconds for each phase, slowest first."""
+        totals: dict[str, tuple[int, float, float]] = {}
+        for name, _, _, start, end in self.spans:
+            count, total, longest = totals.get(name, (0, 0.0, 0.0))
+            totals[name] = (count + 1, total + end - start, max(longest, end - start))
+        return sorted(((name, *values) for name, values in totals.items()), key=lambda row: -row[2])
+
+    def summary_table(self) -> "Table":
+        """Table of the summary, to print at the end of a run."""
+        from rich.table import Table
+
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        table = Table(title=f"Profile: {end_time - self.start_time:.2f}s in total", title_justify="left")
+        table.add_column("Phase")
+        table.add_column("Count", justify="right")
+        table.add_column("Total (s)", justify="right")
+        table.add_column("Mean (ms)", justify="right")
+        table.add_column("Longest (ms)", justify="right")
+        for name, count, total, longest in self.summary():
+            table.add_row(name, str(count), f"{total:.3f}", f"{total / count * 1000:.1f}", f"{longest * 1000:.1f}")
+        return table
+
+    def trace(self) -> dict[str, Any]:
+        """Spans as Chrome trace events, with times in microseconds from the start of the run."""
+        pid = os.getpid()
+        events: list[dict[str, Any]] = [
+            {"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "rich-codex"}}
+        ]
+        for track, track_name in enumerate(self.track_names):
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": track, "args": {"name": track_name}})
+            events.append(
+                {"name": "thread_sort_index", "ph": "M", "pid": pid, "tid": track, "args": {"sort_index": track}}
+            )
+        for name, detail, track, start, end in sorted(self.spans, key=lambda span: span[3]):
+            event: dict[str, Any] = {
+                "name": name,
+                "cat": "rich-codex",
+                "ph": "X",
+                "ts": round((start - self.start_time) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": pid,
+                "tid": track,
+            }
+            if detail is not None:
+                event["args"] = {"detail": detail}
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_trace(self, path: str | Path) -> None:
+        """Write the Chrome trace to a JSON file."""
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(self.trace(), fh)
+        log.info(f"Saved profile of {len(self.spans)} spans to [magenta]{path}[/]")
@@ -0,0 +1,185 @@
+"""On-disk cache of rendered images, so that unchanged outputs don't have to be regenerated."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from shutil import copyfile
+from typing import TYPE_CHECKING
+
+from rich_codex import __version__
+from rich_codex.utils import clean_list, relative_path
+
+if TYPE_CHECKING:
+    from rich_codex.rich_img import RichImg
+
+log = logging.getLogger("rich-codex")
+
+# Cache entries are saved under this directory unless told otherwise
+DEFAULT_CACHE_DIR = ".rich-codex-cache"
+
+
+def make_cache_dir(cache_dir: Path) -> None:
+    """Create a cache directory, telling git to ignore everything in it."""
+    if not cache_dir.exists():
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        (cache_dir / ".gitignore").write_text("# Created by rich-codex\n*\n")
+
+
+class RenderCache:
+    """Content-addressed store of rendered images.
+
+    Each entry holds one rendered file per image type (SVG / PNG / PDF) and is keyed on
+    the config of an image, ignoring its output filenames, plus a fingerprint of any
+    inputs that a command depends on.
+
+    Snippets are always cached, as their config covers everything that they render.
+    Commands can print anything, so are only cached when cache inputs are given, or
+    when the image lists the files it depends on with 'depends_on'.
+    """
+
+    def __init__(self, cache_dir: str | Path, inputs: str | None = None, max_size_mb: float | None = None) -> None:
+        """Set up the cache and fingerprint its inputs."""
+        self.cache_dir = Path(cache_dir)
+        self.inputs = clean_list(inputs.splitlines()) if inputs else []
+        self.max_size = None if max_size_mb is None else int(max_size_mb * 1024 * 1024)
+        self.num_hits = 0
+        self.num_misses = 0
+        self.fingerprint = self._fingerprint_inputs() if self.inputs else None
+        # Images often depend on the same files, so each is only read once
+        self._file_checksums: dict[Path, str] = {}
+
+    def _fingerprint_inputs(self) -> str:
+        """Hash the cache inputs.
+
+        Each input is either an environment variable ('$NAME'), the output of a
+        command ('!my_tool --version') or a glob pattern of files to read.
+        """
+        checksum = hashlib.sha256()
+        for cache_input in self.inputs:
+            checksum.update(cache_input.encode("utf-8") + b"\0")
+            if cache_input.startswith("$"):
+                checksum.update(os.environ.get(cache_input[1:], "").encode("utf-8"))
+            elif cache_input.startswith("!"):
+                result = subprocess.run(cache_input[1:], shell=True, capture_output=True)
+                checksum.update(result.stdout + result.stderr + str(result.returncode).encode("utf-8"))
+            else:
+                for path in sorted(Path.cwd().glob(cache_input)):
+                    if path.is_file():
+                        checksum.update(relative_path(path).encode("utf-8") + b"\0" + path.read_bytes())
+            checksum.update(b"\0")
+        fingerprint = checksum.hexdigest()
+        log.debug(f"Render cache inputs fingerprint: {fingerprint[:12]} ({len(self.inputs)} inputs)")
+        return fingerprint
+
+    def _fingerprint_depends_on(self, img_obj: "RichImg") -> str:
+        """Hash the files matching the 'depends_on' glob patterns of an image, relative to its working directory."""
+        checksum = hashlib.sha256()
+        for pattern in img_obj.depends_on:
+            checksum.update(pattern.encode("utf-8") + b"\0")
+            paths = img_obj.dependency_files(pattern)
+            if len(paths) == 0:
+                log.warning(f"No files found matching depends_on pattern '{pattern}' for '{img_obj.command}'")
+            for path in paths:
+                file_checksum = self._file_checksums.get(path.resolve())
+                if file_checksum is None:
+                    file_checksum = hashlib.sha256(path.read_bytes()).hexdigest()
+                    self._file_checksums[path.resolve()] = file_checksum
+                checksum.update(path.relative_to(img_obj.working_dir).as_posix().encode("utf-8") + b"\0")
+                checksum.update(file_checksum.encode("utf-8"))
+            checksum.update(b"\0")
+        return checksum.hexdigest()
+
+    def key(self, img_obj: "RichImg") -> str | None:
+        """Cache key for an image, or None if it can't be cached."""
+        from importlib.metadata import version
+
+        from rich_codex.rich_img import HASH_ATTRS_NO_FN
+
+        if img_obj.command is not None and self.fingerprint is None and len(img_obj.depends_on) == 0:
+            return None
+        attrs = {attr: getattr(img_obj, attr) for attr in HASH_ATTRS_NO_FN}
+        # Relative paths, as for RichImg.exec_key(), so that other checkouts share the same entries
+        attrs["source"] = relative_path(img_obj.source) if img_obj.source is not None else None
+        attrs["working_dir"] = relative_path(img_obj.working_dir)
+        key_data = {
+            "attrs": attrs,
+            # The SVG ID comes from the first output filename, which the attrs don't cover
+            "svg_id": img_obj._svg_unique_id(),
+            "inputs": self.fingerprint,
+            "depends_on": self._fingerprint_depends_on(img_obj) if img_obj.depends_on else None,
+            "versions": [__version__, version("rich")],
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def restore(self, img_obj: "RichImg") -> bool:
+        """Save the images for an object from the cache, if they're all there.
+
+        On a miss, the object is told its key so that save_images() can fill the cache.
+        """
+        key = self.key(img_obj)
+        if key is None or len(img_obj.img_paths) == 0:
+            return False
+        img_obj.render_cache_key = key
+        entry_dir = self._entry_dir(key)
+        suffixes = {Path(img_path).suffix.lower() for img_path in img_obj.img_paths}
+        if not all((entry_dir / f"render{suffix}").is_file() for suffix in suffixes):
+            self.num_misses += 1
+            log.debug(f"[dim]Render cache miss: {key[:12]}")
+            return False
+
+        self.num_hits += 1
+        log.debug(f"Render cache hit: {key[:12]}, skipping '{img_obj.command or 'snippet'}'")
+        # Entries are evicted least recently used first
+        entry_dir.touch()
+        for filename in img_obj.img_paths:
+            try:
+                Path(filename).parent.mkdir(parents=True, exist_ok=True)
+            except OSError:  # Covers PermissionError, which is a subclass
+                log.error(f"Invalid path: {filename}")
+                continue
+            cached_fn = str(entry_dir / f"render{Path(filename).suffix.lower()}")
+            if img_obj._enough_image_difference(cached_fn, filename):
+                copyfile(cached_fn, filename)
+        return True
+
+    def store(self, key: str, renders: dict[str, str]) -> None:
+        """Save rendered files to the cache, from a dict of file suffix to filename."""
+        if len(renders) == 0:
+            return
+        entry_dir = self._entry_dir(key)
+        make_cache_dir(self.cache_dir)
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        for suffix, filename in renders.items():
+            # Write then rename, so that parallel jobs never see a half-written file
+            tmp_fn = entry_dir / f".render{suffix}.{os.getpid()}.tmp"
+            copyfile(filename, tmp_fn)
+            os.replace(tmp_fn, entry_dir / f"render{suffix}")
+        log.debug(f"[dim]Saved {len(renders)} renders to cache: {key[:12]}")
+
+    def evict(self) -> list[Path]:
+        """Delete the least recently used entries until the cache is under its maximum size."""
+        if self.max_size is None or not self.cache_dir.is_dir():
+            return []
+        entries: list[tuple[float, int, Path]] = []
+        for entry_dir in self.cache_dir.glob("*/*"):
+            if entry_dir.is_dir():
+                size = sum(f.stat().st_size for f in entry_dir.iterdir() if f.is_file())
+                entries.append((entry_dir.stat().st_mtime, size, entry_dir))
+        total_size = sum(size for _, size, _ in entries)
+        evicted: list[Path] = []
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
+            evicted.append(entry_dir)
+        if len(evicted) > 0:
+            log.debug(f"Evicted {len(evicted)} entries from render cache '{relative_path(self.cache_dir)}'")
+        return evicted
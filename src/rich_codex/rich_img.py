@@ -1,4 +1,5 @@
-import difflib
+import codecs
+import hashlib
 import io
 import json
 import logging
@@ -6,30 +7,40 @@ import os
 import re
 import signal
 import subprocess
+import threading
+import time
 import zlib
+from collections import Counter, deque
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 from pathlib import Path
 from shutil import copyfile
 from tempfile import TemporaryDirectory
+from typing import TYPE_CHECKING, Any
 
 import rich.terminal_theme
-import yaml
-from Levenshtein import ratio
 from rich import inspect
 from rich.ansi import AnsiDecoder
 from rich.console import Console
 from rich.prompt import Confirm
-from rich.syntax import Syntax
 from rich.text import Text
 
-from rich_codex.utils import relative_path
+from rich_codex import profiling
+from rich_codex.utils import CONFIG_SCHEMA, relative_path
+
+if TYPE_CHECKING:
+    import asyncio
+    from concurrent.futures import Executor
+
+    from rich_codex.cassette import CassettePlayer, CassetteRecorder
+    from rich_codex.preload import PreloadServer
+    from rich_codex.render_cache import RenderCache
+    from rich_codex.shell_session import ShellSessions
 
 log = logging.getLogger("rich-codex")
 
-# Parse the config schema file to get config attributes
-config_schema_fn = Path(__file__).parent / "config-schema.yml"
-with config_schema_fn.open() as fh:
-    config_schema = yaml.safe_load(fh)
-RICH_IMG_ATTRS = config_schema["properties"]["outputs"]["items"]["properties"].keys()
+# Config attributes, from the config schema
+RICH_IMG_ATTRS = CONFIG_SCHEMA["properties"]["outputs"]["items"]["properties"].keys()
 
 # Line numbers say where an image was defined, not what it renders, so are ignored when deduplicating.
 # 'source' is deliberately kept, so that identical commands in different files stay distinct
@@ -37,9 +48,192 @@ RICH_IMG_ATTRS = config_schema["properties"]["outputs"]["items"]["properties"].k
 HASH_ATTRS = [attr for attr in RICH_IMG_ATTRS if attr != "source_line"]
 HASH_ATTRS_NO_FN = [attr for attr in HASH_ATTRS if attr != "img_paths"]
 
+# Everything that can change what a command prints. Images that only differ in other,
+# presentational attributes (head, tail, title, theme and so on) can share one run of the command.
+# Like HASH_ATTRS, 'source' is kept so that commands in different files still run separately.
+EXEC_ATTRS = [
+    "source",
+    "command",
+    "working_dir",
+    "extra_env",
+    "before_command",
+    "after_command",
+    "use_pty",
+    "terminal_width",
+    "timeout",
+]
+
+# SVGs start with a comment holding a checksum of what was rendered, so unchanged images can be skipped
+SVG_DIGEST_PREFIX = "<!-- rich-codex render: "
+SVG_DIGEST_SUFFIX = " -->"
+
 # Base list of commands to ignore
 IGNORE_COMMANDS = ["rm", "cp", "mv", "sudo"]
 
+# Seconds to wait for the output of a preloaded tool to close after it's killed
+KILL_GRACE = 5
+
+
+def common_affix_lengths(first: bytes, second: bytes) -> tuple[int, int]:
+    """Find the lengths of the common prefix and suffix of two byte strings.
+
+    Uses a binary search over slice comparisons, which are done in C, instead of
+    stepping through the bytes in Python. The prefix and suffix never overlap.
+    """
+    first_view = memoryview(first)
+    second_view = memoryview(second)
+    shortest = min(len(first), len(second))
+
+    low, high = 0, shortest
+    while low < high:
+        mid = (low + high + 1) // 2
+        if first_view[:mid] == second_view[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    prefix = low
+
+    low, high = 0, shortest - prefix
+    while low < high:
+        mid = (low + high + 1) // 2
+        if first_view[len(first) - mid :] == second_view[len(second) - mid :]:
+            low = mid
+        else:
+            high = mid - 1
+    return prefix, low
+
+
+def pct_change_bounds(new_bytes: bytes, old_bytes: bytes, min_pct_diff: float) -> tuple[float, float]:
+    """Work out how much two files differ, only as precisely as needed to compare with min_pct_diff.
+
+    The change is the indel distance (Levenshtein.ratio()) as a percentage, which takes
+    roughly quadratic time and can run for minutes on multi-megabyte PNGs. So it is
+    bounded with cheaper checks first, from fastest to slowest:
+
+    - Identical files have no change
+    - The difference in length is a lower bound
+    - A common prefix and suffix can't be part of the change, so the rest is an upper bound
+    - Every insertion or deletion changes the count of one byte value by one,
+      so the total difference in byte counts is a lower bound
+
+    Returns the lower and upper bounds, as soon as they are both on the same side of
+    min_pct_diff. They are equal when the exact change had to be calculated.
+    """
+    if new_bytes == old_bytes:
+        return 0.0, 0.0
+    total_length = len(new_bytes) + len(old_bytes)
+
+    def as_pct(distance: int | float) -> float:
+        return distance / total_length * 100.0
+
+    # At least one byte must have been added or removed
+    lower = max(abs(len(new_bytes) - len(old_bytes)), 1)
+    if as_pct(lower) > min_pct_diff:
+        return as_pct(lower), 100.0
+
+    # Stripping the common prefix and suffix doesn't change the distance
+    prefix, suffix = common_affix_lengths(new_bytes, old_bytes)
+    new_middle = new_bytes[prefix : len(new_bytes) - suffix]
+    old_middle = old_bytes[prefix : len(old_bytes) - suffix]
+    upper = len(new_middle) + len(old_middle)
+    if as_pct(upper) <= min_pct_diff:
+        return as_pct(lower), as_pct(upper)
+
+    new_counts = Counter(new_middle)
+    old_counts = Counter(old_middle)
+    lower = max(lower, sum(abs(new_counts[value] - old_counts[value]) for value in new_counts | old_counts))
+    if as_pct(lower) > min_pct_diff:
+        return as_pct(lower), as_pct(upper)
+
+    from Levenshtein import ratio
+
+    pct_change = as_pct((1 - ratio(new_middle, old_middle)) * upper)
+    return pct_change, pct_change
+
+
+def convert_svg(svg_filename: str, converted_filename: str) -> None:
+    """Convert an SVG image to a PNG or PDF, depending on the suffix of the new filename.
+
+    A module-level function so that it can be run in a process pool.
+    """
+    from cairosvg import svg2pdf, svg2png
+
+    with open(svg_filename, "rb") as svg_fh:
+        if converted_filename.lower().endswith(".png"):
+            svg2png(file_obj=svg_fh, write_to=converted_filename, dpi=300, output_width=4000)
+        else:
+            svg2pdf(file_obj=svg_fh, write_to=converted_filename)
+
+
+class SharedCapture:
+    """Output of a command, captured by the first image that runs it and reused by the rest.
+
+    Shared by images with the same EXEC_ATTRS, see CodexSearch.collapse_duplicates().
+    """
+
+    def __init__(self) -> None:
+        """Start with nothing captured."""
+        self.output: str | None = None
+
+
+class CapturedLines:
+    """Command output, decoded into lines of rich Text as it arrives.
+
+    With a head or a tail, only the first 'head' and the last 'tail' lines are kept,
+    so memory use doesn't grow with the size of the output. Every line is still
+    decoded, to count them, measure the width and track styles from one line to the next.
+    """
+
+    def __init__(self, head: int | None = None, tail: int | None = None) -> None:
+        """Start with no output, keeping everything unless a head or tail is set."""
+        self.max_head = None if head is None and tail is None else (head or 0)
+        self.head_lines: list[Text] = []
+        self.tail_lines: deque[Text] = deque(maxlen=tail or 0)
+        self.num_lines = 0
+        self.max_line_length = 0
+        self._decoder = AnsiDecoder()
+        self._utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._partial_line = ""
+
+    @classmethod
+    def from_output(cls, output: str, head: int | None = None, tail: int | None = None) -> "CapturedLines":
+        """Decode output that has already been captured in full."""
+        captured = cls(head, tail)
+        captured._partial_line = output
+        captured._add_lines()
+        captured.close()
+        return captured
+
+    def feed(self, data: bytes) -> None:
+        """Decode the next chunk of output."""
+        self._partial_line += self._utf8_decoder.decode(data)
+        self._add_lines()
+
+    def close(self) -> None:
+        """Decode whatever is left once the output has ended."""
+        self._partial_line += self._utf8_decoder.decode(b"", final=True)
+        # Same as Rich, the text after the last newline is always a line, even if it's empty
+        self._add_line(self._partial_line)
+        self._partial_line = ""
+
+    def _add_lines(self) -> None:
+        *lines, self._partial_line = self._partial_line.split("\n")
+        for line in lines:
+            self._add_line(line)
+
+    def _add_line(self, line: str) -> None:
+        # Rich takes a carriage return to mean the line is overwritten, which would blank
+        # every line from a pty, as they end with '\r\n'
+        if line.endswith("\r"):
+            line = line[:-1]
+        text = self._decoder.decode_line(line)
+        self.num_lines += 1
+        self.max_line_length = max(len(text), self.max_line_length)
+        if self.max_head is None or len(self.head_lines) < self.max_head:
+            self.head_lines.append(text)
+        else:
+            self.tail_lines.append(text)
+
 
 class RichImg:
     """Image generation for rich-codex.
@@ -53,6 +247,7 @@ class RichImg:
         working_dir: str | Path | None = None,
         snippet: str | None = None,
         img_paths: list[str] | None = None,
+        depends_on: list[str] | None = None,
         snippet_syntax: str | None = None,
         timeout: int = 5,
         before_command: str | None = None,
@@ -84,6 +279,7 @@ class RichImg:
         self.working_dir = Path.cwd() if working_dir is None else Path(working_dir)
         self.snippet = snippet
         self.img_paths = [] if img_paths is None else img_paths
+        self.depends_on = [] if depends_on is None else depends_on
         self.snippet_syntax = snippet_syntax
         self.timeout = timeout
         self.before_command = before_command
@@ -110,11 +306,32 @@ class RichImg:
         self.console = Console() if console is None else console
         # Only set once the output has been rendered, by run_command() or format_snippet()
         self.capture_console: Console | None = None
+        # Only set once the command has been run, by capture_command()
+        self.command_output: str | None = None
+        # With head / tail, output is decoded as it arrives and only the lines shown are kept
+        self.stream_output = True
+        self.command_lines: CapturedLines | None = None
+        # Set by CodexSearch when other images run the same command, see capture_command()
+        self.shared_capture: SharedCapture | None = None
         self.saved_img_paths: list[str] = []
         self.num_img_saved = 0
         self.num_img_skipped = 0
         self.no_confirm = False
         self.aborted = False
+        # Set by the caller to reuse renders from earlier runs, see generate()
+        self.render_cache: RenderCache | None = None
+        self.render_cache_key: str | None = None
+        # Set by the caller to convert PNG / PDF images in other processes, see convert_svg()
+        self.convert_pool: Executor | None = None
+        # Set by the caller to run commands in long-lived shells, see capture_command()
+        self.shell_sessions: ShellSessions | None = None
+        # Set by the caller to run Python tools in forks of a server that has imported them
+        self.preload_server: PreloadServer | None = None
+        # Set by the caller to record command output to a cassette, or replay it from one, see capture_command()
+        self.record_cassette: CassetteRecorder | None = None
+        self.replay_cassette: CassettePlayer | None = None
+        # Seconds spent on 'command', 'render' and 'convert', for the timing history
+        self.timings: dict[str, float] = {}
         self.source_type = source_type
         self.source = Path(source) if source is not None else None
         self.source_line = source_line
@@ -136,6 +353,34 @@ class RichImg:
         attrs = str([getattr(self, attr) for attr in HASH_ATTRS_NO_FN])
         return hash(attrs)
 
+    def _hash_exec(self) -> int:
+        """Hash of everything that goes into running the command, but not how its output is shown."""
+        attrs = str([getattr(self, attr) for attr in EXEC_ATTRS])
+        return hash(attrs)
+
+    @contextmanager
+    def _timed(self, name: str) -> Iterator[None]:
+        """Add the time taken to the timings."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def exec_key(self) -> str:
+        """Checksum of everything that goes into running the command, the same from one run to the next.
+
+        Paths are relative to the working directory, so that the key is the same in other checkouts.
+        """
+        attrs = {attr: getattr(self, attr) for attr in EXEC_ATTRS}
+        attrs["source"] = relative_path(self.source) if self.source is not None else None
+        attrs["working_dir"] = relative_path(self.working_dir)
+        return hashlib.sha256(json.dumps(attrs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def dependency_files(self, pattern: str) -> list[Path]:
+        """Files matching one of the 'depends_on' glob patterns, relative to the working directory."""
+        return sorted(path for path in self.working_dir.glob(pattern) if path.is_file())
+
     def confirm_command(self) -> bool:
         """Prompt user to confirm running command."""
         if self.command is None or self.no_confirm:
@@ -159,29 +404,93 @@ class RichImg:
 
     def run_command(self) -> None:
         """Capture output from a supplied command and save to an image."""
+        import asyncio
+
         if self.command is None:
             log.debug("Tried to generate image with no command")
             return
 
+        # Output may already have been captured, eg. alongside other commands by CodexSearch
+        if self.command_output is None and self.command_lines is None and not self.aborted:
+            asyncio.run(self.capture_command())
+        with self._timed("render"):
+            if self.command_lines is not None:
+                self.render_command_lines(self.command_lines)
+            elif self.command_output is not None:
+                self.render_command_output(self.command_output)
+
+    async def capture_command(self) -> None:
+        """Run the command, with any before and after commands, and save its output.
+
+        Runs on an asyncio event loop, so that many commands can be captured at once.
+        """
+        if self.command is None:
+            return
+
         self.command = self.command.strip()
 
+        if self.shared_capture is not None and self.shared_capture.output is not None:
+            log.debug(f"Reusing output of '{self.command}', captured for another image")
+            self.command_output = self.shared_capture.output
+            return
+
         for ignore in IGNORE_COMMANDS:
             if any(cmd_part.strip().startswith(ignore) for cmd_part in self.command.split("&;")):
                 log.warning(f"Ignoring command because it contained '{ignore}': [white on black] {self.command} [/]")
                 self.aborted = True
                 return
 
-        if self.title == "" and self.title_command:
-            self.title = self.fake_command if self.fake_command else self.command
+        # Save everything, or stream just the lines we need for head / tail
+        output_arr: list[bytes] = []
+        write_output = output_arr.append
+        if self.stream_output and (self.head is not None or self.tail is not None):
+            self.command_lines = CapturedLines(self.head, self.tail)
+            write_output = self.command_lines.feed
+
+        # Record the raw output as it arrives, or replay it instead of running the command
+        exec_key = self.exec_key() if self.record_cassette is not None or self.replay_cassette is not None else ""
+        recording = self.record_cassette is not None and self.record_cassette.start(exec_key)
+        if recording:
+            record_cassette, write_captured = self.record_cassette, write_output
+            assert record_cassette is not None
+
+            def record_output(data: bytes) -> None:
+                record_cassette.write(exec_key, data)
+                write_captured(data)
+
+            write_output = record_output
+
+        with profiling.span("command", self.command):
+            if self.replay_cassette is not None and exec_key in self.replay_cassette:
+                log.debug(f"Replaying output of '{self.command}' from the cassette")
+                for data in self.replay_cassette.read(exec_key):
+                    write_output(data)
+            else:
+                if self.replay_cassette is not None:
+                    log.warning(f"No output for '{self.command}' in the cassette, running it instead")
+                # Only timed when it's run, so that replays don't go into the timing history
+                with self._timed("command"):
+                    await self._run_command(write_output)
+        if recording:
+            assert self.record_cassette is not None
+            self.record_cassette.finish(exec_key)
+        if self.command_lines is not None:
+            self.command_lines.close()
+        else:
+            self.command_output = b"".join(output_arr).decode("utf-8")
+            if self.shared_capture is not None:
+                self.shared_capture.output = self.command_output
 
+    async def _run_command(self, write_output: Callable[[bytes], None]) -> None:
+        """Run the command, with any before and after commands, passing its output to write_output()."""
+        assert self.command is not None
         if self.use_pty:
             log.debug(f"Running command '{self.command}' with pty")
 
             try:
-                import fcntl
-                import pty
-                import struct
-                import termios
+                import fcntl  # noqa: F401
+                import pty  # noqa: F401
+                import termios  # noqa: F401
 
                 run_with_pty = True
             except ImportError:
@@ -191,6 +500,9 @@ class RichImg:
                     "Falling back to subprocess."
                 )
                 run_with_pty = False
+        elif self.shell_sessions is not None:
+            log.debug(f"Running command '{self.command}' in a shell session")
+            run_with_pty = False
         else:
             log.debug(f"Running command '{self.command}' with subprocess")
             run_with_pty = False
@@ -207,164 +519,313 @@ class RichImg:
 
         # Run before_command if set
         if self.before_command:
-            # Workaround to get inspect() into a string for logging
-            # https://github.com/Textualize/rich/discussions/2378
             log.debug("Running 'before_command'")
-            inspect_console = Console(no_color=True)
-            with inspect_console.capture() as capture:
-                inspect(
-                    subprocess.run(
-                        self.before_command,
-                        cwd=self.working_dir,
-                        shell=True,
-                        env=command_env,
-                        capture_output=True,
-                    ),
-                    title="'before_command' results",
-                    docs=False,
-                    console=inspect_console,
-                )
-            log.debug(Text.from_ansi(capture.get()).plain)
-
+            await self._run_setup_command(self.before_command, "before_command", command_env)
+
+        # Run a preloaded Python tool in a fork of the server that has already imported it
+        preload_argv = self.preload_server.preload_argv(self.command) if self.preload_server is not None else None
+        if preload_argv is not None and await self._run_preloaded(
+            preload_argv, run_with_pty, command_env, write_output
+        ):
+            log.debug(f"Ran '{self.command}' in a fork of the preload server")
         # Run the command with a fake tty to try to get colours
-        if run_with_pty:
-            read_end, write_end = pty.openpty()
+        elif run_with_pty:
+            await self._run_with_pty(command_env, write_output)
+        # Run the command in a shell that's already running
+        elif self.shell_sessions is not None:
+            await self._run_in_session(command_env, write_output)
+        # Run the command without messing with ttys
+        else:
+            await self._run_with_pipe(command_env, write_output)
 
-            # Resize routine for pty
-            # First, get our own current terminal size
-            # (struct is documented here: https://www.delorie.com/djgpp/doc/libc/libc_495.html)
-            size = fcntl.ioctl(0, termios.TIOCGWINSZ, struct.pack("HHHH", 0, 0, 0, 0))
+        # Run after_command if set
+        if self.after_command:
+            log.debug("Running 'after_command'")
+            await self._run_setup_command(self.after_command, "after_command", command_env)
+
+    async def _run_setup_command(self, command: str, name: str, command_env: dict[str, str]) -> None:
+        """Run a before / after command to completion and log the results."""
+        import asyncio
+
+        if self.shell_sessions is not None:
+            # Sessions send stderr to stdout, as they do for the command itself
+            stdout, returncode = await asyncio.to_thread(
+                self.shell_sessions.run, command, self.working_dir, command_env
+            )
+            stderr = b""
+        else:
+            process = await asyncio.create_subprocess_shell(
+                command,
+                cwd=self.working_dir,
+                env=command_env,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout, stderr = await process.communicate()
+            returncode = process.returncode
+        # Same shape of results as subprocess.run(), so they log just as they always have
+        result = subprocess.CompletedProcess(command, returncode or 0, stdout, stderr)
+
+        # Workaround to get inspect() into a string for logging
+        # https://github.com/Textualize/rich/discussions/2378
+        inspect_console = Console(no_color=True)
+        with inspect_console.capture() as capture:
+            inspect(result, title=f"'{name}' results", docs=False, console=inspect_console)
+        log.debug(Text.from_ansi(capture.get()).plain)
+
+    def _log_timeout(self) -> None:
+        log.info(f"Command '{self.command}' timed out after {self.timeout} seconds")
+
+    async def _run_with_pipe(self, command_env: dict[str, str], write_output: Callable[[bytes], None]) -> None:
+        """Run the command with its output going to a pipe, killing it if it takes too long."""
+        import asyncio
+
+        assert self.command is not None
+        process = await asyncio.create_subprocess_shell(
+            self.command,
+            cwd=self.working_dir,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=command_env,
+            start_new_session=True,  # Needed for subprocess termination
+        )
+        assert process.stdin is not None and process.stdout is not None
+        # No input for the command, same as Popen.communicate()
+        process.stdin.close()
+
+        async def read_output(stream: "asyncio.StreamReader") -> None:
+            while data := await stream.read(65536):
+                write_output(data)
+
+        # Read as we go, so that output captured before a timeout isn't lost
+        reader = asyncio.ensure_future(read_output(process.stdout))
+        waiter = asyncio.ensure_future(process.wait())
+        _, pending = await asyncio.wait({reader, waiter}, timeout=self.timeout)
+        if pending:
+            self._log_timeout()
+            # The shell leads its own process group, which outlives it while a background job is running
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        await asyncio.gather(reader, waiter)
 
-            # Rewrite size with selected terminal width if set
-            if self.terminal_width is not None:
-                winsize = struct.unpack("HHHH", size)
-                size = struct.pack("HHHH", winsize[0], self.terminal_width, 0, 0)
+    async def _run_in_session(self, command_env: dict[str, str], write_output: Callable[[bytes], None]) -> None:
+        """Run the command in a shell session, which is killed and started again if it takes too long."""
+        import asyncio
 
-            # Issue command to pty to resize
-            fcntl.ioctl(write_end, termios.TIOCSWINSZ, size)
-            fcntl.ioctl(read_end, termios.TIOCSWINSZ, size)
+        assert self.command is not None and self.shell_sessions is not None
+        try:
+            output, _ = await asyncio.to_thread(
+                self.shell_sessions.run, self.command, self.working_dir, command_env, self.timeout
+            )
+        except subprocess.TimeoutExpired as e:
+            self._log_timeout()
+            output = e.output
+        write_output(output)
+
+    def _open_pty(self) -> tuple[int, int]:
+        """Open a pseudo-terminal the size of ours, or as wide as terminal_width if set."""
+        import fcntl
+        import pty
+        import struct
+        import termios
+
+        read_end, write_end = pty.openpty()
+
+        # Resize routine for pty
+        # First, get our own current terminal size
+        # (struct is documented here: https://www.delorie.com/djgpp/doc/libc/libc_495.html)
+        size = fcntl.ioctl(0, termios.TIOCGWINSZ, struct.pack("HHHH", 0, 0, 0, 0))
+
+        # Rewrite size with selected terminal width if set
+        if self.terminal_width is not None:
+            winsize = struct.unpack("HHHH", size)
+            size = struct.pack("HHHH", winsize[0], self.terminal_width, 0, 0)
+
+        # Issue command to pty to resize
+        fcntl.ioctl(write_end, termios.TIOCSWINSZ, size)
+        fcntl.ioctl(read_end, termios.TIOCSWINSZ, size)
+        # Signal handlers can only be set from the main thread, not from parallel jobs
+        if threading.current_thread() is threading.main_thread():
             signal.signal(signal.SIGWINCH, lambda s, f: fcntl.ioctl(write_end, termios.TIOCSWINSZ, size))
             signal.signal(signal.SIGWINCH, lambda s, f: fcntl.ioctl(read_end, termios.TIOCSWINSZ, size))
+        return read_end, write_end
 
-            # Run subprocess in pty
-            try:
-                process = subprocess.Popen(
-                    self.command,
-                    cwd=self.working_dir,
-                    shell=True,
-                    env=command_env,
-                    close_fds=True,
-                    start_new_session=True,  # Needed for subprocess termination
-                    stdin=write_end,
-                    stdout=write_end,
-                    stderr=write_end,
-                )
-                process.wait(timeout=self.timeout)
-            except subprocess.TimeoutExpired:
-                log.info(f"Command '{self.command}' timed out after {self.timeout} seconds")
-                os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-            os.close(write_end)
+    @staticmethod
+    def _read_until_closed(read_end: int, write_output: Callable[[bytes], None]) -> "asyncio.Future[Any]":
+        """Read a pipe or pty whenever it has data, so that the command never blocks on a full buffer.
 
-            output_arr: list[bytes] = []
+        The future is done once every copy of the write end is closed.
+        """
+        import asyncio
 
-            # This loop will keep going until no more data is incoming (child process closed their pipe)
-            while True:
-                try:
-                    data = os.read(read_end, 1024)
-                except OSError:
-                    data = b""
+        loop = asyncio.get_running_loop()
+        read_done = loop.create_future()
 
-                if data:
-                    output_arr.append(data)
-                else:
-                    break
+        def read_output() -> None:
+            try:
+                data = os.read(read_end, 65536)
+            except OSError:
+                data = b""
+            if data:
+                write_output(data)
+            elif not read_done.done():
+                loop.remove_reader(read_end)
+                read_done.set_result(None)
+
+        loop.add_reader(read_end, read_output)
+        return read_done
+
+    async def _run_with_pty(self, command_env: dict[str, str], write_output: Callable[[bytes], None]) -> None:
+        """Run the command in a pseudo-terminal, killing it if it takes too long."""
+        import asyncio
+
+        assert self.command is not None
+        read_end, write_end = self._open_pty()
+
+        # Run subprocess in pty
+        process = await asyncio.create_subprocess_shell(
+            self.command,
+            cwd=self.working_dir,
+            env=command_env,
+            close_fds=True,
+            start_new_session=True,  # Needed for subprocess termination
+            stdin=write_end,
+            stdout=write_end,
+            stderr=write_end,
+        )
+        # The child has its own copy now. Reads give an error once every copy is closed.
+        os.close(write_end)
 
+        read_done = self._read_until_closed(read_end, write_output)
+        waiter = asyncio.ensure_future(process.wait())
+        try:
+            _, pending = await asyncio.wait({read_done, waiter}, timeout=self.timeout)
+            if pending:
+                self._log_timeout()
+                # The shell leads its own process group, which outlives it while a background job is running
+                try:
+                    os.killpg(process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            await asyncio.gather(read_done, waiter)
+        finally:
+            asyncio.get_running_loop().remove_reader(read_end)
             os.close(read_end)
-            output = b"".join(output_arr).decode("utf-8")
 
-        # Run the command without messing with ttys
-        else:
-            try:
-                process = subprocess.Popen(
-                    self.command,
-                    cwd=self.working_dir,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    shell=True,  # Needed for pipes
-                    env=command_env,
-                    start_new_session=True,  # Needed for subprocess termination
-                )
-                output_bytes, _ = process.communicate(timeout=self.timeout)
-            except subprocess.TimeoutExpired:
-                log.info(f"Command '{self.command}' timed out after {self.timeout} seconds")
-                os.killpg(os.getpgid(process.pid), signal.SIGKILL)
-                output_bytes, _ = process.communicate()
-            output = output_bytes.decode("utf-8")
+    async def _run_preloaded(
+        self, argv: list[str], run_with_pty: bool, command_env: dict[str, str], write_output: Callable[[bytes], None]
+    ) -> bool:
+        """Run a preloaded tool in a fork of the preload server, wired up as for a pty or a pipe.
 
-        # Run after_command if set
-        if self.after_command:
-            log.debug("Running 'after_command'")
+        The fork isn't a child of rich-codex, so it's finished once its output is closed.
+        Returns False without running anything if the server couldn't start the fork.
+        """
+        import asyncio
 
-            # Workaround to get inspect() into a string for logging
-            # https://github.com/Textualize/rich/discussions/2378
-            inspect_console = Console(no_color=True)
-            with inspect_console.capture() as capture:
-                inspect(
-                    subprocess.run(
-                        self.after_command,
-                        cwd=self.working_dir,
-                        shell=True,
-                        env=command_env,
-                        capture_output=True,
-                    ),
-                    title="'after_command' results",
-                    docs=False,
-                    console=inspect_console,
-                )
-            log.debug(Text.from_ansi(capture.get()).plain)
+        assert self.preload_server is not None
+        if run_with_pty:
+            read_end, write_end = self._open_pty()
+            stdin = os.dup(write_end)
+        else:
+            read_end, write_end = os.pipe()
+            # No input for the command, same as Popen.communicate()
+            stdin = os.open(os.devnull, os.O_RDONLY)
+        try:
+            pid = self.preload_server.spawn(argv, self.working_dir, command_env, (stdin, write_end, write_end))
+        except OSError as e:
+            log.warning(f"Couldn't run '{self.command}' in the preload server, running it as normal: {e}")
+            os.close(read_end)
+            return False
+        finally:
+            # The fork has its own copies now
+            os.close(stdin)
+            os.close(write_end)
 
-        decoder = AnsiDecoder()
+        read_done = self._read_until_closed(read_end, write_output)
+        try:
+            _, pending = await asyncio.wait({read_done}, timeout=self.timeout)
+            if pending:
+                self._log_timeout()
+                kill_signal = signal.SIGTERM if run_with_pty else signal.SIGKILL
+                try:
+                    os.killpg(pid, kill_signal)
+                except ProcessLookupError:
+                    # The fork can time out before it has started its own process group
+                    try:
+                        os.kill(pid, kill_signal)
+                    except ProcessLookupError:
+                        pass
+                try:
+                    # Anything the tool started in another session could keep the output open
+                    await asyncio.wait_for(read_done, KILL_GRACE)
+                except asyncio.TimeoutError:
+                    log.warning(f"Output of '{self.command}' was still open after it was killed, not waiting for it")
+            else:
+                await read_done
+        finally:
+            asyncio.get_running_loop().remove_reader(read_end)
+            os.close(read_end)
+        return True
+
+    def render_command_output(self, output: str) -> None:
+        """Print captured command output to the capture console, ready to save."""
+        with profiling.span("decode"):
+            captured = CapturedLines.from_output(output)
+        self.render_command_lines(captured)
 
-        # Count lines and find longest line
-        print_lines = []
-        max_line_length = 0
-        for line in decoder.decode(output):
-            print_lines.append(True)
-            max_line_length = max(len(line), max_line_length)
+    def render_command_lines(self, captured: CapturedLines) -> None:
+        """Print decoded lines of command output to the capture console, ready to save."""
+        if self.title == "" and self.title_command:
+            self.title = self.fake_command if self.fake_command else (self.command or "")
 
-        self.capture_console = self._new_capture_console(max_line_length)
+        self.capture_console = self._new_capture_console(captured.max_line_length)
 
         # Set head / tail print set
-        if self.head and self.head >= len(print_lines):
+        num_lines = captured.num_lines
+        if self.head and self.head >= num_lines:
             self.head = None
-        if self.tail and self.tail >= len(print_lines):
+        if self.tail and self.tail >= num_lines:
             self.tail = None
+        # Line numbers for everything that was kept: the head, then the end of the tail
+        tail_offset = num_lines - len(captured.tail_lines)
+        kept_lines = list(enumerate(captured.head_lines)) + list(enumerate(captured.tail_lines, tail_offset))
+        head_lines = [line for _, line in kept_lines]
+        tail_lines: list[Text] = []
         if self.head is not None or self.tail is not None:
-            print_lines = [False] * len(print_lines)
-            if self.head is not None:
-                print_lines[: self.head] = [True] * self.head
-            if self.tail is not None:
-                print_lines[len(print_lines) - self.tail :] = [True] * self.tail
+            tail_start = num_lines - self.tail if self.tail is not None else num_lines
+            head_end = min(self.head or 0, tail_start)
+            head_lines = [line for idx, line in kept_lines if idx < head_end]
+            tail_lines = [line for idx, line in kept_lines if idx >= tail_start]
 
         # Print the command
         if not self.hide_command:
             self.capture_console.print(f"$ {self.fake_command if self.fake_command else self.command}")
 
-        # Decode and print the output (captured)
-        truncated = False
-        for idx, line in enumerate(decoder.decode(output)):
-            if print_lines[idx]:
-                self.capture_console.print(line)
-                # Trim text after trim_after
-                if self.trim_after and self.trim_after in line:
-                    break
-            elif not truncated and self.truncated_text and (self.head is not None or self.tail is not None):
-                self.capture_console.print(self.truncated_text, style="italic dim")
-                truncated = True
+        # Print the output (captured), with a marker where lines were left out
+        for line in head_lines:
+            self.capture_console.print(line)
+            # Trim text after trim_after
+            if self.trim_after and self.trim_after in line:
+                return
+        if len(head_lines) + len(tail_lines) < num_lines and self.truncated_text:
+            self.capture_console.print(self.truncated_text, style="italic dim")
+        for line in tail_lines:
+            self.capture_console.print(line)
+            if self.trim_after and self.trim_after in line:
+                return
+
+    @staticmethod
+    def decode_output(output: str) -> list[Text]:
+        """Decode command output with ANSI codes into lines of rich Text, in a single pass."""
+        return CapturedLines.from_output(output).head_lines
 
     def format_snippet(self) -> None:
         """Take a text snippet and format it using rich."""
+        from rich.syntax import Syntax
+
         if self.snippet is None:
             log.debug("Tried to format snippet with no snippet")
             return
@@ -396,11 +857,24 @@ class RichImg:
         else:
             log.warning("Tried to get output with no command or snippet")
 
+    def generate(self) -> None:
+        """Get the output and save the images, unless they can be copied from the render cache."""
+        if self.render_cache is not None and self.render_cache.restore(self):
+            return
+        self.get_output()
+        self.save_images()
+
     def _enough_image_difference(self, new_fn: str, old_fn: str) -> bool:
         """Decide whether the newly rendered image differs enough from the saved one.
 
         Also logs the outcome and updates the saved / skipped counters.
         """
+        with profiling.span("compare", old_fn):
+            return self._compare_images(new_fn, old_fn)
+
+    def _compare_images(self, new_fn: str, old_fn: str) -> bool:
+        import difflib
+
         new_file = Path(new_fn)
         old_file = Path(old_fn)
         create_file = True
@@ -415,13 +889,18 @@ class RichImg:
             # This method works even with entirely binary files, no decoding required
             new_file_bytes = new_file.read_bytes()
             old_file_bytes = old_file.read_bytes()
-            pct_change = (1 - ratio(new_file_bytes, old_file_bytes)) * 100.0
-            if pct_change <= self.min_pct_diff:
+            min_pct_change, max_pct_change = pct_change_bounds(new_file_bytes, old_file_bytes, self.min_pct_diff)
+            if max_pct_change <= self.min_pct_diff:
                 create_file = False
-            log_msg = f"{pct_change:.2f}% change"
+            if min_pct_change == max_pct_change:
+                log_msg = f"{min_pct_change:.2f}% change"
+            elif create_file:
+                log_msg = f"over {self.min_pct_diff:g}% change"
+            else:
+                log_msg = f"at most {max_pct_change:.2f}% change"
 
             # No point in looking for a diff if the files are identical
-            if pct_change > 0:
+            if max_pct_change > 0:
                 # Regex on file diff to skip.
                 # Drop blank lines only: an empty pattern would match every line.
                 # Not clean_list(), as '#' starts a valid regex and spaces can be significant.
@@ -429,8 +908,17 @@ class RichImg:
                 if self.skip_change_regex:
                     skip_regexes = [ln for ln in self.skip_change_regex.splitlines() if ln.strip()]
                 if len(skip_regexes) > 0:
-                    new_file_lines = new_file_bytes.decode(errors="ignore").splitlines()
-                    old_file_lines = old_file_bytes.decode(errors="ignore").splitlines()
+                    # The render checksum changes with any change, so never counts as a real one
+                    new_file_lines = [
+                        ln
+                        for ln in new_file_bytes.decode(errors="ignore").splitlines()
+                        if not ln.startswith(SVG_DIGEST_PREFIX)
+                    ]
+                    old_file_lines = [
+                        ln
+                        for ln in old_file_bytes.decode(errors="ignore").splitlines()
+                        if not ln.startswith(SVG_DIGEST_PREFIX)
+                    ]
                     log.info("Checking diff")
 
                     # Only continue if we found something to diff with
@@ -489,8 +977,58 @@ class RichImg:
             path = Path(path.name)
         return "rich-codex-" + str(zlib.adler32(str(path).encode("utf-8")))
 
+    def _render_digest(self) -> str:
+        """Checksum of everything that goes into the SVG: the captured output and how it's drawn."""
+        from importlib.metadata import version
+
+        assert self.capture_console is not None
+        checksum = hashlib.sha256()
+        for part in [
+            version("rich"),
+            str(self.capture_console.width),
+            self.title,
+            str(self.terminal_theme),
+            self._svg_unique_id(),
+            self.capture_console.export_text(clear=False, styles=True),
+        ]:
+            checksum.update(part.encode("utf-8") + b"\0")
+        return checksum.hexdigest()
+
+    @staticmethod
+    def _write_image(source: str, filename: str) -> None:
+        """Copy a rendered image to where it's saved."""
+        with profiling.span("write", filename):
+            copyfile(source, filename)
+
+    def _convert_svg(self, svg_filename: str, converted_filename: str) -> None:
+        """Convert an SVG to a PNG or PDF, in the convert pool if there is one."""
+        with self._timed("convert"), profiling.span("convert", converted_filename):
+            if self.convert_pool is None:
+                convert_svg(svg_filename, converted_filename)
+            else:
+                self.convert_pool.submit(convert_svg, svg_filename, converted_filename).result()
+
+    @staticmethod
+    def _svg_has_digest(filename: str, render_digest: str) -> bool:
+        """Check whether an existing SVG was rendered from output with this digest."""
+        if not filename.lower().endswith(".svg"):
+            return False
+        try:
+            with open(filename, encoding="utf-8") as fh:
+                first_line = fh.readline(256).rstrip("\n")
+        except (OSError, UnicodeDecodeError):
+            return False
+        return first_line == f"{SVG_DIGEST_PREFIX}{render_digest}{SVG_DIGEST_SUFFIX}"
+
     def save_images(self) -> None:
         """Save the images to the specified filenames."""
+        convert_before = self.timings.get("convert", 0.0)
+        with self._timed("render"):
+            self._save_images()
+        # Conversions are timed on their own
+        self.timings["render"] -= self.timings.get("convert", 0.0) - convert_before
+
+    def _save_images(self) -> None:
         if self.aborted:
             return
         if len(self.img_paths) == 0:
@@ -511,6 +1049,14 @@ class RichImg:
                     f"Falling back to default for [magenta]{', '.join(self.img_paths)}"
                 )
 
+        # Nothing to do if every image is an SVG that was rendered from exactly this output
+        render_digest = self._render_digest()
+        if all(self._svg_has_digest(filename, render_digest) for filename in self.img_paths):
+            for filename in self.img_paths:
+                self.num_img_skipped += 1
+                log.debug(f"[dim]Skipped: '{relative_path(filename)}' (render unchanged)")
+            return
+
         # Save image as requested with $IMG_PATHS
         svg_img = None
         png_img = None
@@ -518,8 +1064,9 @@ class RichImg:
         with TemporaryDirectory() as tmp_dir:
             # Scratch files for the renders, all removed when the loop is done
             svg_tmp_filename = str(Path(tmp_dir) / "render.svg")
-            converted_filename = str(Path(tmp_dir) / "converted")
             rendered_svg = False
+            # Fresh renders by file suffix, to save in the render cache
+            renders: dict[str, str] = {}
 
             for filename in self.img_paths:
                 # Make directories if necessary
@@ -533,40 +1080,44 @@ class RichImg:
                 if filename.lower().endswith(".png") and png_img is not None:
                     log.debug(f"Using '{png_img}' for '{filename}'")
                     if self._enough_image_difference(png_img, filename):
-                        copyfile(png_img, filename)
+                        self._write_image(png_img, filename)
                     continue
                 if filename.lower().endswith(".pdf") and pdf_img is not None:
                     log.debug(f"Using '{pdf_img}' for '{filename}'")
                     if self._enough_image_difference(pdf_img, filename):
-                        copyfile(pdf_img, filename)
+                        self._write_image(pdf_img, filename)
                     continue
                 if filename.lower().endswith(".svg") and svg_img is not None:
                     log.debug(f"Using '{svg_img}' for '{filename}'")
                     if self._enough_image_difference(svg_img, filename):
-                        copyfile(svg_img, filename)
+                        self._write_image(svg_img, filename)
                     continue
 
                 # We always render an SVG first, then reuse it for every other output
                 if svg_img is None and not rendered_svg:
-                    self.capture_console.save_svg(
-                        svg_tmp_filename,
-                        title=self.title,
-                        theme=terminal_theme,
-                        unique_id=self._svg_unique_id(),
-                    )
+                    with profiling.span("save svg"):
+                        svg = self.capture_console.export_svg(
+                            title=self.title,
+                            theme=terminal_theme,
+                            unique_id=self._svg_unique_id(),
+                        )
+                        with open(svg_tmp_filename, "w", encoding="utf-8") as fh:
+                            fh.write(f"{SVG_DIGEST_PREFIX}{render_digest}{SVG_DIGEST_SUFFIX}\n{svg}")
                     rendered_svg = True
+                    renders[".svg"] = svg_tmp_filename
                 svg_source = svg_img or svg_tmp_filename
 
                 # Save the SVG image if requested
                 if filename.lower().endswith(".svg"):
                     if self._enough_image_difference(svg_source, filename):
-                        copyfile(svg_source, filename)
+                        self._write_image(svg_source, filename)
                     svg_img = filename
 
                 # Lazy-load PNG / PDF libraries if needed
+                # Loaded here even when converting in a process pool, so that errors are reported the same way
                 if filename.lower().endswith(".png") or filename.lower().endswith(".pdf"):
                     try:
-                        from cairosvg import svg2pdf, svg2png
+                        import cairosvg  # noqa: F401
                     except ImportError as e:
                         log.debug(e)
                         log.error("CairoSVG not installed, cannot convert SVG to PNG or PDF.")
@@ -584,26 +1135,23 @@ class RichImg:
 
                     # Convert to PNG if requested
                     if filename.lower().endswith(".png"):
+                        converted_filename = str(Path(tmp_dir) / "converted.png")
                         log.debug(f"Converting SVG '{svg_source}' to PNG '{filename}'")
-                        with open(svg_source, "rb") as svg_fh:
-                            svg2png(
-                                file_obj=svg_fh,
-                                write_to=converted_filename,
-                                dpi=300,
-                                output_width=4000,
-                            )
+                        self._convert_svg(svg_source, converted_filename)
+                        renders[".png"] = converted_filename
                         if self._enough_image_difference(converted_filename, filename):
-                            copyfile(converted_filename, filename)
+                            self._write_image(converted_filename, filename)
                             png_img = filename
 
                     # Convert to PDF if requested
                     if filename.lower().endswith(".pdf"):
+                        converted_filename = str(Path(tmp_dir) / "converted.pdf")
                         log.debug(f"Converting SVG '{svg_source}' to PDF '{filename}'")
-                        with open(svg_source, "rb") as svg_fh:
-                            svg2pdf(
-                                file_obj=svg_fh,
-                                write_to=converted_filename,
-                            )
+                        self._convert_svg(svg_source, converted_filename)
+                        renders[".pdf"] = converted_filename
                         if self._enough_image_difference(converted_filename, filename):
-                            copyfile(converted_filename, filename)
+                            self._write_image(converted_filename, filename)
                             pdf_img = filename
+
+            if self.render_cache is not None and self.render_cache_key is not None:
+                self.render_cache.store(self.render_cache_key, renders)
@@ -0,0 +1,149 @@
+"""On-disk index of search results, so that unchanged files don't have to be searched again."""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from rich_codex import __version__
+from rich_codex.codex_search import has_scan_markers, scan_file
+from rich_codex.render_cache import make_cache_dir
+from rich_codex.utils import relative_path
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+
+log = logging.getLogger("rich-codex")
+
+# Saved in the cache directory, alongside the render cache
+SEARCH_INDEX_FILENAME = "search-index.json"
+
+# Files changed this soon after their mtime was read could change again without the
+# mtime moving on, on file systems with coarse timestamps, so their contents are checked
+RACY_NS = 2_000_000_000
+
+
+def index_file(path: Path, old_checksum: str | None = None) -> dict[str, Any]:
+    """Read a file and make its entry in the index.
+
+    If the contents still match old_checksum, they aren't scanned again and 'found' is None.
+    A module-level function so that it can be run in a process pool.
+    """
+    stat = path.stat()
+    indexed_ns = time.time_ns()
+    contents = path.read_bytes()
+    checksum = hashlib.sha256(contents).hexdigest()
+    found = None
+    if checksum != old_checksum:
+        found = scan_file(contents.decode("utf-8")) if has_scan_markers(contents) else []
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "indexed_ns": indexed_ns,
+        "sha256": checksum,
+        "found": found,
+    }
+
+
+class SearchIndex:
+    """Results of scan_file() for each searched file.
+
+    Files are looked up by path. If the size and modification time haven't changed, the
+    saved results are used without reading the file. Otherwise a checksum of the contents
+    decides whether the file needs to be scanned again.
+
+    The results don't depend on any config, only on the file contents, so the index
+    only has to be thrown away when rich-codex is upgraded.
+    """
+
+    def __init__(self, cache_dir: str | Path) -> None:
+        """Load the index from the cache directory, if there is one."""
+        self.cache_dir = Path(cache_dir)
+        self.index_fn = self.cache_dir / SEARCH_INDEX_FILENAME
+        self.files: dict[str, dict[str, Any]] = self._load()
+        self.num_reused = 0
+        self.num_scanned = 0
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        try:
+            index = json.loads(self.index_fn.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(index, dict) or index.get("version") != __version__:
+            log.debug("[dim]Search index is from another version of rich-codex, ignoring it")
+            return {}
+        return index.get("files", {})
+
+    def scan(self, path: Path) -> list[dict[str, Any]]:
+        """Find the images in a file, reusing the results from last time if it hasn't changed."""
+        return self.scan_all([path])[0]
+
+    def scan_all(
+        self, paths: list[Path], executor: "Executor | None" = None, chunksize: int = 1
+    ) -> list[list[dict[str, Any]]]:
+        """Find the images in each file, in order, only reading the files that look like they've changed.
+
+        With an executor, the files that have to be read are indexed in parallel.
+        """
+        found: list[list[dict[str, Any]] | None] = []
+        changed: list[Path] = []
+        for path in paths:
+            stat = path.stat()
+            entry = self.files.get(str(path))
+            if (
+                entry is not None
+                and entry["size"] == stat.st_size
+                and entry["mtime_ns"] == stat.st_mtime_ns
+                and entry["indexed_ns"] - entry["mtime_ns"] > RACY_NS
+            ):
+                self.num_reused += 1
+                found.append(entry["found"])
+            else:
+                changed.append(path)
+                found.append(None)
+
+        old_checksums = [self.files.get(str(path), {}).get("sha256") for path in changed]
+        if executor is not None:
+            new_entries = executor.map(index_file, changed, old_checksums, chunksize=chunksize)
+        else:
+            new_entries = map(index_file, changed, old_checksums)
+        changed_found = []
+        for path, entry in zip(changed, new_entries):
+            if entry["found"] is None:
+                # Same contents as last time
+                self.num_reused += 1
+                entry["found"] = self.files[str(path)]["found"]
+            else:
+                self.num_scanned += 1
+            self.files[str(path)] = entry
+            changed_found.append(entry["found"])
+
+        changed_iter = iter(changed_found)
+        return [next(changed_iter) if file_found is None else file_found for file_found in found]
+
+    def save(self, searched_files: list[Path]) -> None:
+        """Save the index, dropping any files that weren't searched this time."""
+        log.debug(f"Search index: {self.num_reused} files unchanged, {self.num_scanned} files scanned")
+        keep = {str(path) for path in searched_files}
+        files = {}
+        for path, entry in self.files.items():
+            if path not in keep:
+                continue
+            # YAML config can hold values that JSON can't, such as dates. Those files are scanned every time.
+            try:
+                json.dumps(entry)
+            except (TypeError, ValueError):
+                continue
+            files[path] = entry
+        self.files = files
+        if len(files) == 0 and not self.index_fn.exists():
+            return
+        make_cache_dir(self.cache_dir)
+        # Write then rename, so that a run that's interrupted never leaves half an index
+        tmp_fn = self.index_fn.with_name(f".{SEARCH_INDEX_FILENAME}.{os.getpid()}.tmp")
+        tmp_fn.write_text(json.dumps({"version": __version__, "files": files}), encoding="utf-8")
+        os.replace(tmp_fn, self.index_fn)
+        log.debug(f"[dim]Saved search index to '{relative_path(self.index_fn)}'")
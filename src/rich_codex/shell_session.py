@@ -0,0 +1,213 @@
+"""Long-lived shells to run commands in, instead of starting a new shell for every command."""
+
+import logging
+import os
+import select
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+log = logging.getLogger("rich-codex")
+
+# Same shell as subprocess uses for shell=True
+SHELL = "/bin/sh"
+# Seconds between checks that the shell is still alive, while waiting for output
+POLL_INTERVAL = 0.5
+
+
+class ShellSession:
+    """A shell process that reads commands from its stdin, one after another.
+
+    Each command runs in a subshell, so changes that it makes to the directory, variables
+    and so on don't leak into the next command. Its output goes to a FIFO of its own,
+    which is closed once the command finishes, so that anything it leaves running in the
+    background can't write into the output of the next command. The shell then prints a
+    line holding a sentinel that's unique to the session and the exit code, which marks
+    where the command finished.
+    """
+
+    def __init__(self, working_dir: Path, env: dict[str, str]) -> None:
+        """Start the shell, in its own process group so that a command can be killed along with it."""
+        self.sentinel = f"rich-codex-done-{uuid.uuid4().hex}"
+        self.fifo_dir = Path(tempfile.mkdtemp(prefix="rich-codex-session-"))
+        self.num_runs = 0
+        self.process = subprocess.Popen(
+            [SHELL],
+            cwd=working_dir,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+    @property
+    def alive(self) -> bool:
+        """Whether the shell is still running."""
+        return self.process.poll() is None
+
+    def run(self, command: str, timeout: float | None = None) -> tuple[bytes, int | None]:
+        """Run a command and return its output and exit code.
+
+        The exit code is None if the shell died before the command finished. If the
+        command takes longer than the timeout, the shell is killed along with it and
+        subprocess.TimeoutExpired is raised, holding the output so far.
+        """
+        self.num_runs += 1
+        fifo = self.fifo_dir / f"output-{self.num_runs}"
+        os.mkfifo(fifo)
+        # Our own write end stops the FIFO reading as closed before the command opens it
+        fifo_fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+        fifo_write_fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            return self._run(command, timeout, fifo, fifo_fd)
+        finally:
+            os.close(fifo_fd)
+            os.close(fifo_write_fd)
+            fifo.unlink(missing_ok=True)
+
+    def _run(self, command: str, timeout: float | None, fifo: Path, fifo_fd: int) -> tuple[bytes, int | None]:
+        """Run a command with its output going to a FIFO, and read it until the sentinel comes from the shell."""
+        assert self.process.stdin is not None and self.process.stdout is not None
+        # Commands can't read from the session's stdin, as that's where the next command comes from
+        script = (
+            f"(eval {shlex.quote(command)}) </dev/null >{shlex.quote(str(fifo))} 2>&1\n"
+            f"printf '\\n%s %s\\n' {self.sentinel} \"$?\"\n"
+        )
+        try:
+            self.process.stdin.write(script.encode("utf-8"))
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            self.kill()
+            return b"", None
+
+        marker = f"\n{self.sentinel} ".encode()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        shell_fd = self.process.stdout.fileno()
+        output = bytearray()
+        # Anything the shell prints itself, such as an error opening the FIFO, and then the sentinel
+        shell_output = bytearray()
+        while True:
+            marker_start = shell_output.find(marker)
+            if marker_start != -1:
+                line_end = shell_output.find(b"\n", marker_start + len(marker))
+                if line_end != -1:
+                    # The command has exited, so everything it wrote is already in the FIFO
+                    output += _read_available(fifo_fd)
+                    exit_code = int(shell_output[marker_start + len(marker) : line_end])
+                    return bytes(shell_output[:marker_start] + output), exit_code
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self.kill()
+                output += _read_available(fifo_fd)
+                raise subprocess.TimeoutExpired(command, timeout or 0, output=bytes(output))
+            # Wake up now and then, as the command could keep running after the shell dies
+            ready, _, _ = select.select(
+                [shell_fd, fifo_fd], [], [], POLL_INTERVAL if remaining is None else min(remaining, POLL_INTERVAL)
+            )
+            if fifo_fd in ready:
+                output += _read_available(fifo_fd)
+            chunk = os.read(shell_fd, 65536) if shell_fd in ready else None
+            if chunk == b"" or (chunk is None and not self.alive):
+                log.debug(f"[dim]Shell session ended while running '{command}'")
+                self.kill()
+                output += _read_available(fifo_fd)
+                return bytes(shell_output + output), None
+            if chunk:
+                shell_output += chunk
+
+    def kill(self) -> None:
+        """Kill the shell and anything still running in it."""
+        if self.alive:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout):
+            if pipe is not None:
+                pipe.close()
+        shutil.rmtree(self.fifo_dir, ignore_errors=True)
+
+    def close(self) -> None:
+        """Let the shell exit once it has run everything it was sent."""
+        if self.process.stdin is not None:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        self.kill()
+
+
+def _read_available(fd: int) -> bytes:
+    """Read everything that's waiting in a non-blocking pipe."""
+    data = bytearray()
+    while True:
+        try:
+            chunk = os.read(fd, 65536)
+        except BlockingIOError:
+            break
+        if chunk == b"":
+            break
+        data += chunk
+    return bytes(data)
+
+
+class ShellSessions:
+    """Shell sessions for each working directory and environment, started when they're first needed.
+
+    Commands that run at the same time get a session each. Sessions are started again
+    after a command times out or the shell dies.
+    """
+
+    def __init__(self) -> None:
+        """Start with no sessions."""
+        self._idle: dict[tuple[str, tuple[tuple[str, str], ...]], list[ShellSession]] = {}
+        self._lock = threading.Lock()
+        self.num_started = 0
+
+    def run(
+        self, command: str, working_dir: Path, env: dict[str, str], timeout: float | None = None
+    ) -> tuple[bytes, int | None]:
+        """Run a command in a session for its working directory and environment, see ShellSession.run()."""
+        key = (str(working_dir), tuple(sorted(env.items())))
+        session = None
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while session is None and len(idle) > 0:
+                session = idle.pop()
+                if not session.alive:
+                    session.kill()
+                    session = None
+            if session is None:
+                self.num_started += 1
+        if session is None:
+            log.debug(f"[dim]Starting shell session in '{working_dir}'")
+            session = ShellSession(working_dir, env)
+
+        try:
+            return session.run(command, timeout)
+        finally:
+            if session.alive:
+                with self._lock:
+                    self._idle.setdefault(key, []).append(session)
+
+    def close(self) -> None:
+        """Stop every session."""
+        with self._lock:
+            sessions = [session for idle in self._idle.values() for session in idle]
+            self._idle = {}
+        for session in sessions:
+            session.close()
+        if self.num_started > 0:
+            log.debug(f"Closed {self.num_started} shell sessions")
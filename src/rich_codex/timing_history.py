@@ -0,0 +1,130 @@
+"""History of how long each image took to generate, to start the slowest ones first."""
+
+import hashlib
+import json
+import logging
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from rich_codex.render_cache import make_cache_dir
+
+if TYPE_CHECKING:
+    from rich_codex.rich_img import RichImg
+
+log = logging.getLogger("rich-codex")
+
+# Saved in the cache directory, alongside the render cache
+TIMING_HISTORY_FILENAME = "timings.jsonl"
+# Rewritten with one line per image once it has this many times more lines than that
+COMPACT_RATIO = 4
+# Weight of the latest timing, against the history so far
+SMOOTHING = 0.5
+
+
+class TimingHistory:
+    """Seconds spent running the command, rendering and converting, for each image with a command.
+
+    Each run appends a line for every image it timed, as `[key, command, render, convert]`,
+    and the last line for an image wins when loading. Once the file has many more lines
+    than images, it's rewritten with one line per image. Appending and rewriting take a
+    file lock where there is one, so runs at the same time don't lose each other's lines.
+    """
+
+    def __init__(self, cache_dir: str | Path) -> None:
+        """Load the history from the cache directory, if there is one."""
+        self.cache_dir = Path(cache_dir)
+        self.history_fn = self.cache_dir / TIMING_HISTORY_FILENAME
+        self.num_lines = 0
+        self.timings: dict[str, tuple[float, float, float]] = self._load()
+        self._new: dict[str, tuple[float, float, float]] = {}
+
+    def _load(self) -> dict[str, tuple[float, float, float]]:
+        timings: dict[str, tuple[float, float, float]] = {}
+        try:
+            lines = self.history_fn.read_text(encoding="utf-8").splitlines()
+        except OSError:
+            return timings
+        for line in lines:
+            self.num_lines += 1
+            try:
+                key, command, render, convert = json.loads(line)
+                timings[str(key)] = (float(command), float(render), float(convert))
+            except (TypeError, ValueError):
+                # A line cut short by a run that was killed part way through writing it
+                continue
+        return timings
+
+    @staticmethod
+    def key(img_obj: "RichImg") -> str:
+        """Key for an image: what goes into running its command, and the types of image it saves."""
+        suffixes = sorted({Path(img_path).suffix.lower() for img_path in img_obj.img_paths})
+        return hashlib.sha256(json.dumps([img_obj.exec_key(), suffixes]).encode("utf-8")).hexdigest()[:16]
+
+    def predict(self, img_obj: "RichImg") -> float | None:
+        """Seconds that an image is expected to take, or None if it has no history."""
+        if img_obj.command is None:
+            return None
+        timings = self.timings.get(self.key(img_obj))
+        return sum(timings) if timings is not None else None
+
+    def record(self, img_obj: "RichImg") -> None:
+        """Add the timings of an image whose command was run.
+
+        Images whose output was replayed from a cassette, reused from another image or
+        restored from the render cache have no command timing, and are left out.
+        """
+        if img_obj.command is None or "command" not in img_obj.timings:
+            return
+        key = self.key(img_obj)
+        new = (
+            img_obj.timings["command"],
+            img_obj.timings.get("render", 0.0),
+            img_obj.timings.get("convert", 0.0),
+        )
+        old = self.timings.get(key)
+        if old is not None:
+            command, render, convert = (SMOOTHING * n + (1 - SMOOTHING) * o for n, o in zip(new, old))
+            new = (command, render, convert)
+        self.timings[key] = new
+        self._new[key] = new
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Stop other runs from appending while the history is rewritten, where file locks are available."""
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        with open(self.cache_dir / f".{TIMING_HISTORY_FILENAME}.lock", "w") as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            yield
+
+    def save(self) -> None:
+        """Append the timings from this run, and compact the history if it has grown too long."""
+        if len(self._new) == 0:
+            return
+        make_cache_dir(self.cache_dir)
+        lines = "".join(json.dumps([key, *(round(t, 3) for t in new)]) + "\n" for key, new in self._new.items())
+        with self._locked():
+            with open(self.history_fn, "a", encoding="utf-8") as fh:
+                fh.write(lines)
+            self.num_lines += len(self._new)
+            if self.num_lines > COMPACT_RATIO * len(self.timings):
+                self._compact()
+        log.debug(f"[dim]Saved timings of {len(self._new)} images to the timing history")
+        self._new = {}
+
+    def _compact(self) -> None:
+        """Rewrite the history with the last line for each image, including any appended by other runs."""
+        self.timings = self._load()
+        tmp_fn = self.history_fn.with_name(f".{TIMING_HISTORY_FILENAME}.{os.getpid()}.tmp")
+        tmp_fn.write_text(
+            "".join(json.dumps([key, *timings]) + "\n" for key, timings in self.timings.items()), encoding="utf-8"
+        )
+        os.replace(tmp_fn, self.history_fn)
+        self.num_lines = len(self.timings)
+        log.debug(f"[dim]Compacted the timing history to {self.num_lines} images")
@@ -1,15 +1,64 @@
 import logging
-from collections.abc import Iterable
+import os
+import re
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-from git import Repo
-from git.exc import InvalidGitRepositoryError
-from jsonschema import Draft4Validator
-from jsonschema.exceptions import ValidationError
+import yaml
+
+# GitPython and jsonschema are slow to import and many runs don't need them, so are imported where they're used
+if TYPE_CHECKING:
+    from jsonschema import Draft4Validator
+    from jsonschema.exceptions import ValidationError
 
 log = logging.getLogger("rich-codex")
 
+# Parse the config schema file once, it's the same for every image and every search
+config_schema_fn = Path(__file__).parent / "config-schema.yml"
+with config_schema_fn.open() as fh:
+    # The C loader is much faster, if PyYAML was built with it
+    CONFIG_SCHEMA: dict[str, Any] = yaml.load(fh, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+# Log records from jobs running in parallel are held here, to be replayed in a stable order
+_log_buffer: ContextVar[list[logging.LogRecord] | None] = ContextVar("rich_codex_log_buffer", default=None)
+
+
+class _LogBufferFilter(logging.Filter):
+    """Divert log records into the current buffer, if one is active."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        buffer = _log_buffer.get()
+        if buffer is None:
+            return True
+        buffer.append(record)
+        return False
+
+
+log.addFilter(_LogBufferFilter())
+
+
+@contextmanager
+def buffered_logs(records: list[logging.LogRecord]) -> Iterator[None]:
+    """Hold back rich-codex log records in this context, saving them to 'records'.
+
+    The context is per thread and per asyncio task, so parallel jobs each get their own.
+    """
+    token = _log_buffer.set(records)
+    try:
+        yield
+    finally:
+        _log_buffer.reset(token)
+
+
+def replay_logs(records: list[logging.LogRecord]) -> None:
+    """Emit log records that were held back by buffered_logs()."""
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+
 
 def relative_path(path: str | Path | None, base: Path | None = None) -> str:
     """Path relative to the working directory, or as given if it's outside it."""
@@ -70,6 +119,67 @@ def clean_list(unclean_lines: list[str]) -> list[str]:
     return clean_lines
 
 
+def glob_to_regex(pattern: str) -> str:
+    """Translate a glob pattern, as used by Path.glob(), to a regex for relative POSIX paths.
+
+    '*', '?' and '[...]' match within one path component and '**' matches any number of
+    whole directories. A trailing '**' also matches the directory it's in, so that the
+    pattern 'build/**' covers the 'build' directory itself.
+    """
+    segments = [segment for segment in pattern.split("/") if segment not in ["", "."]]
+    regex = ""
+    for idx, segment in enumerate(segments):
+        last = idx == len(segments) - 1
+        if segment == "**":
+            if not last:
+                regex += "(?:[^/]+/)*"
+            elif idx == 0:
+                regex += ".*"
+            else:
+                regex = regex.removesuffix("/") + "(?:/.*)?"
+            continue
+        regex += _glob_segment_to_regex(segment) + ("" if last else "/")
+    return regex
+
+
+def _glob_segment_to_regex(segment: str) -> str:
+    """Translate one path component of a glob pattern to a regex."""
+    regex = ""
+    idx = 0
+    while idx < len(segment):
+        char = segment[idx]
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[":
+            # A ']' straight after the '[' or '[!' is part of the set, not the end of it
+            end = idx + 2 if segment[idx + 1 : idx + 2] == "!" else idx + 1
+            end = segment.find("]", end + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                chars = segment[idx + 1 : end].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    regex += f"[^/{chars[1:]}]"
+                else:
+                    regex += "[" + ("\\" + chars if chars.startswith("^") else chars) + "]"
+                idx = end
+        else:
+            regex += re.escape(char)
+        idx += 1
+    return regex
+
+
+def compile_globs(patterns: list[str]) -> re.Pattern[str] | None:
+    """Compile a list of glob patterns into one regex that matches a path if any of them do."""
+    if len(patterns) == 0:
+        return None
+    # Same as Path.glob(), which is case-insensitive on Windows
+    flags = re.IGNORECASE if os.path.normcase("A") == "a" else 0
+    return re.compile("|".join(f"(?:{glob_to_regex(pattern)})" for pattern in patterns), flags)
+
+
 def parse_extra_env(extra_env_raw: str) -> dict[str, str]:
     """Parse newline-separated 'KEY=value' pairs into a dict of environment variables."""
     extra_env: dict[str, str] = {}
@@ -81,18 +191,111 @@ def parse_extra_env(extra_env_raw: str) -> dict[str, str]:
     return extra_env
 
 
-def check_git_status() -> tuple[bool, str]:
-    """Check if the working directory is a clean git repo."""
+def check_git_status(paths: Iterable[str | Path] | None = None) -> tuple[bool, str]:
+    """Check if the working directory is a clean git repo.
+
+    With paths, only changes to those files, or to files in those directories, count.
+    Either way it's a single 'git status', so that the untracked cache and fsmonitor
+    are used if the repo has them turned on.
+    """
+    from git import Repo
+    from git.exc import InvalidGitRepositoryError
+
+    start = time.perf_counter()
     try:
         repo = Repo(Path.cwd().resolve(), search_parent_directories=True)
-        if repo.is_dirty(untracked_files=True):
-            changedFiles = [item.a_path for item in repo.index.diff(None)]
-            return (False, f"Found uncommitted changes: {changedFiles + repo.untracked_files}")
     except InvalidGitRepositoryError:
         return (False, "Does not appear to be a git repository")
+
+    # Pathspecs are relative to the top of the repo, which is where GitPython runs git
+    pathspecs: list[str] = []
+    if paths is not None:
+        repo_root = Path(str(repo.working_tree_dir)).resolve()
+        for path in {Path(path).resolve() for path in paths}:
+            if not path.is_relative_to(repo_root):
+                log.debug(f"[dim]Not checking git status of '{relative_path(path)}', it's outside the repo")
+                continue
+            # ':/' is the whole repo, a literal '.' wouldn't match anything
+            pathspecs.append(f":(top,literal){path.relative_to(repo_root).as_posix()}" if path != repo_root else ":/")
+        if len(pathspecs) == 0:
+            return (True, "No files to check in the git repo.")
+
+    # Untracked directories are listed once, instead of every file inside them
+    status = repo.git.status("--porcelain", "-z", "--untracked-files=normal", "--", *sorted(pathspecs))
+    changed_files = []
+    entries = iter(status.split("\0"))
+    for entry in entries:
+        if entry:
+            changed_files.append(entry[3:])
+            # Renames and copies are followed by the original path
+            if entry[0] in "RC":
+                next(entries, None)
+    log.debug(
+        f"[dim]Checked git status of {f'{len(pathspecs)} paths' if paths is not None else 'the repo'}"
+        f" in {time.perf_counter() - start:.2f}s"
+    )
+    if len(changed_files) > 0:
+        return (False, f"Found uncommitted changes: {changed_files}")
     return (True, "Git repo looks good.")
 
 
+def changed_files(ref: str) -> set[Path]:
+    """Files that have changed in the git repo since a commit, including untracked files.
+
+    Renamed files are listed under both names. Raises ValueError if there's no repo or
+    the ref can't be found.
+    """
+    from git import Repo
+    from git.exc import GitCommandError, InvalidGitRepositoryError
+
+    try:
+        repo = Repo(Path.cwd().resolve(), search_parent_directories=True)
+        # Both commands list paths relative to the top of the repo, which is where GitPython runs git
+        changed = repo.git.diff("--name-only", "--no-renames", "-z", ref, "--")
+        untracked = repo.git.ls_files("--others", "--exclude-standard", "-z")
+    except InvalidGitRepositoryError:
+        raise ValueError("Does not appear to be a git repository")
+    except GitCommandError as e:
+        raise ValueError(f"Couldn't find changes since '{ref}': {str(e.stderr).strip()}")
+    repo_root = Path(str(repo.working_tree_dir)).resolve()
+    return {repo_root / name for name in f"{changed}\0{untracked}".split("\0") if name}
+
+
+# Validators are slow to build, so are kept for each schema
+_validators: dict[int, tuple[dict[str, Any], "Draft4Validator"]] = {}
+
+
+def get_validator(schema: dict[str, Any]) -> "Draft4Validator":
+    """Build a validator for a schema the first time it's needed, then reuse it.
+
+    References within the schema are resolved up front, instead of for every value
+    that is validated.
+    """
+    from jsonschema import Draft4Validator
+
+    cached = _validators.get(id(schema))
+    # Check it's the same object, as ids can be reused once a schema is garbage collected
+    if cached is None or cached[0] is not schema:
+        cached = (schema, Draft4Validator(_inline_refs(schema, schema)))
+        _validators[id(schema)] = cached
+    return cached[1]
+
+
+def _inline_refs(node: Any, root: dict[str, Any]) -> Any:
+    """Copy a schema, replacing local references such as {"$ref": "#/$defs/head"} with what they point to."""
+    if isinstance(node, dict):
+        ref = node.get("$ref")
+        if len(node) == 1 and isinstance(ref, str) and ref.startswith("#/"):
+            target: Any = root
+            for part in ref[2:].split("/"):
+                target = target[part.replace("~1", "/").replace("~0", "~")]
+            return _inline_refs(target, root)
+        return {key: _inline_refs(value, root) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_inline_refs(value, root) for value in node]
+    return node
+
+
 def validate_config(
     schema: dict[str, Any],
     config: dict[str, Any],
@@ -100,15 +303,46 @@ def validate_config(
     line_number: int | None = None,
 ) -> None:
     """Validate a config file string against the rich-codex JSON schema."""
+    from jsonschema.exceptions import ValidationError
+
+    errors = list(get_validator(schema).iter_errors(config))
+    if len(errors) > 0:
+        raise ValidationError(_validation_message(errors, filename, line_number))
+
+
+def validate_outputs(
+    schema: dict[str, Any],
+    outputs: list[tuple[dict[str, Any], str | Path, int | None]],
+) -> list["ValidationError | None"]:
+    """Validate the configs for many outputs against the rich-codex JSON schema, in one pass.
+
+    Takes the config, filename and line number of each output. Returns an error for each
+    output that was invalid, with the same message as validate_config(), or None if it was valid.
+    """
+    from jsonschema.exceptions import ValidationError
+
+    output_errors: list[list[ValidationError]] = [[] for _ in outputs]
+    for error in get_validator(schema).iter_errors({"outputs": [config for config, _, _ in outputs]}):
+        # Errors are for an output, unless the list itself is invalid
+        if len(error.path) > 1:
+            output_errors[error.path[1]].append(error)
+        else:
+            for errors in output_errors:
+                errors.append(error)
+    return [
+        ValidationError(_validation_message(errors, filename, line_number)) if len(errors) > 0 else None
+        for errors, (_, filename, line_number) in zip(output_errors, outputs)
+    ]
+
+
+def _validation_message(errors: list["ValidationError"], filename: str | Path, line_number: int | None) -> str:
+    """Describe validation errors for a config, with where it came from."""
     ln_text = f"line {line_number} " if line_number else ""
-    v = Draft4Validator(schema)
-    if not v.is_valid(config):
-        err_msg = f"[red][✗] Rich-codex config in '{filename}' {ln_text}was invalid"
-
-        for error in sorted(v.iter_errors(config), key=str):
-            err_msg += f"\n - {error.message}"
-            if len(error.context):
-                err_msg += ":"
-            for suberror in sorted(error.context, key=lambda e: e.schema_path):
-                err_msg += f"\n     * {suberror.message}"
-        raise ValidationError(err_msg)
+    err_msg = f"[red][✗] Rich-codex config in '{filename}' {ln_text}was invalid"
+    for error in sorted(errors, key=str):
+        err_msg += f"\n - {error.message}"
+        if len(error.context):
+            err_msg += ":"
+        for suberror in sorted(error.context, key=lambda e: e.schema_path):
+            err_msg += f"\n     * {suberror.message}"
+    return err_msg
@@ -35,6 +35,15 @@ CODEX_SEARCH_DEFAULTS = {
     "configs": None,
     "no_confirm": True,
     "no_dedupe": False,
+    "jobs": 1,
+    "convert_workers": 0,
+    "render_cache": None,
+    "search_index": None,
+    "shell_sessions": None,
+    "preload_server": None,
+    "record_cassette": None,
+    "replay_cassette": None,
+    "timing_history": None,
     "extra_env": None,
     "snippet_syntax": None,
     "timeout": 5,
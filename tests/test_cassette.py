@@ -0,0 +1,149 @@
+"""Tests for rich_codex.cassette."""
+
+import json
+import zlib
+
+import pytest
+
+from rich_codex import __version__
+from rich_codex import cassette as cassette_module
+from rich_codex.cassette import CassettePlayer, CassetteRecorder
+
+
+def record(path, outputs):
+    """Record a cassette with the given output for each key."""
+    recorder = CassetteRecorder(path)
+    for key, data in outputs.items():
+        assert recorder.start(key)
+        recorder.write(key, data)
+        recorder.finish(key)
+    recorder.close()
+
+
+class TestCassette:
+    """Tests for recording and replaying cassettes."""
+
+    def test_round_trip(self, tmp_path):
+        record(tmp_path / "tape.rcx", {"one": b"first output\n", "two": b"\x1b[31mred\x1b[0m\n", "empty": b""})
+        player = CassettePlayer(tmp_path / "tape.rcx")
+        assert b"".join(player.read("one")) == b"first output\n"
+        assert b"".join(player.read("two")) == b"\x1b[31mred\x1b[0m\n"
+        assert list(player.read("empty")) == []
+        assert "missing" not in player
+        player.close()
+
+    def test_output_is_chunked(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(cassette_module, "CHUNK_SIZE", 10)
+        record(tmp_path / "tape.rcx", {"long": b"0123456789" * 5 + b"end"})
+        player = CassettePlayer(tmp_path / "tape.rcx")
+        chunks = list(player.read("long"))
+        assert chunks == [b"0123456789"] * 5 + [b"end"]
+        assert player.records["long"]["size"] == 53
+        player.close()
+
+    def test_commands_recorded_at_the_same_time(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(cassette_module, "CHUNK_SIZE", 4)
+        recorder = CassetteRecorder(tmp_path / "tape.rcx")
+        recorder.start("one")
+        recorder.start("two")
+        for data in (b"aaaa", b"bbbb", b"aa", b"bb"):
+            recorder.write("one" if data.startswith(b"a") else "two", data)
+        recorder.finish("one")
+        recorder.finish("two")
+        recorder.close()
+        player = CassettePlayer(tmp_path / "tape.rcx")
+        assert b"".join(player.read("one")) == b"aaaaaa"
+        assert b"".join(player.read("two")) == b"bbbbbb"
+        player.close()
+
+    def test_each_key_is_recorded_once(self, tmp_path):
+        recorder = CassetteRecorder(tmp_path / "tape.rcx")
+        assert recorder.start("one")
+        assert not recorder.start("one")
+        recorder.finish("one")
+        recorder.close()
+
+    def test_unfinished_commands_are_left_out(self, tmp_path):
+        recorder = CassetteRecorder(tmp_path / "tape.rcx")
+        recorder.start("one")
+        recorder.write("one", b"partial")
+        recorder.close()
+        assert "one" not in CassettePlayer(tmp_path / "tape.rcx")
+
+    def test_cassette_only_replaces_the_old_one_when_closed(self, tmp_path):
+        record(tmp_path / "tape.rcx", {"old": b"old"})
+        recorder = CassetteRecorder(tmp_path / "tape.rcx")
+        assert "old" in CassettePlayer(tmp_path / "tape.rcx")
+        recorder.close()
+        assert "old" not in CassettePlayer(tmp_path / "tape.rcx")
+        assert list(tmp_path.iterdir()) == [tmp_path / "tape.rcx"]
+
+    def test_aborted_recording_leaves_the_old_cassette(self, tmp_path):
+        record(tmp_path / "tape.rcx", {"old": b"old"})
+        recorder = CassetteRecorder(tmp_path / "tape.rcx")
+        recorder.start("new")
+        recorder.write("new", b"new")
+        recorder.abort()
+        recorder.close()
+        assert "old" in CassettePlayer(tmp_path / "tape.rcx")
+        assert list(tmp_path.iterdir()) == [tmp_path / "tape.rcx"]
+
+    def test_failure_while_closing_removes_the_temporary_file(self, tmp_path, monkeypatch):
+        recorder = CassetteRecorder(tmp_path / "tape.rcx")
+
+        def fail(*args):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(cassette_module.os, "replace", fail)
+        with pytest.raises(OSError, match="disk full"):
+            recorder.close()
+        assert list(tmp_path.iterdir()) == []
+
+    def test_only_the_index_is_read_when_opened(self, tmp_path, monkeypatch):
+        record(tmp_path / "tape.rcx", {"big": b"x" * 5_000_000})
+        decompressed = []
+        decompress = cassette_module.zlib.decompress
+        monkeypatch.setattr(
+            cassette_module.zlib, "decompress", lambda data: decompressed.append(data) or decompress(data)
+        )
+        player = CassettePlayer(tmp_path / "tape.rcx")
+        assert len(decompressed) == 1
+        next(player.read("big"))
+        assert len(decompressed) == 2
+        player.close()
+
+
+class TestCassettePlayerErrors:
+    """Tests for opening files that aren't complete cassettes."""
+
+    def test_missing_file(self, tmp_path):
+        with pytest.raises(ValueError, match="Couldn't open cassette"):
+            CassettePlayer(tmp_path / "missing.rcx")
+
+    def test_not_a_cassette(self, tmp_path):
+        (tmp_path / "tape.rcx").write_text("hello")
+        with pytest.raises(ValueError, match="not a rich-codex cassette"):
+            CassettePlayer(tmp_path / "tape.rcx")
+
+    def test_incomplete_cassette(self, tmp_path):
+        record(tmp_path / "tape.rcx", {"one": b"output"})
+        data = (tmp_path / "tape.rcx").read_bytes()
+        (tmp_path / "tape.rcx").write_bytes(data[:-5])
+        with pytest.raises(ValueError, match="incomplete"):
+            CassettePlayer(tmp_path / "tape.rcx")
+
+    def test_recorded_with_another_version(self, tmp_path, monkeypatch, caplog):
+        monkeypatch.setattr(cassette_module, "__version__", "0.0.1")
+        record(tmp_path / "tape.rcx", {"one": b"output"})
+        monkeypatch.setattr(cassette_module, "__version__", __version__)
+        player = CassettePlayer(tmp_path / "tape.rcx")
+        assert f"recorded with rich-codex 0.0.1, this is {__version__}" in caplog.text
+        assert b"".join(player.read("one")) == b"output"
+        player.close()
+
+    def test_index_without_a_version(self, tmp_path):
+        index = zlib.compress(json.dumps({"records": {}}).encode("utf-8"))
+        footer = cassette_module.FOOTER.pack(len(cassette_module.MAGIC), len(index), cassette_module.MAGIC)
+        (tmp_path / "tape.rcx").write_bytes(cassette_module.MAGIC + index + footer)
+        with pytest.raises(ValueError, match="can't read"):
+            CassettePlayer(tmp_path / "tape.rcx")
@@ -1,6 +1,8 @@
 """Tests for rich_codex.cli, driven through Click's CliRunner."""
 
+import json
 import logging
+from pathlib import Path
 
 import pytest
 from click.testing import CliRunner
@@ -97,20 +99,52 @@ class TestGitChecks:
     """Tests for the git safety checks."""
 
     def test_dirty_repo_exits(self, runner, tmp_cwd, monkeypatch):
-        monkeypatch.setattr("rich_codex.utils.check_git_status", lambda: (False, "Found uncommitted changes: [x]"))
+        monkeypatch.setattr(
+            "rich_codex.utils.check_git_status", lambda paths=None: (False, "Found uncommitted changes: [x]")
+        )
         result = runner.invoke(main, ["--no-search"], catch_exceptions=False)
         assert result.exit_code == 1
 
     def test_skip_git_checks_continues(self, runner, tmp_cwd, monkeypatch):
-        monkeypatch.setattr("rich_codex.utils.check_git_status", lambda: (False, "Found uncommitted changes: [x]"))
+        monkeypatch.setattr(
+            "rich_codex.utils.check_git_status", lambda paths=None: (False, "Found uncommitted changes: [x]")
+        )
         result = runner.invoke(main, ["--skip-git-checks", "--no-search"], catch_exceptions=False)
         assert result.exit_code == 0
 
     def test_clean_repo_continues(self, runner, tmp_cwd, monkeypatch):
-        monkeypatch.setattr("rich_codex.utils.check_git_status", lambda: (True, "Git repo looks good."))
+        monkeypatch.setattr("rich_codex.utils.check_git_status", lambda paths=None: (True, "Git repo looks good."))
         result = runner.invoke(main, ["--no-search"], catch_exceptions=False)
         assert result.exit_code == 0
 
+    def test_scoped_checks_use_searched_files(self, runner, tmp_cwd, monkeypatch):
+        (tmp_cwd / "README.md").write_text("![`echo hi`](img/out.svg)\n")
+        write(tmp_cwd / "img" / "old.svg", "<svg></svg>")
+        checked = []
+
+        def check_git_status(paths=None):
+            checked.append({Path(path).resolve() for path in paths})
+            return (True, "Git repo looks good.")
+
+        monkeypatch.setattr("rich_codex.utils.check_git_status", check_git_status)
+        result = runner.invoke(
+            main, ["--scoped-git-checks", "--no-confirm", "--clean-img-paths", "img/*.svg"], catch_exceptions=False
+        )
+        assert result.exit_code == 0
+        assert checked == [{(tmp_cwd / name).resolve() for name in ["README.md", "img/out.svg", "img/old.svg"]}]
+
+    def test_scoped_checks_exit_before_running_commands(self, runner, tmp_cwd, monkeypatch):
+        monkeypatch.setattr(
+            "rich_codex.utils.check_git_status", lambda paths=None: (False, "Found uncommitted changes: [x]")
+        )
+        result = runner.invoke(
+            main,
+            ["--scoped-git-checks", "--command", "touch ran.txt", "--img-paths", "out.svg", "--no-confirm"],
+            catch_exceptions=False,
+        )
+        assert result.exit_code == 1
+        assert not (tmp_cwd / "ran.txt").exists()
+
 
 class TestSnippetAndCommand:
     """Tests for generating a single image from the command line."""
@@ -236,6 +270,86 @@ class TestSearch:
         assert (tmp_cwd / "readme.svg").exists()
         assert not (tmp_cwd / "other.svg").exists()
 
+    def test_jobs_option(self, runner, tmp_cwd):
+        (tmp_cwd / "README.md").write_text("![`echo one`](one.svg)\n![`echo two`](two.svg)\n")
+        result = invoke(runner, ["--jobs", "2", "--no-confirm"])
+        assert result.exit_code == 0
+        assert "Saved 2 images" in result.output
+
+    def test_jobs_must_be_positive(self, runner, tmp_cwd):
+        result = invoke(runner, ["--jobs", "0"])
+        assert result.exit_code != 0
+
+    def test_convert_workers_option(self, runner, tmp_cwd):
+        (tmp_cwd / "README.md").write_text("![`echo one`](one.svg)\n![`echo two`](two.svg)\n")
+        result = invoke(runner, ["--convert-workers", "2", "--no-confirm"])
+        assert result.exit_code == 0
+        assert "Saved 2 images" in result.output
+
+    def test_convert_workers_cant_be_negative(self, runner, tmp_cwd):
+        result = invoke(runner, ["--convert-workers", "-1"])
+        assert result.exit_code != 0
+
+    def test_shell_sessions_option(self, runner, tmp_cwd):
+        (tmp_cwd / "README.md").write_text("![`echo one`](one.svg)\n![`echo two`](two.svg)\n")
+        result = invoke(runner, ["--shell-sessions", "--jobs", "2", "--no-confirm", "--verbose"])
+        assert result.exit_code == 0
+        assert "Saved 2 images" in result.output
+        assert "in a shell session" in result.output
+        assert "two" in svg_text(tmp_cwd / "two.svg")
+
+    def test_preload_option(self, runner, tmp_cwd):
+        (tmp_cwd / "README.md").write_text("![`rich-codex --help`](help.svg)\n")
+        result = invoke(runner, ["--preload", "rich-codex", "--no-confirm", "--verbose"])
+        assert result.exit_code == 0
+        assert "in a fork of the preload server" in result.output
+        assert "Usage: rich-codex [OPTIONS]" in svg_text(tmp_cwd / "help.svg")
+
+    def test_record_and_replay(self, runner, tmp_cwd):
+        (tmp_cwd / "README.md").write_text("![`echo recorded; touch ran.txt`](out.svg)\n")
+        result = invoke(runner, ["--record", "tape.rcx", "--no-confirm"])
+        assert result.exit_code == 0
+        assert "Recorded the output of 1 commands" in result.output
+        (tmp_cwd / "ran.txt").unlink()
+        result = invoke(runner, ["--replay", "tape.rcx", "--terminal-theme", "MONOKAI", "--no-confirm"])
+        assert result.exit_code == 0
+        assert "Saved 1 images" in result.output
+        assert "recorded" in svg_text(tmp_cwd / "out.svg")
+        assert not (tmp_cwd / "ran.txt").exists()
+
+    def test_failed_recording_leaves_no_temporary_file(self, runner, tmp_cwd):
+        (tmp_cwd / "README.md").write_text("<!-- RICH-CODEX ]not: [valid -->\n![`echo hi`](out.svg)\n")
+        result = invoke(runner, ["--record", "tape.rcx", "--no-confirm"])
+        assert result.exit_code == 1
+        assert not (tmp_cwd / "tape.rcx").exists()
+        assert not (tmp_cwd / "tape.rcx.tmp").exists()
+
+    def test_replay_leaves_the_timing_history_alone(self, runner, tmp_cwd):
+        (tmp_cwd / "README.md").write_text("![`sleep 0.2; echo recorded`](out.svg)\n")
+        result = invoke(runner, ["--record", "tape.rcx", "--no-confirm", "--jobs", "2"])
+        assert result.exit_code == 0
+        history = (tmp_cwd / ".rich-codex-cache" / "timings.jsonl").read_text()
+        assert len(history.splitlines()) == 1
+        result = invoke(runner, ["--replay", "tape.rcx", "--terminal-theme", "MONOKAI", "--no-confirm", "--jobs", "2"])
+        assert result.exit_code == 0
+        assert "recorded" in svg_text(tmp_cwd / "out.svg")
+        assert (tmp_cwd / ".rich-codex-cache" / "timings.jsonl").read_text() == history
+
+    def test_record_and_replay_together(self, runner, tmp_cwd):
+        result = invoke(runner, ["--record", "one.rcx", "--replay", "two.rcx"])
+        assert result.exit_code != 0
+        assert "either --record OR --replay" in result.output
+
+    def test_replay_missing_cassette(self, runner, tmp_cwd):
+        result = invoke(runner, ["--replay", "missing.rcx"])
+        assert result.exit_code != 0
+        assert "Couldn't open cassette" in result.output
+
+    def test_invalid_preload(self, runner, tmp_cwd):
+        result = invoke(runner, ["--preload", "my-tool=module"])
+        assert result.exit_code != 0
+        assert "Can't preload 'my-tool=module'" in result.output
+
     def test_unchanged_images_are_reported_as_skipped(self, runner, tmp_cwd):
         args = ["--snippet", "hi", "--snippet-syntax", "text", "--img-paths", "out.svg"]
         assert invoke(runner, args).exit_code == 0
@@ -243,12 +357,80 @@ class TestSearch:
         assert result.exit_code == 0
         assert "Skipped 1 images" in result.output
 
+    def test_snippets_are_cached(self, runner, tmp_cwd):
+        args = ["--snippet", "hi", "--snippet-syntax", "text", "--img-paths", "out.svg", "--verbose"]
+        assert invoke(runner, args).exit_code == 0
+        result = invoke(runner, args)
+        assert "Render cache hit" in result.output
+        assert (tmp_cwd / ".rich-codex-cache").is_dir()
+
+    def test_command_timings_are_saved(self, runner, tmp_cwd):
+        write(tmp_cwd / "README.md", "![`echo hi`](out.svg)\n")
+        result = invoke(runner, ["--no-confirm", "--jobs", "2"])
+        assert result.exit_code == 0
+        assert len((tmp_cwd / ".rich-codex-cache" / "timings.jsonl").read_text().splitlines()) == 1
+
+    def test_command_timings_are_only_saved_with_jobs(self, runner, tmp_cwd):
+        write(tmp_cwd / "README.md", "![`echo hi`](out.svg)\n")
+        result = invoke(runner, ["--no-confirm"])
+        assert result.exit_code == 0
+        assert not (tmp_cwd / ".rich-codex-cache" / "timings.jsonl").exists()
+
+    def test_profile(self, runner, tmp_cwd):
+        write(tmp_cwd / "README.md", "![`echo hi`](out.svg)\n")
+        result = invoke(runner, ["--no-confirm", "--profile", "trace.json"])
+        assert result.exit_code == 0
+        assert "Profile:" in result.output
+        trace = json.loads((tmp_cwd / "trace.json").read_text())
+        assert {"command", "save svg", "compare", "write"} <= {event["name"] for event in trace["traceEvents"]}
+
+    def test_no_cache(self, runner, tmp_cwd):
+        result = invoke(runner, ["--snippet", "hi", "--img-paths", "out.svg", "--no-cache"])
+        assert result.exit_code == 0
+        assert not (tmp_cwd / ".rich-codex-cache").exists()
+
     def test_nothing_to_do_warns(self, runner, tmp_cwd):
         result = invoke(runner, ["--no-search"])
         assert result.exit_code == 0
         assert "Couldn't find anything to do" in result.output
 
 
+class TestSince:
+    """Tests for --since."""
+
+    @pytest.fixture
+    def repo(self, tmp_cwd):
+        from git import Repo
+
+        repo = Repo.init(tmp_cwd)
+        write(tmp_cwd / "one.md", "![`echo one`](one.svg)\n")
+        write(tmp_cwd / "two.md", "![`echo two`](two.svg)\n")
+        repo.index.add(["one.md", "two.md"])
+        repo.index.commit("initial", author_date="2022-01-01T00:00:00", commit_date="2022-01-01T00:00:00")
+        return repo
+
+    def test_only_changed_files_are_generated(self, runner, repo, tmp_cwd):
+        write(tmp_cwd / "two.md", "# Changed\n![`echo two`](two.svg)\n")
+        result = invoke(runner, ["--since", "HEAD", "--no-confirm", "--no-cache"])
+        assert result.exit_code == 0
+        assert not (tmp_cwd / "one.svg").exists()
+        assert (tmp_cwd / "two.svg").exists()
+        assert "Searching 1 of 2 files, skipping unchanged files" in result.output
+        assert "Generating 1 of 1 images, affected by changes since 'HEAD'" in result.output
+
+    def test_cleaning_is_disabled(self, runner, repo, tmp_cwd):
+        write(tmp_cwd / "old.svg", "<svg></svg>")
+        result = invoke(runner, ["--since", "HEAD", "--no-confirm", "--clean-img-paths", "*.svg"])
+        assert result.exit_code == 0
+        assert (tmp_cwd / "old.svg").exists()
+        assert "Not cleaning images with '--since'" in result.output
+
+    def test_unknown_ref_is_a_usage_error(self, runner, repo):
+        result = invoke(runner, ["--since", "not-a-branch", "--no-confirm"])
+        assert result.exit_code == 2
+        assert "Couldn't find changes since 'not-a-branch'" in result.output
+
+
 class TestFileLists:
     """Tests for --created-files, --deleted-files and --clean-img-paths."""
 
@@ -376,6 +558,48 @@ class TestEntryPoint:
         assert __version__.count(".") >= 2
 
 
+# Modules that only some runs need, so must not be imported just to start the CLI
+LAZY_MODULES = ["git", "jsonschema", "Levenshtein", "asyncio", "difflib", "concurrent.futures", "cairosvg"]
+
+# Cumulative import time of rich_codex.cli, in microseconds, with plenty of headroom for slow machines
+IMPORT_TIME_BUDGET_US = 400_000
+
+
+def import_times(*args):
+    """Run Python with -X importtime and return the cumulative import time of each module."""
+    import subprocess
+    import sys
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestStartupTime:
+    """Tests that starting rich-codex stays quick, for hooks that run it many times."""
+
+    def test_help_does_not_import_heavy_modules(self, tmp_cwd):
+        imported = import_times("-m", "rich_codex", "--help")
+        assert "rich_codex.cli" in imported
+        assert [module for module in LAZY_MODULES if module in imported] == []
+
+    def test_import_time_budget(self):
+        # Best of three, so that one slow run on a busy machine doesn't fail the test
+        best = min(import_times("-c", "import rich_codex.cli")["rich_codex.cli"] for _ in range(3))
+        assert best < IMPORT_TIME_BUDGET_US, f"Importing rich_codex.cli took {best / 1000:.0f}ms"
+
+
 def test_cli_module_defines_option_groups():
     """rich-click option groups keep --help readable; every option in them must exist."""
     from rich_codex import cli
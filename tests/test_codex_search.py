@@ -1,13 +1,24 @@
 """Tests for rich_codex.codex_search."""
 
+import time
 from pathlib import Path
 
 import pytest
-from conftest import write
+from conftest import svg_text, write
 from jsonschema.exceptions import ValidationError
 
 from rich_codex import codex_search as codex_search_module
+from rich_codex.codex_search import CodexSearch
 from rich_codex.rich_img import RichImg
+from rich_codex.search_index import SearchIndex
+from rich_codex.timing_history import TimingHistory
+
+
+def timed_command(command, seconds, img_path):
+    """Make an image whose command took the given number of seconds to run."""
+    img_obj = RichImg(command=command, img_paths=[img_path])
+    img_obj.timings = {"command": seconds}
+    return img_obj
 
 
 class TestInit:
@@ -126,6 +137,18 @@ class TestSearchFiles:
         cs.search_files()
         assert cs.rich_imgs[0].terminal_width == 60
 
+    def test_depends_on_config(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "README.md", '<!-- RICH-CODEX depends_on: ["../src/**/*.py"] -->\n![`echo hi`](img/hi.svg)\n')
+        cs = codex_search()
+        assert cs.search_files() == 0
+        assert cs.rich_imgs[0].depends_on == ["../src/**/*.py"]
+
+    def test_depends_on_must_be_a_list(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "README.md", "<!-- RICH-CODEX depends_on: src/*.py -->\n![`echo hi`](img/hi.svg)\n")
+        cs = codex_search()
+        assert cs.search_files() == 1
+        assert cs.rich_imgs == []
+
     def test_mdx_comment_config(self, tmp_cwd, codex_search):
         """MDX v2+ doesn't allow HTML comments, so JSX comments are supported too."""
         write(tmp_cwd / "docs.mdx", "{/* RICH-CODEX terminal_width: 60 */}\n![`echo hi`](img/hi.svg)\n")
@@ -194,6 +217,73 @@ class TestSearchFiles:
         assert cs.search_files() == 0
         assert cs.rich_imgs == []
 
+    def test_skip_config_stays_in_its_file(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "a.md", "![`echo a`](a.svg)\n<!-- RICH-CODEX skip: true -->\n")
+        write(tmp_cwd / "b.md", "![`echo b`](b.svg)\n")
+        cs = codex_search()
+        assert cs.search_files() == 0
+        assert [img.command for img in cs.rich_imgs] == ["echo a", "echo b"]
+
+    def test_search_index_gives_the_same_images(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "README.md", "<!-- RICH-CODEX terminal_width: 60 -->\n![`echo hi`](img/hi.svg)\n")
+        results = []
+        for _ in range(2):
+            cs = codex_search(search_index=SearchIndex(tmp_cwd / "cache"), terminal_theme="MONOKAI")
+            assert cs.search_files() == 0
+            results.append(cs.rich_imgs)
+        assert results[0] == results[1]
+        assert results[1][0].terminal_width == 60
+        assert results[1][0].terminal_theme == "MONOKAI"
+
+    @pytest.mark.parametrize("use_index", [False, True])
+    def test_parallel_scan_gives_the_same_images(self, tmp_cwd, codex_search, monkeypatch, caplog, use_index):
+        for i in range(12):
+            write(
+                tmp_cwd / f"doc_{i:02}.md",
+                f"# Doc {i}\n<!-- RICH-CODEX head: {i + 1} -->\n![`echo {i}`](img/{i}.svg)\n",
+            )
+        write(tmp_cwd / "plain.md", "Nothing to see here\n")
+        serial = codex_search()
+        serial.search_files()
+
+        monkeypatch.setattr(codex_search_module, "PARALLEL_SCAN_MIN_FILES", 0)
+        monkeypatch.setattr(codex_search_module.os, "cpu_count", lambda: 4)
+        search_index = SearchIndex(tmp_cwd / "cache") if use_index else None
+        parallel = codex_search(jobs=2, search_index=search_index)
+        assert parallel.search_files() == 0
+        assert "Scanning 13 files with 2 processes" in caplog.text
+        assert parallel.rich_imgs == serial.rich_imgs
+        assert [(img.command, img.head, img.source_line) for img in parallel.rich_imgs] == [
+            (f"echo {i}", i + 1, 3) for i in range(12)
+        ]
+
+    def test_only_changed_files_are_scanned(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "one.md", "![`echo one`](one.svg)\n")
+        write(tmp_cwd / "two.md", '<!-- RICH-CODEX depends_on: ["src/*.py"] -->\n![`echo two`](two.svg)\n')
+        write(tmp_cwd / "three.md", "![`echo three`](three.svg)\n")
+        cs = codex_search()
+        assert cs.search_files({tmp_cwd / "one.md"}) == 0
+        # Files with 'depends_on' are scanned too, for filter_changed() to check their dependencies
+        assert [img.command for img in cs.rich_imgs] == ["echo one", "echo two"]
+
+    def test_changed_config_scans_every_file(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "one.md", "![`echo one`](one.svg)\n")
+        write(tmp_cwd / "two.md", "![`echo two`](two.svg)\n")
+        write(tmp_cwd / ".rich-codex.yml", "terminal_width: 60\n")
+        cs = codex_search(configs=".rich-codex.yml")
+        assert cs.search_files({tmp_cwd / ".rich-codex.yml"}) == 0
+        assert [img.command for img in cs.rich_imgs] == ["echo one", "echo two"]
+
+    def test_unchanged_files_stay_in_the_search_index(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "one.md", "![`echo one`](one.svg)\n")
+        write(tmp_cwd / "two.md", "![`echo two`](two.svg)\n")
+        codex_search(search_index=SearchIndex(tmp_cwd / "cache")).search_files()
+        codex_search(search_index=SearchIndex(tmp_cwd / "cache")).search_files({tmp_cwd / "one.md"})
+        index = SearchIndex(tmp_cwd / "cache")
+        cs = codex_search(search_index=index)
+        cs.search_files()
+        assert index.num_reused == 2
+
     def test_invalid_yaml_is_an_error(self, tmp_cwd, codex_search, caplog):
         write(tmp_cwd / "README.md", "<!-- RICH-CODEX ]not: [valid -->\n![`echo hi`](img/hi.svg)\n")
         cs = codex_search()
@@ -223,6 +313,16 @@ class TestSearchFiles:
         assert cs.rich_imgs == []
         assert "was invalid" in caplog.text
 
+    def test_errors_are_reported_in_file_order(self, tmp_cwd, codex_search, caplog):
+        write(tmp_cwd / "a.md", "<!-- RICH-CODEX terminal_width: wide -->\n![`echo a`](img/a.svg)\n")
+        write(tmp_cwd / "b.md", "<!-- RICH-CODEX ]not: [valid -->\n![`echo b`](img/b.svg)\n")
+        cs = codex_search()
+        assert cs.search_files() == 2
+        errors = [record.getMessage() for record in caplog.records if record.levelname == "ERROR"]
+        assert len(errors) == 2
+        assert "a.md" in errors[0] and "was invalid" in errors[0]
+        assert "Error parsing config YAML in 'b.md'" in errors[1]
+
     def test_bad_image_suffix_is_an_error(self, tmp_cwd, codex_search):
         write(tmp_cwd / "README.md", "![`echo hi`](img/hi.jpg)\n")
         cs = codex_search()
@@ -276,6 +376,41 @@ class TestSearchFiles:
         cs.search_files()
         assert [img.command for img in cs.rich_imgs] == ["echo keep"]
 
+    def test_node_modules_are_excluded_at_any_depth(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "node_modules" / "pkg" / "README.md", "![`echo pkg`](a.svg)\n")
+        write(tmp_cwd / "site" / "node_modules" / "README.md", "![`echo nested`](b.svg)\n")
+        write(tmp_cwd / ".github" / "README.md", "![`echo github`](c.svg)\n")
+        write(tmp_cwd / "README.md", "![`echo keep`](d.svg)\n")
+        assert codex_search().find_files() == [tmp_cwd / "README.md"]
+
+    def test_excluded_directories_are_not_walked(self, tmp_cwd, codex_search, monkeypatch):
+        write(tmp_cwd / "node_modules" / "pkg" / "README.md", "")
+        write(tmp_cwd / "docs" / "README.md", "")
+        walked = []
+        os_walk = codex_search_module.os.walk
+
+        def spy_walk(top):
+            for root, dir_names, file_names in os_walk(top):
+                walked.append(Path(root).relative_to(tmp_cwd).as_posix())
+                yield root, dir_names, file_names
+
+        monkeypatch.setattr(codex_search_module.os, "walk", spy_walk)
+        codex_search().find_files()
+        assert sorted(walked) == [".", "docs"]
+
+    def test_shallow_include_patterns_dont_walk_deeper(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "docs" / "README.md", "")
+        write(tmp_cwd / "docs" / "deeper" / "README.md", "")
+        write(tmp_cwd / "README.md", "")
+        cs = codex_search(search_include="README.md\ndocs/*.md")
+        assert cs.find_files() == [tmp_cwd / "docs" / "README.md", tmp_cwd / "README.md"]
+
+    def test_gitignore_directories_are_excluded(self, tmp_cwd, codex_search):
+        write(tmp_cwd / ".gitignore", "site/\n")
+        write(tmp_cwd / "site" / "index.md", "")
+        write(tmp_cwd / "index.md", "")
+        assert codex_search().find_files() == [tmp_cwd / "index.md"]
+
     def test_invalid_exclude_pattern_is_ignored(self, tmp_cwd, codex_search):
         write(tmp_cwd / "keep.md", "![`echo keep`](a.svg)\n")
         cs = codex_search(search_exclude="/absolute/pattern")
@@ -428,6 +563,41 @@ class TestParseConfigs:
         assert cs.rich_imgs == []
 
 
+class TestFilterChanged:
+    """Tests for CodexSearch.filter_changed()."""
+
+    @pytest.fixture
+    def searched(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "one.md", "![`echo one`](one.svg)\n")
+        write(tmp_cwd / "two.md", '<!-- RICH-CODEX depends_on: ["src/*.py"] -->\n![`echo two`](two.svg)\n')
+        write(tmp_cwd / "src" / "tool.py", "print('hi')\n")
+        cs = codex_search()
+        cs.search_files()
+        return cs
+
+    def test_changed_source_is_kept(self, searched, tmp_cwd):
+        searched.filter_changed({tmp_cwd / "one.md"}, "main")
+        assert [img.command for img in searched.rich_imgs] == ["echo one"]
+
+    def test_changed_dependency_is_kept(self, searched, tmp_cwd):
+        searched.filter_changed({tmp_cwd / "src" / "tool.py"}, "main")
+        assert [img.command for img in searched.rich_imgs] == ["echo two"]
+
+    def test_nothing_changed(self, searched, tmp_cwd, caplog):
+        searched.filter_changed({tmp_cwd / "other.txt"}, "main")
+        assert searched.rich_imgs == []
+        assert "Generating 0 of 2 images, affected by changes since 'main'" in caplog.text
+
+    def test_changed_config_keeps_everything(self, tmp_cwd, codex_search):
+        write(tmp_cwd / "one.md", "![`echo one`](one.svg)\n")
+        write(tmp_cwd / ".rich-codex.yml", "terminal_width: 60\n")
+        cs = codex_search(configs=".rich-codex.yml")
+        cs.parse_configs()
+        cs.search_files()
+        cs.filter_changed({tmp_cwd / ".rich-codex.yml"}, "main")
+        assert [img.command for img in cs.rich_imgs] == ["echo one"]
+
+
 class TestCollapseDuplicates:
     """Tests for CodexSearch.collapse_duplicates()."""
 
@@ -472,6 +642,31 @@ class TestCollapseDuplicates:
         cs.collapse_duplicates()
         assert len(cs.rich_imgs) == 1
 
+    def test_presentation_variants_share_a_capture(self, tmp_cwd, codex_search):
+        cs = codex_search()
+        cs.rich_imgs = [
+            RichImg(command="echo hi", img_paths=["a.svg"], head=1),
+            RichImg(command="echo hi", img_paths=["b.svg"], title="Hi", terminal_theme="MONOKAI"),
+            RichImg(command="echo hi", img_paths=["c.svg"], extra_env={"NAME": "value"}),
+            RichImg(command="echo bye", img_paths=["d.svg"]),
+        ]
+        cs.collapse_duplicates()
+        first, second, other_env, other_command = cs.rich_imgs
+        assert first.shared_capture is not None
+        assert second.shared_capture is first.shared_capture
+        assert other_env.shared_capture is None
+        assert other_command.shared_capture is None
+        assert first.stream_output is False
+
+    def test_no_dedupe_doesnt_share_captures(self, tmp_cwd, codex_search):
+        cs = codex_search(no_dedupe=True)
+        cs.rich_imgs = [
+            RichImg(command="echo hi", img_paths=["a.svg"], head=1),
+            RichImg(command="echo hi", img_paths=["b.svg"], tail=1),
+        ]
+        cs.collapse_duplicates()
+        assert [ri.shared_capture for ri in cs.rich_imgs] == [None, None]
+
 
 class TestPathHelpers:
     """Tests for _relative_path() and _path_link()."""
@@ -597,6 +792,229 @@ class TestSaveAllImages:
         assert cs.num_img_saved == 0
         assert cs.num_img_skipped == 1
 
+    def test_parallel_jobs_match_a_serial_run(self, tmp_cwd, codex_search, caplog):
+        def run(jobs, out_dir):
+            caplog.clear()
+            cs = codex_search(jobs=jobs)
+            cs.rich_imgs = [
+                RichImg(command=f"sleep 0.{3 - i} && echo {i}", img_paths=[str(tmp_cwd / out_dir / f"{i}.svg")])
+                for i in range(3)
+            ]
+            cs.save_all_images()
+            saved = [line for line in caplog.text.splitlines() if "Saved:" in line]
+            return cs, [Path(p).name for p in cs.saved_img_paths], saved
+
+        serial, serial_paths, serial_logs = run(1, "serial")
+        parallel, parallel_paths, parallel_logs = run(3, "parallel")
+        assert parallel.num_img_saved == serial.num_img_saved == 3
+        assert parallel_paths == serial_paths == ["0.svg", "1.svg", "2.svg"]
+        assert [line.replace("parallel", "serial") for line in parallel_logs] == serial_logs
+
+    @pytest.mark.parametrize("jobs", [1, 3])
+    def test_shared_command_runs_once(self, tmp_cwd, codex_search, jobs):
+        cs = codex_search(jobs=jobs)
+        command = "echo run >> runs.txt; printf 'one\\ntwo\\nthree'"
+        cs.rich_imgs = [
+            RichImg(command=command, img_paths=[str(tmp_cwd / "head.svg")], head=1, hide_command=True),
+            RichImg(command=command, img_paths=[str(tmp_cwd / "tail.svg")], tail=1, hide_command=True),
+            RichImg(command=command, img_paths=[str(tmp_cwd / "all.svg")], title="Everything"),
+        ]
+        cs.collapse_duplicates()
+        cs.save_all_images()
+        assert (tmp_cwd / "runs.txt").read_text() == "run\n"
+        assert cs.num_img_saved == 3
+        head, tail, everything = (svg_text(tmp_cwd / name) for name in ["head.svg", "tail.svg", "all.svg"])
+        assert "one" in head and "three" not in head
+        assert "three" in tail and "one" not in tail
+        assert "one" in everything and "three" in everything and "Everything" in everything
+
+    def test_parallel_commands_run_at_the_same_time(self, tmp_cwd, codex_search):
+        cs = codex_search(jobs=4)
+        cs.rich_imgs = [
+            RichImg(command=f"sleep 1 && echo {i}", img_paths=[str(tmp_cwd / f"{i}.svg")]) for i in range(4)
+        ]
+        start = time.monotonic()
+        cs.save_all_images()
+        assert time.monotonic() - start < 3
+        assert cs.num_img_saved == 4
+
+    def test_images_are_saved_while_other_commands_run(self, tmp_cwd, codex_search, monkeypatch):
+        saved_at = {}
+        save_image = CodexSearch._save_image
+
+        def timed_save_image(img_obj):
+            saved_at[img_obj.command] = time.monotonic()
+            save_image(img_obj)
+
+        monkeypatch.setattr(CodexSearch, "_save_image", staticmethod(timed_save_image))
+        cs = codex_search(jobs=2)
+        cs.rich_imgs = [
+            RichImg(command="sleep 1 && echo slow", img_paths=[str(tmp_cwd / "slow.svg")]),
+            RichImg(command="echo quick", img_paths=[str(tmp_cwd / "quick.svg")]),
+        ]
+        start = time.monotonic()
+        cs.save_all_images()
+        assert saved_at["echo quick"] - start < 0.8
+        assert cs.num_img_saved == 2
+
+    def test_convert_workers_without_png_or_pdf_outputs(self, tmp_cwd, codex_search):
+        cs = codex_search(convert_workers=2)
+        cs.rich_imgs = [RichImg(snippet=f"{i}", img_paths=[str(tmp_cwd / f"{i}.svg")]) for i in range(2)]
+        cs.save_all_images()
+        assert cs.num_img_saved == 2
+        assert all(img_obj.convert_pool is None for img_obj in cs.rich_imgs)
+
+    def test_convert_workers_convert_in_order(self, tmp_cwd, codex_search):
+        pytest.importorskip("cairosvg", reason="CairoSVG is an optional extra")
+        cs = codex_search(convert_workers=2)
+        cs.rich_imgs = [
+            RichImg(command=f"echo {i}", img_paths=[str(tmp_cwd / f"{i}.png"), str(tmp_cwd / f"{i}.pdf")])
+            for i in range(3)
+        ]
+        cs.save_all_images()
+        assert cs.num_img_saved == 6
+        assert [Path(p).name for p in cs.saved_img_paths] == ["0.png", "0.pdf", "1.png", "1.pdf", "2.png", "2.pdf"]
+        assert (tmp_cwd / "2.png").read_bytes().startswith(b"\x89PNG")
+
+    def test_timings_are_recorded(self, tmp_cwd, codex_search):
+        history = TimingHistory(tmp_cwd / "cache")
+        cs = codex_search(jobs=2, timing_history=history)
+        cs.rich_imgs = [
+            RichImg(command="sleep 0.2 && echo slow", img_paths=[str(tmp_cwd / "slow.svg")]),
+            RichImg(snippet="hi", img_paths=[str(tmp_cwd / "snippet.svg")]),
+        ]
+        cs.save_all_images()
+        assert len(history.timings) == 1
+        assert history.predict(cs.rich_imgs[0]) >= 0.2
+
+    def test_slowest_commands_start_first(self, tmp_cwd, codex_search, monkeypatch):
+        started = []
+        capture_command = RichImg.capture_command
+
+        async def record_start(img_obj):
+            started.append(img_obj.command)
+            await capture_command(img_obj)
+
+        history = TimingHistory(tmp_cwd / "cache")
+        for command, seconds in [("echo quick", 0.1), ("echo slow", 5.0)]:
+            history.record(timed_command(command, seconds, str(tmp_cwd / "out.svg")))
+        monkeypatch.setattr(RichImg, "capture_command", record_start)
+        cs = codex_search(jobs=2, timing_history=history)
+        cs.rich_imgs = [
+            RichImg(command=command, img_paths=[str(tmp_cwd / "out.svg")])
+            for command in ["echo quick", "echo slow", "echo new"]
+        ]
+        cs.save_all_images()
+        assert started == ["echo new", "echo slow", "echo quick"]
+        # Results still come back in the original order
+        assert [img_obj.command for img_obj in cs.rich_imgs] == ["echo quick", "echo slow", "echo new"]
+
+    def test_schedule(self, tmp_cwd, codex_search):
+        history = TimingHistory(tmp_cwd / "cache")
+        history.record(timed_command("echo one", 1.0, "out.svg"))
+        history.record(timed_command("echo two", 2.0, "out.svg"))
+        imgs = [
+            RichImg(snippet="hi", img_paths=["out.svg"]),
+            RichImg(command="echo one", img_paths=["out.svg"]),
+            None,
+            RichImg(command="echo new", img_paths=["out.svg"]),
+            RichImg(command="echo two", img_paths=["out.svg"]),
+        ]
+        assert codex_search(timing_history=history).schedule(imgs) == [3, 4, 1, 0, 2]
+        assert codex_search().schedule(imgs) == [0, 1, 2, 3, 4]
+
+    def test_parallel_job_exceptions_are_raised(self, tmp_cwd, codex_search, monkeypatch):
+        def explode(self):
+            raise RuntimeError("boom")
+
+        monkeypatch.setattr(RichImg, "get_output", explode)
+        cs = codex_search(jobs=2)
+        cs.rich_imgs = [
+            RichImg(snippet="one", img_paths=[str(tmp_cwd / "one.svg")]),
+            RichImg(snippet="two", img_paths=[str(tmp_cwd / "two.svg")]),
+        ]
+        with pytest.raises(RuntimeError, match="boom"):
+            cs.save_all_images()
+
+
+class TestScanFile:
+    """Tests for scan_file()."""
+
+    def test_images_and_their_config(self):
+        found = codex_search_module.scan_file(
+            '# Title\n<!-- RICH-CODEX terminal_width: 60 -->\n![`echo hi`](hi.svg "Hello")\n![](plain.png)\n'
+        )
+        assert found == [
+            {
+                "line_number": 3,
+                "config": {"terminal_width": 60},
+                "match": {"cmd": "echo hi", "img_path": "hi.svg ", "title": '"Hello"'},
+            },
+            {"line_number": 4, "config": {}, "match": {"img_path": "plain.png", "title": None}},
+        ]
+
+    def test_multiline_config(self):
+        found = codex_search_module.scan_file("{/* RICH-CODEX\nsnippet: hello\n*/}\n![snippet](out.svg)\n")
+        assert found[0]["config"] == {"snippet": "hello"}
+
+    def test_yaml_errors(self):
+        found = codex_search_module.scan_file("<!-- RICH-CODEX ]not: [valid -->\n![`echo hi`](hi.svg)\n")
+        assert found[0]["line_number"] == 2
+        assert "error" in found[0]
+        assert found[1]["config"] == {}
+
+    def test_windows_line_endings(self):
+        found = codex_search_module.scan_file("<!-- RICH-CODEX\r\nhead: 2\r\n-->\r\n![`echo hi`](hi.svg)\r\n")
+        assert found[0]["config"] == {"head": 2}
+
+
+class TestScanPath:
+    """Tests for scan_path()."""
+
+    @pytest.fixture
+    def scan_file_calls(self, monkeypatch):
+        """Count the files that get the full scan."""
+        calls = []
+        original_scan_file = codex_search_module.scan_file
+
+        def scan_file(text):
+            calls.append(text)
+            return original_scan_file(text)
+
+        monkeypatch.setattr(codex_search_module, "scan_file", scan_file)
+        return calls
+
+    def test_file_without_markers_is_skipped(self, tmp_cwd, scan_file_calls):
+        readme = write(tmp_cwd / "README.md", "# Title\n![plain](image.png)\n`code`\n")
+        assert codex_search_module.scan_path(readme) == []
+        assert scan_file_calls == []
+
+    @pytest.mark.parametrize(
+        "text", ["![`echo hi`](hi.svg)\n", "<!-- RICH-CODEX\nsnippet: hi\n-->\n![snippet](hi.svg)\n"]
+    )
+    def test_file_with_markers_is_scanned(self, tmp_cwd, scan_file_calls, text):
+        readme = write(tmp_cwd / "README.md", text)
+        found = codex_search_module.scan_path(readme)
+        assert scan_file_calls == [text]
+        assert len(found) == 1
+
+    def test_empty_file(self, tmp_cwd, scan_file_calls):
+        assert codex_search_module.scan_path(write(tmp_cwd / "README.md", "")) == []
+        assert scan_file_calls == []
+
+    def test_large_files_are_memory_mapped(self, tmp_cwd, scan_file_calls):
+        padding = "x" * codex_search_module.MMAP_MIN_SIZE + "\n"
+        without = write(tmp_cwd / "without.md", padding)
+        with_markers = write(tmp_cwd / "with.md", padding + "![`echo hi`](hi.svg)\n")
+        assert codex_search_module.scan_path(without) == []
+        assert [item["match"]["cmd"] for item in codex_search_module.scan_path(with_markers)] == ["echo hi"]
+        assert len(scan_file_calls) == 1
+
+    def test_only_files_with_markers_need_to_be_utf8(self, tmp_cwd):
+        binary = tmp_cwd / "binary.md"
+        binary.write_bytes(b"\xff\xfe not utf-8")
+        assert codex_search_module.scan_path(binary) == []
+
 
 def test_config_comment_styles_are_paired():
     """Each supported comment opener needs a non-empty closer that differs from it."""
@@ -0,0 +1,189 @@
+"""Tests for rich_codex.preload."""
+
+import os
+import time
+
+import pytest
+from conftest import write
+
+from rich_codex import rich_img as rich_img_module
+from rich_codex.preload import PreloadServer, parse_preload
+
+TOOL = """
+import os
+import subprocess
+import sys
+import time
+
+
+def main():
+    print("args:", *sys.argv[1:])
+    print("cwd:", os.getcwd())
+    print("env:", os.environ.get("RC_TEST_VAR"))
+    print("tty:", sys.stdout.isatty())
+    print("oops", file=sys.stderr)
+    return 3
+
+
+def sleep():
+    print("before-timeout", flush=True)
+    time.sleep(30)
+
+
+def daemon():
+    # Keeps the output open in a session of its own, after this tool is killed
+    subprocess.Popen(["sleep", "5"], start_new_session=True)
+    print("before-timeout", flush=True)
+    time.sleep(30)
+"""
+
+
+@pytest.fixture
+def preload_server(tmp_cwd):
+    """Start a preload server for a tool in the temporary working directory."""
+    write(tmp_cwd / "tools" / "rc_test_tool.py", TOOL)
+    server = PreloadServer(
+        {
+            "rc-test-tool": "rc_test_tool:main",
+            "rc-test-sleep": "rc_test_tool:sleep",
+            "rc-test-daemon": "rc_test_tool:daemon",
+        },
+        {**os.environ, "PYTHONPATH": str(tmp_cwd / "tools")},
+    )
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def preloaded_img(rich_img, preload_server):
+    """Build RichImg objects that run preloaded tools in the server."""
+
+    def _preloaded_img(**kwargs):
+        img = rich_img(**kwargs)
+        img.preload_server = preload_server
+        return img
+
+    return _preloaded_img
+
+
+class TestParsePreload:
+    """Tests for parse_preload()."""
+
+    def test_names_and_targets(self):
+        assert parse_preload("my-tool\n\n  other = other.cli:app.main \n") == {
+            "my-tool": None,
+            "other": "other.cli:app.main",
+        }
+
+    @pytest.mark.parametrize("preload", ["my tool", "my-tool=module", "my-tool=module:"])
+    def test_invalid(self, preload):
+        with pytest.raises(ValueError, match="Can't preload"):
+            parse_preload(preload)
+
+
+class TestPreloadServer:
+    """Tests for PreloadServer."""
+
+    def test_tools_are_loaded(self, preload_server):
+        assert preload_server.names == {"rc-test-tool", "rc-test-sleep", "rc-test-daemon"}
+
+    def test_tools_that_fail_to_load(self, tmp_cwd, caplog):
+        server = PreloadServer({"not-a-real-tool": None, "missing": "not_a_module:main"}, dict(os.environ))
+        server.close()
+        assert server.names == set()
+        assert "no console script called 'not-a-real-tool'" in caplog.text
+        assert "ModuleNotFoundError" in caplog.text
+
+    @pytest.mark.parametrize(
+        ("command", "argv"),
+        [
+            ("rc-test-tool", ["rc-test-tool"]),
+            ("rc-test-tool --flag 'two words'", ["rc-test-tool", "--flag", "two words"]),
+            ("rc-test-tool | head", None),
+            ("rc-test-tool $HOME", None),
+            ("rc-test-tool > out.txt", None),
+            ("RC_TEST_VAR=1 rc-test-tool", None),
+            ("other-tool", None),
+            ("rc-test-tool 'unclosed", None),
+        ],
+    )
+    def test_preload_argv(self, preload_server, command, argv):
+        assert preload_server.preload_argv(command) == argv
+
+    def test_stopped_server(self, preload_server):
+        preload_server.close()
+        with pytest.raises(OSError):
+            preload_server.spawn(["rc-test-tool"], os.getcwd(), dict(os.environ), (0, 1, 2))
+
+
+class TestRunPreloaded:
+    """Tests for running preloaded tools with RichImg.preload_server."""
+
+    def test_output(self, preloaded_img, tmp_cwd):
+        img = preloaded_img(command="rc-test-tool one 'two words'", extra_env={"RC_TEST_VAR": "set"})
+        img.run_command()
+        # stdout is buffered when it isn't a terminal, as for a new process, so stderr comes first
+        assert img.command_output == f"oops\nargs: one two words\ncwd: {tmp_cwd}\nenv: set\ntty: False\n"
+
+    def test_working_dir(self, preloaded_img, tmp_cwd):
+        img = preloaded_img(command="rc-test-tool", working_dir=str(tmp_cwd / "nested"))
+        img.run_command()
+        assert f"cwd: {tmp_cwd / 'nested'}\n" in img.command_output
+
+    def test_use_pty(self, preloaded_img, tmp_cwd, tty_stdin):
+        img = preloaded_img(command="rc-test-tool", use_pty=True)
+        img.run_command()
+        assert "tty: True\r\n" in img.command_output
+
+    def test_timeout(self, preloaded_img, tmp_cwd, caplog):
+        img = preloaded_img(command="rc-test-sleep", timeout=0.5)
+        start = time.monotonic()
+        img.run_command()
+        assert time.monotonic() - start < 10
+        assert "timed out" in caplog.text
+        assert img.command_output == "before-timeout\n"
+
+    def test_timeout_before_the_fork_has_its_own_process_group(self, preloaded_img, tmp_cwd, monkeypatch):
+        def no_process_group(pid, sig):
+            raise ProcessLookupError
+
+        monkeypatch.setattr(os, "killpg", no_process_group)
+        img = preloaded_img(command="rc-test-sleep", timeout=0.5)
+        start = time.monotonic()
+        img.run_command()
+        assert time.monotonic() - start < 4
+        assert img.command_output == "before-timeout\n"
+
+    def test_timeout_with_output_held_open(self, preloaded_img, tmp_cwd, monkeypatch, caplog):
+        monkeypatch.setattr(rich_img_module, "KILL_GRACE", 0.5)
+        img = preloaded_img(command="rc-test-daemon", timeout=0.5)
+        start = time.monotonic()
+        img.run_command()
+        assert time.monotonic() - start < 4
+        assert "still open after it was killed" in caplog.text
+        assert img.command_output == "before-timeout\n"
+
+    def test_other_commands_run_as_normal(self, preloaded_img, tmp_cwd):
+        img = preloaded_img(command="rc-test-tool | tr a-z A-Z")
+        img.run_command()
+        assert "not found" in img.command_output
+
+    def test_stopped_server_runs_as_normal(self, preloaded_img, preload_server, tmp_cwd, caplog):
+        preload_server.close()
+        img = preloaded_img(command="rc-test-tool")
+        img.run_command()
+        assert "Couldn't run 'rc-test-tool' in the preload server" in caplog.text
+        assert "not found" in img.command_output
+
+    def test_same_output_as_a_new_process(self, rich_img, tmp_cwd):
+        """rich-codex is a rich-click tool, so its help should look just the same."""
+        server = PreloadServer({"rich-codex": None}, dict(os.environ))
+        outputs = []
+        for preload_server in (None, server):
+            img = rich_img(command="rich-codex --help")
+            img.preload_server = preload_server
+            img.run_command()
+            outputs.append(img.command_output)
+        server.close()
+        assert "Usage: rich-codex [OPTIONS]" in outputs[0]
+        assert outputs[0] == outputs[1]
@@ -0,0 +1,100 @@
+"""Tests for rich_codex.profiling."""
+
+import asyncio
+import json
+import threading
+
+import pytest
+
+from rich_codex import profiling
+
+
+@pytest.fixture
+def profiler():
+    """Turn on profiling for a test."""
+    profiler = profiling.start()
+    yield profiler
+    profiling.stop()
+
+
+class TestSpan:
+    """Tests for profiling.span()."""
+
+    def test_nothing_is_recorded_when_off(self):
+        assert profiling.span("off") is profiling.span("also off")
+        with profiling.span("off"):
+            pass
+
+    def test_spans_are_recorded(self, profiler):
+        with profiling.span("outer"):
+            with profiling.span("inner", "detail"):
+                pass
+        inner, outer = profiler.spans
+        assert (inner[0], inner[1], outer[0], outer[1]) == ("inner", "detail", "outer", None)
+        assert outer[3] <= inner[3] <= inner[4] <= outer[4]
+
+    def test_spans_are_recorded_after_an_exception(self, profiler):
+        with pytest.raises(ValueError), profiling.span("broken"):
+            raise ValueError
+        assert [span[0] for span in profiler.spans] == ["broken"]
+
+    def test_threads_and_tasks_have_their_own_tracks(self, profiler):
+        async def job():
+            with profiling.span("job"):
+                await asyncio.sleep(0.01)
+
+        async def jobs():
+            await asyncio.gather(job(), job())
+
+        with profiling.span("main"):
+            asyncio.run(jobs())
+
+        def in_thread():
+            with profiling.span("thread"):
+                pass
+
+        thread = threading.Thread(target=in_thread, name="worker")
+        thread.start()
+        thread.join()
+        tracks = {span[0]: [] for span in profiler.spans}
+        for span in profiler.spans:
+            tracks[span[0]].append(span[2])
+        assert len(set(tracks["job"])) == 2
+        assert tracks["main"][0] not in tracks["job"]
+        assert profiler.track_names[tracks["main"][0]] == "MainThread"
+        assert profiler.track_names[tracks["thread"][0]] == "worker"
+
+
+class TestReport:
+    """Tests for the summary and trace of a Profiler."""
+
+    @pytest.fixture
+    def spans(self, profiler):
+        profiler.spans = [
+            ("command", "echo hi", 0, profiler.start_time + 0.5, profiler.start_time + 1.5),
+            ("write", None, 1, profiler.start_time, profiler.start_time + 0.25),
+            ("command", "echo bye", 1, profiler.start_time + 1.0, profiler.start_time + 4.0),
+        ]
+        profiler.track_names = ["MainThread", "Task-1"]
+        return profiler
+
+    def test_summary(self, spans):
+        assert spans.summary() == [
+            ("command", 2, pytest.approx(4.0), pytest.approx(3.0)),
+            ("write", 1, pytest.approx(0.25), pytest.approx(0.25)),
+        ]
+
+    def test_trace(self, spans, tmp_cwd):
+        spans.save_trace(tmp_cwd / "trace.json")
+        trace = json.loads((tmp_cwd / "trace.json").read_text())
+        events = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+        assert [(event["name"], event["ts"], event["dur"], event["tid"]) for event in events] == [
+            ("write", 0, 250000, 1),
+            ("command", 500000, 1000000, 0),
+            ("command", 1000000, 3000000, 1),
+        ]
+        assert events[1]["args"] == {"detail": "echo hi"}
+        names = {
+            event["tid"]: event["args"]["name"] for event in trace["traceEvents"] if event["name"] == "thread_name"
+        }
+        assert names == {0: "MainThread", 1: "Task-1"}
@@ -0,0 +1,203 @@
+"""Tests for rich_codex.render_cache."""
+
+import os
+
+import pytest
+
+from rich_codex.render_cache import RenderCache
+from rich_codex.rich_img import RichImg
+
+
+@pytest.fixture
+def cache(tmp_cwd):
+    """Make a render cache in the temporary working directory."""
+    return RenderCache(tmp_cwd / "cache")
+
+
+def generate(img):
+    """Generate an image, reporting whether its output had to be rendered."""
+    rendered = []
+    original_get_output = img.get_output
+
+    def get_output():
+        rendered.append(True)
+        original_get_output()
+
+    img.get_output = get_output
+    img.generate()
+    return bool(rendered)
+
+
+class TestKey:
+    """Tests for RenderCache.key()."""
+
+    def test_snippets_are_cacheable(self, cache, tmp_cwd):
+        assert cache.key(RichImg(snippet="hi", img_paths=["a.svg"])) is not None
+
+    def test_commands_need_cache_inputs(self, cache, tmp_cwd):
+        assert cache.key(RichImg(command="echo hi", img_paths=["a.svg"])) is None
+
+    def test_commands_with_cache_inputs(self, tmp_cwd):
+        cache = RenderCache(tmp_cwd / "cache", "$HOME")
+        assert cache.key(RichImg(command="echo hi", img_paths=["a.svg"])) is not None
+
+    def test_key_ignores_output_filenames_after_the_first(self, cache, tmp_cwd):
+        one = RichImg(snippet="hi", img_paths=["a.svg"])
+        two = RichImg(snippet="hi", img_paths=["a.svg", "a.png"])
+        assert cache.key(one) == cache.key(two)
+
+    def test_key_depends_on_config(self, cache, tmp_cwd):
+        one = RichImg(snippet="hi", img_paths=["a.svg"])
+        two = RichImg(snippet="hi", img_paths=["a.svg"], terminal_theme="MONOKAI")
+        assert cache.key(one) != cache.key(two)
+
+    def test_file_inputs_change_the_key(self, tmp_cwd):
+        (tmp_cwd / "tool.py").write_text("print('v1')")
+        img = RichImg(command="echo hi", img_paths=["a.svg"])
+        before = RenderCache(tmp_cwd / "cache", "*.py").key(img)
+        (tmp_cwd / "tool.py").write_text("print('v2')")
+        assert RenderCache(tmp_cwd / "cache", "*.py").key(img) != before
+
+    def test_env_inputs_change_the_key(self, tmp_cwd, monkeypatch):
+        img = RichImg(command="echo hi", img_paths=["a.svg"])
+        monkeypatch.setenv("RC_CACHE_TEST", "one")
+        before = RenderCache(tmp_cwd / "cache", "$RC_CACHE_TEST").key(img)
+        monkeypatch.setenv("RC_CACHE_TEST", "two")
+        assert RenderCache(tmp_cwd / "cache", "$RC_CACHE_TEST").key(img) != before
+
+    def test_command_inputs_change_the_key(self, tmp_cwd):
+        img = RichImg(command="echo hi", img_paths=["a.svg"])
+        one = RenderCache(tmp_cwd / "cache", "!echo one").key(img)
+        assert RenderCache(tmp_cwd / "cache", "!echo two").key(img) != one
+
+    def test_key_is_the_same_in_another_checkout(self, tmp_cwd, monkeypatch):
+        keys = []
+        for checkout in (tmp_cwd / "one", tmp_cwd / "two" / "nested"):
+            (checkout / "docs").mkdir(parents=True)
+            (checkout / "tool.py").write_text("print('hi')")
+            (checkout / "docs" / "README.md").write_text("![`python tool.py`](img/a.svg)\n")
+            monkeypatch.chdir(checkout)
+            img = RichImg(
+                command="python tool.py",
+                img_paths=[str(checkout / "docs" / "img" / "a.svg")],
+                source=str(checkout / "docs" / "README.md"),
+                working_dir=str(checkout / "docs"),
+                depends_on=["../tool.py"],
+            )
+            keys.append(RenderCache(checkout / "cache", "*.py").key(img))
+        assert keys[0] is not None
+        assert keys[0] == keys[1]
+
+
+class TestDependsOn:
+    """Tests for the 'depends_on' files of an image."""
+
+    def test_commands_with_depends_on_are_cacheable(self, cache, tmp_cwd):
+        (tmp_cwd / "tool.py").write_text("print('v1')")
+        assert cache.key(RichImg(command="echo hi", img_paths=["a.svg"], depends_on=["*.py"])) is not None
+
+    def test_changed_dependency_changes_the_key(self, tmp_cwd):
+        tool = tmp_cwd / "src" / "tool.py"
+        tool.parent.mkdir()
+        tool.write_text("print('v1')")
+        img = RichImg(command="echo hi", img_paths=["a.svg"], depends_on=["src/**/*.py"])
+        before = RenderCache(tmp_cwd / "cache").key(img)
+        assert RenderCache(tmp_cwd / "cache").key(img) == before
+        tool.write_text("print('v2')")
+        assert RenderCache(tmp_cwd / "cache").key(img) != before
+
+    def test_other_files_dont_change_the_key(self, tmp_cwd):
+        (tmp_cwd / "tool.py").write_text("print('v1')")
+        img = RichImg(command="echo hi", img_paths=["a.svg"], depends_on=["*.py"])
+        before = RenderCache(tmp_cwd / "cache").key(img)
+        (tmp_cwd / "notes.txt").write_text("unrelated")
+        assert RenderCache(tmp_cwd / "cache").key(img) == before
+
+    def test_patterns_are_relative_to_the_working_dir(self, cache, tmp_cwd):
+        (tmp_cwd / "docs").mkdir()
+        (tmp_cwd / "tool.py").write_text("print('v1')")
+        img = RichImg(command="echo hi", img_paths=["a.svg"], depends_on=["../*.py"], working_dir=tmp_cwd / "docs")
+        before = cache.key(img)
+        (tmp_cwd / "tool.py").write_text("print('v2')")
+        assert RenderCache(tmp_cwd / "cache").key(img) != before
+
+    def test_no_matching_files_is_a_warning(self, cache, tmp_cwd, caplog):
+        cache.key(RichImg(command="echo hi", img_paths=["a.svg"], depends_on=["missing/*.py"]))
+        assert "No files found matching depends_on pattern 'missing/*.py'" in caplog.text
+
+    def test_unchanged_command_is_not_run(self, cache, tmp_cwd):
+        (tmp_cwd / "tool.py").write_text("print('v1')")
+        target = str(tmp_cwd / "out.svg")
+        for _ in range(2):
+            img = RichImg(command="echo hi >> runs.txt; echo hi", img_paths=[target], depends_on=["*.py"])
+            img.no_confirm = True
+            img.render_cache = cache
+            img.generate()
+        assert (tmp_cwd / "runs.txt").read_text() == "hi\n"
+        assert cache.num_hits == 1
+
+
+class TestRestore:
+    """Tests for RichImg.generate() with a render cache."""
+
+    def test_miss_then_hit(self, cache, tmp_cwd):
+        target = tmp_cwd / "out.svg"
+        first = RichImg(snippet="hello", snippet_syntax="text", img_paths=[str(target)])
+        first.render_cache = cache
+        assert generate(first) is True
+        assert cache.num_misses == 1
+
+        target.unlink()
+        second = RichImg(snippet="hello", snippet_syntax="text", img_paths=[str(target)])
+        second.render_cache = cache
+        assert generate(second) is False
+        assert cache.num_hits == 1
+        assert second.num_img_saved == 1
+        assert target.exists()
+
+    def test_unchanged_target_is_skipped(self, cache, tmp_cwd):
+        target = str(tmp_cwd / "out.svg")
+        for _ in range(2):
+            img = RichImg(snippet="hello", snippet_syntax="text", img_paths=[target])
+            img.render_cache = cache
+            img.generate()
+        assert img.num_img_skipped == 1
+        assert cache.num_hits == 1
+
+    def test_missing_image_type_is_a_miss(self, cache, tmp_cwd):
+        svg = RichImg(snippet="hello", img_paths=[str(tmp_cwd / "out.svg")])
+        svg.render_cache = cache
+        svg.generate()
+        both = RichImg(snippet="hello", img_paths=[str(tmp_cwd / "out.svg"), str(tmp_cwd / "out.pdf")])
+        assert cache.restore(both) is False
+
+    def test_cache_dir_is_ignored_by_git(self, cache, tmp_cwd):
+        img = RichImg(snippet="hello", img_paths=[str(tmp_cwd / "out.svg")])
+        img.render_cache = cache
+        img.generate()
+        assert (tmp_cwd / "cache" / ".gitignore").read_text().endswith("*\n")
+
+
+class TestEvict:
+    """Tests for RenderCache.evict()."""
+
+    def fill(self, cache, tmp_cwd, snippets):
+        for snippet in snippets:
+            img = RichImg(snippet=snippet, img_paths=[str(tmp_cwd / f"{snippet}.svg")])
+            img.render_cache = cache
+            img.generate()
+        return sorted(path for path in cache.cache_dir.glob("*/*") if path.is_dir())
+
+    def test_no_max_size_keeps_everything(self, cache, tmp_cwd):
+        self.fill(cache, tmp_cwd, ["one", "two"])
+        assert cache.evict() == []
+
+    def test_least_recently_used_are_evicted_first(self, tmp_cwd):
+        cache = RenderCache(tmp_cwd / "cache", max_size_mb=0)
+        entries = self.fill(cache, tmp_cwd, ["one", "two"])
+        for age, entry in enumerate(entries):
+            os.utime(entry, (1000 + age, 1000 + age))
+        # Room for exactly one entry
+        cache.max_size = sum(f.stat().st_size for f in entries[1].iterdir())
+        assert cache.evict() == [entries[0]]
+        assert entries[1].exists()
@@ -1,15 +1,22 @@
 """Tests for rich_codex.rich_img."""
 
 import difflib
+import random
 import re
 import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import Levenshtein
 import pytest
 from conftest import svg_text
+from Levenshtein import ratio
 
 from rich_codex import rich_img as rich_img_module
-from rich_codex.rich_img import RichImg
+from rich_codex.cassette import CassettePlayer, CassetteRecorder
+from rich_codex.rich_img import CapturedLines, RichImg
+from rich_codex.shell_session import ShellSessions
 
 
 def rendered_text(img_obj):
@@ -288,6 +295,42 @@ class TestRunCommand:
         img.run_command()
         assert "timed out" in caplog.text
 
+    def test_output_before_a_timeout_is_kept(self, rich_img, tmp_cwd):
+        img = rich_img(command="echo before-timeout && sleep 30", timeout=0.5)
+        img.run_command()
+        assert "before-timeout" in rendered_text(img)
+
+    def test_timeout_with_a_background_job_holding_the_output(self, rich_img, tmp_cwd, caplog):
+        """The shell has already exited and been reaped when the timeout kills its process group."""
+        img = rich_img(command="echo before-timeout; sleep 3 &", timeout=0.5)
+        start = time.monotonic()
+        img.run_command()
+        assert time.monotonic() - start < 2.5
+        assert "timed out" in caplog.text
+        assert "before-timeout" in rendered_text(img)
+
+    def test_pre_captured_output_is_not_run_again(self, rich_img, tmp_cwd):
+        img = rich_img(command="echo from-the-command", hide_command=True)
+        img.command_output = "captured-earlier\n"
+        img.run_command()
+        assert "captured-earlier" in rendered_text(img)
+        assert "from-the-command" not in rendered_text(img)
+
+    def test_pty_line_endings_are_not_blanked(self, rich_img):
+        lines = rich_img().decode_output("one\r\ntwo\r\n")
+        assert [line.plain for line in lines] == ["one", "two", ""]
+
+    def test_carriage_returns_still_overwrite_the_line(self, rich_img):
+        lines = rich_img().decode_output("10%\r50%\r100%\n")
+        assert [line.plain for line in lines] == ["100%", ""]
+
+    def test_head_and_tail_that_overlap_show_everything(self, rich_img, tmp_cwd):
+        img = rich_img(command="printf 'one\ntwo\nthree'", head=2, tail=2, hide_command=True)
+        img.run_command()
+        output = rendered_text(img)
+        assert "three" in output
+        assert "[..truncated..]" not in output
+
     def test_use_pty(self, rich_img, tmp_cwd, tty_stdin):
         img = rich_img(command="echo hello-from-pty", use_pty=True, terminal_width=100, notrim=True)
         img.run_command()
@@ -306,6 +349,21 @@ class TestRunCommand:
         img.run_command()
         assert "timed out" in caplog.text
 
+    def test_pty_timeout_with_a_background_job_holding_the_output(self, rich_img, tmp_cwd, caplog, tty_stdin):
+        img = rich_img(command="echo before-timeout; sleep 3 &", use_pty=True, timeout=0.5)
+        start = time.monotonic()
+        img.run_command()
+        assert time.monotonic() - start < 2.5
+        assert "timed out" in caplog.text
+        assert "before-timeout" in rendered_text(img)
+
+    def test_pty_output_bigger_than_its_buffer(self, rich_img, tmp_cwd, caplog, tty_stdin):
+        """The pty is read while the command runs, so a full buffer never blocks it."""
+        img = rich_img(command="seq 1 50000", use_pty=True, timeout=5)
+        img.run_command()
+        assert "timed out" not in caplog.text
+        assert img.command_output.endswith("50000\r\n")
+
 
 class TestFormatSnippet:
     """Tests for RichImg.format_snippet()."""
@@ -380,6 +438,82 @@ class TestGetOutput:
         assert "no command or snippet" in caplog.text
 
 
+class TestPctChangeBounds:
+    """Tests for pct_change_bounds()."""
+
+    @pytest.fixture
+    def ratio_calls(self, monkeypatch):
+        """Count the calls to the slow Levenshtein ratio."""
+        calls = []
+
+        def counted_ratio(*args):
+            calls.append(args)
+            return ratio(*args)
+
+        monkeypatch.setattr(Levenshtein, "ratio", counted_ratio)
+        return calls
+
+    def exact(self, new, old):
+        return (1 - ratio(new, old)) * 100.0
+
+    def test_identical(self, ratio_calls):
+        assert rich_img_module.pct_change_bounds(b"same", b"same", 0) == (0.0, 0.0)
+        assert ratio_calls == []
+
+    def test_any_change_beats_zero(self, ratio_calls):
+        low, high = rich_img_module.pct_change_bounds(b"<svg>a</svg>", b"<svg>b</svg>", 0)
+        assert 0 < low <= high
+        assert ratio_calls == []
+
+    def test_length_difference_beats_threshold(self, ratio_calls):
+        low, _ = rich_img_module.pct_change_bounds(b"a" * 100, b"a" * 10, 50)
+        assert low > 50
+        assert ratio_calls == []
+
+    def test_small_change_in_the_middle_is_under_threshold(self, ratio_calls):
+        new = b"header" + b"x" * 1000 + b"footer"
+        old = b"header" + b"x" * 500 + b"y" + b"x" * 499 + b"footer"
+        low, high = rich_img_module.pct_change_bounds(new, old, 1)
+        assert low <= self.exact(new, old) <= high <= 1
+        assert ratio_calls == []
+
+    def test_byte_counts_beat_threshold(self, ratio_calls):
+        new = b"a" * 100
+        old = b"b" * 100
+        low, _ = rich_img_module.pct_change_bounds(new, old, 50)
+        assert low == self.exact(new, old) == 100
+        assert ratio_calls == []
+
+    def test_falls_back_to_exact_ratio(self, ratio_calls):
+        new = b"start abcdef end"
+        old = b"start fedcba end"
+        low, high = rich_img_module.pct_change_bounds(new, old, 20)
+        assert low == high == pytest.approx(self.exact(new, old))
+        assert len(ratio_calls) == 1
+
+    @pytest.mark.parametrize("seed", range(20))
+    @pytest.mark.parametrize("min_pct_diff", [0, 1, 10, 50])
+    def test_bounds_agree_with_exact_ratio(self, seed, min_pct_diff):
+        rng = random.Random(seed)
+        old = bytes(rng.choice(b"abc") for _ in range(rng.randint(0, 200)))
+        new = bytearray(old)
+        for _ in range(rng.randint(0, 10)):
+            pos = rng.randint(0, len(new))
+            if rng.random() < 0.5 and pos < len(new):
+                del new[pos]
+            else:
+                new.insert(pos, rng.choice(b"abcd"))
+        exact = self.exact(bytes(new), old)
+        low, high = rich_img_module.pct_change_bounds(bytes(new), old, min_pct_diff)
+        assert low - 1e-9 <= exact <= high + 1e-9
+        assert (low > min_pct_diff) == (exact > min_pct_diff)
+
+    def test_common_affix_lengths_dont_overlap(self):
+        assert rich_img_module.common_affix_lengths(b"aaa", b"aaaa") == (3, 0)
+        assert rich_img_module.common_affix_lengths(b"abXcd", b"abYYcd") == (2, 2)
+        assert rich_img_module.common_affix_lengths(b"", b"abc") == (0, 0)
+
+
 class TestEnoughImageDifference:
     """Tests for RichImg._enough_image_difference()."""
 
@@ -500,6 +634,15 @@ class TestEnoughImageDifference:
         assert img._enough_image_difference(str(new_file), str(old_file)) is True
         assert "Checking diff" not in caplog.text
 
+    def test_render_digest_is_not_a_diff_line(self, rich_img, tmp_cwd):
+        prefix = rich_img_module.SVG_DIGEST_PREFIX
+        new_file = tmp_cwd / "new.svg"
+        old_file = tmp_cwd / "old.svg"
+        new_file.write_text(f"{prefix}aaa -->\nstable line\ngenerated: 2022-01-01\n")
+        old_file.write_text(f"{prefix}bbb -->\nstable line\ngenerated: 1999-12-31\n")
+        img = rich_img(skip_change_regex="generated:")
+        assert img._enough_image_difference(str(new_file), str(old_file)) is False
+
     def test_no_lost_lines_to_match(self, rich_img, tmp_cwd, caplog):
         """The old file only gained lines, so there is nothing for the regexes to match."""
         new_file = tmp_cwd / "new.svg"
@@ -589,6 +732,39 @@ class TestSaveImages:
         assert img.num_img_saved == 0
         assert out.stat().st_mtime_ns == first_mtime
 
+    def test_svg_starts_with_render_digest(self, rich_img, tmp_cwd):
+        out = tmp_cwd / "out.svg"
+        self.rendered(rich_img, img_paths=[str(out)]).save_images()
+        assert out.read_text().startswith(rich_img_module.SVG_DIGEST_PREFIX)
+
+    def test_unchanged_render_is_not_rendered_again(self, rich_img, tmp_cwd, monkeypatch, caplog):
+        out = tmp_cwd / "out.svg"
+        self.rendered(rich_img, img_paths=[str(out)]).save_images()
+        img = self.rendered(rich_img, img_paths=[str(out)])
+
+        def export_svg(*args, **kwargs):
+            raise AssertionError("SVG should not be rendered")
+
+        monkeypatch.setattr(img.capture_console, "export_svg", export_svg)
+        img.save_images()
+        assert img.num_img_skipped == 1
+        assert "render unchanged" in caplog.text
+
+    @pytest.mark.parametrize("change", [{"terminal_theme": "MONOKAI"}, {"title": "New title"}])
+    def test_render_options_change_the_digest(self, rich_img, tmp_cwd, caplog, change):
+        out = tmp_cwd / "out.svg"
+        self.rendered(rich_img, img_paths=[str(out)]).save_images()
+        img = self.rendered(rich_img, img_paths=[str(out)], **change)
+        img.save_images()
+        assert img.num_img_saved == 1
+        assert "render unchanged" not in caplog.text
+
+    def test_digest_is_not_used_for_png(self, rich_img, tmp_cwd):
+        out = tmp_cwd / "out.png"
+        out.write_bytes(b"not really a png")
+        img = self.rendered(rich_img, img_paths=[str(out)])
+        assert img._svg_has_digest(str(out), img._render_digest()) is False
+
     def test_terminal_theme(self, rich_img, tmp_cwd):
         out = tmp_cwd / "out.svg"
         img = self.rendered(rich_img, img_paths=[str(out)], terminal_theme="MONOKAI")
@@ -734,6 +910,15 @@ class TestSaveImages:
         assert all(p.exists() for p in paths)
         assert img.num_img_saved == 3
 
+    def test_png_conversion_in_a_process_pool(self, rich_img, tmp_cwd):
+        pytest.importorskip("cairosvg", reason="CairoSVG is an optional extra")
+        out = tmp_cwd / "out.png"
+        img = self.rendered(rich_img, img_paths=[str(out)])
+        with ProcessPoolExecutor(1) as pool:
+            img.convert_pool = pool
+            img.save_images()
+        assert out.read_bytes().startswith(b"\x89PNG")
+
     def test_missing_cairosvg_is_reported(self, rich_img, tmp_cwd, caplog, block_import):
         block_import("cairosvg")
         out = tmp_cwd / "out.png"
@@ -775,3 +960,177 @@ def test_ignored_commands_are_matched_as_prefixes(rich_img, tmp_cwd):
     img.run_command()
     assert img.aborted is True
     assert rich_img(command="echo rm").aborted is False
+
+
+class TestCapturedLines:
+    """Tests for CapturedLines, which decodes output as it streams in."""
+
+    def test_matches_decoding_everything_at_once(self):
+        output = "\x1b[31mred\nstill red\x1b[0m\r\nplain\n10%\r100%\nlast"
+        whole = CapturedLines.from_output(output)
+        streamed = CapturedLines()
+        # One byte at a time, splitting '\r\n' and the escape codes
+        for byte in output.encode():
+            streamed.feed(bytes([byte]))
+        streamed.close()
+        assert streamed.head_lines == whole.head_lines
+        assert [line.plain for line in whole.head_lines] == ["red", "still red", "plain", "100%", "last"]
+        assert whole.head_lines[1].spans[0].style.color.name == "color(1)"
+
+    def test_multibyte_characters_split_across_chunks(self):
+        captured = CapturedLines()
+        for byte in "✨ sparkles\n".encode():
+            captured.feed(bytes([byte]))
+        captured.close()
+        assert captured.head_lines[0].plain == "✨ sparkles"
+
+    def test_only_head_and_tail_are_kept(self):
+        captured = CapturedLines(head=2, tail=3)
+        captured.feed("".join(f"line {i}\n" for i in range(1000)).encode())
+        captured.close()
+        assert captured.num_lines == 1001
+        assert [line.plain for line in captured.head_lines] == ["line 0", "line 1"]
+        assert [line.plain for line in captured.tail_lines] == ["line 998", "line 999", ""]
+
+    def test_width_covers_lines_that_were_dropped(self):
+        captured = CapturedLines(head=1)
+        captured.feed(b"short\n" + b"x" * 300 + b"\nshort\n")
+        captured.close()
+        assert captured.max_line_length == 300
+        assert len(captured.head_lines) == 1
+
+
+class TestStreamingCapture:
+    """Tests for head / tail output, which is streamed rather than saved in full."""
+
+    def test_streamed_output_is_not_saved_in_full(self, rich_img, tmp_cwd):
+        img = rich_img(command="seq 1 100000", tail=2, hide_command=True)
+        img.run_command()
+        assert img.command_output is None
+        assert len(img.command_lines.head_lines) + len(img.command_lines.tail_lines) == 2
+        assert "100000" in rendered_text(img)
+
+    @pytest.mark.parametrize(
+        ("head", "tail"), [(2, None), (None, 2), (1, 1), (3, 3), (10, None), (None, 10), (0, 2), (2, 0)]
+    )
+    def test_streaming_matches_full_capture(self, rich_img, tmp_cwd, head, tail):
+        def render(stream_output):
+            img = rich_img(command="printf 'one\\ntwo\\nthree\\nfour\\nfive'", head=head, tail=tail)
+            img.stream_output = stream_output
+            img.run_command()
+            return rendered_text(img), img.head, img.tail
+
+        assert render(True) == render(False)
+
+    def test_trim_after_in_the_tail(self, rich_img, tmp_cwd):
+        img = rich_img(command="printf 'one\\ntwo\\nSTOP\\nfour\\n'", tail=3, trim_after="STOP", hide_command=True)
+        img.run_command()
+        output = rendered_text(img)
+        assert "STOP" in output
+        assert "four" not in output
+
+
+class TestShellSessions:
+    """Tests for running commands in shell sessions, with RichImg.shell_sessions."""
+
+    @pytest.fixture
+    def session_img(self, rich_img):
+        """Build RichImg objects that share a set of shell sessions."""
+        sessions = ShellSessions()
+
+        def _session_img(**kwargs):
+            img = rich_img(**kwargs)
+            img.shell_sessions = sessions
+            return img
+
+        yield _session_img
+        sessions.close()
+
+    def test_command_output_is_captured(self, session_img, tmp_cwd):
+        img = session_img(command="echo hello world; echo oh no >&2")
+        img.run_command()
+        assert img.command_output == "hello world\noh no\n"
+
+    def test_before_and_after_commands(self, session_img, tmp_cwd):
+        img = session_img(
+            command="cat before.txt",
+            before_command="echo made-by-before > before.txt",
+            after_command="echo made-by-after > after.txt",
+        )
+        img.run_command()
+        assert "made-by-before" in rendered_text(img)
+        assert (tmp_cwd / "after.txt").exists()
+
+    def test_head_and_tail(self, session_img, tmp_cwd):
+        img = session_img(command="printf 'one\\ntwo\\nthree\\nfour\\nfive'", head=1, tail=1, hide_command=True)
+        img.run_command()
+        output = rendered_text(img)
+        assert "one" in output
+        assert "five" in output
+        assert "three" not in output
+
+    def test_timeout(self, session_img, tmp_cwd, caplog):
+        img = session_img(command="echo before-timeout && sleep 30", timeout=0.5)
+        img.run_command()
+        assert "timed out" in caplog.text
+        assert "before-timeout" in rendered_text(img)
+        next_img = session_img(command="echo next")
+        next_img.run_command()
+        assert next_img.command_output == "next\n"
+
+    def test_shell_is_shared(self, session_img, tmp_cwd):
+        images = [session_img(command="echo $$", extra_env={"RC_TEST_VAR": "same"}) for _ in range(3)]
+        for img in images:
+            img.run_command()
+        assert len({img.command_output for img in images}) == 1
+        assert images[0].shell_sessions.num_started == 1
+
+
+class TestCassettes:
+    """Tests for recording and replaying command output, with RichImg.record_cassette and replay_cassette."""
+
+    def test_exec_key(self, rich_img, tmp_cwd):
+        img = rich_img(command="echo hi", source=str(tmp_cwd / "README.md"), working_dir=str(tmp_cwd / "sub"))
+        assert img.exec_key() == rich_img(command="echo hi", source="README.md", working_dir="sub").exec_key()
+        assert img.exec_key() == rich_img(command="echo hi", source="README.md", working_dir="sub", head=1).exec_key()
+        assert img.exec_key() != rich_img(command="echo bye", source="README.md", working_dir="sub").exec_key()
+
+    def test_replay_doesnt_run_anything(self, rich_img, tmp_cwd):
+        kwargs = {"command": "echo hello; touch ran.txt", "after_command": "touch after.txt"}
+        recorder = CassetteRecorder(tmp_cwd / "tape.rcx")
+        img = rich_img(**kwargs)
+        img.record_cassette = recorder
+        img.run_command()
+        recorder.close()
+        (tmp_cwd / "ran.txt").unlink()
+        (tmp_cwd / "after.txt").unlink()
+
+        replayed = rich_img(**kwargs, terminal_theme="MONOKAI")
+        replayed.replay_cassette = CassettePlayer(tmp_cwd / "tape.rcx")
+        replayed.run_command()
+        assert replayed.command_output == img.command_output == "hello\n"
+        assert not (tmp_cwd / "ran.txt").exists()
+        assert not (tmp_cwd / "after.txt").exists()
+
+    def test_replay_with_head_and_tail(self, rich_img, tmp_cwd):
+        command = "printf 'one\\ntwo\\nthree\\nfour\\nfive'"
+        recorder = CassetteRecorder(tmp_cwd / "tape.rcx")
+        img = rich_img(command=command)
+        img.record_cassette = recorder
+        img.run_command()
+        recorder.close()
+        replayed = rich_img(command=command, head=1, tail=1, hide_command=True)
+        replayed.replay_cassette = CassettePlayer(tmp_cwd / "tape.rcx")
+        replayed.run_command()
+        output = rendered_text(replayed)
+        assert "one" in output
+        assert "five" in output
+        assert "three" not in output
+
+    def test_commands_missing_from_the_cassette_are_run(self, rich_img, tmp_cwd, caplog):
+        CassetteRecorder(tmp_cwd / "tape.rcx").close()
+        img = rich_img(command="echo not-recorded")
+        img.replay_cassette = CassettePlayer(tmp_cwd / "tape.rcx")
+        img.run_command()
+        assert "No output for 'echo not-recorded' in the cassette" in caplog.text
+        assert img.command_output == "not-recorded\n"
@@ -0,0 +1,158 @@
+"""Tests for rich_codex.search_index."""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from conftest import write
+
+from rich_codex import search_index as search_index_module
+from rich_codex.search_index import SearchIndex
+
+
+@pytest.fixture
+def index(tmp_cwd):
+    """Make a search index in the temporary working directory."""
+    return SearchIndex(tmp_cwd / "cache")
+
+
+def age(path, seconds=60):
+    """Make a file look like it was last changed a while ago."""
+    mtime = path.stat().st_mtime - seconds
+    os.utime(path, (mtime, mtime))
+
+
+class TestScan:
+    """Tests for SearchIndex.scan()."""
+
+    def test_first_scan(self, index, tmp_cwd):
+        readme = write(tmp_cwd / "README.md", "![`echo hi`](hi.svg)\n")
+        found = index.scan(readme)
+        assert [item["match"]["cmd"] for item in found] == ["echo hi"]
+        assert index.num_scanned == 1
+
+    def test_unchanged_file_is_not_read(self, index, tmp_cwd, monkeypatch):
+        readme = write(tmp_cwd / "README.md", "![`echo hi`](hi.svg)\n")
+        age(readme)
+        first = index.scan(readme)
+        monkeypatch.setattr(search_index_module, "scan_file", lambda text: pytest.fail("should not have scanned"))
+        monkeypatch.setattr(type(readme), "read_bytes", lambda self: pytest.fail("should not have read"))
+        assert index.scan(readme) == first
+        assert index.num_reused == 1
+
+    def test_recently_changed_file_is_checksummed(self, index, tmp_cwd, monkeypatch):
+        """A file changed just before it was indexed could change again without its mtime moving on."""
+        readme = write(tmp_cwd / "README.md", "![`echo hi`](hi.svg)\n")
+        index.scan(readme)
+        monkeypatch.setattr(search_index_module, "scan_file", lambda text: pytest.fail("should not have scanned"))
+        index.scan(readme)
+        assert index.num_reused == 1
+
+    def test_touched_file_is_not_rescanned(self, index, tmp_cwd, monkeypatch):
+        readme = write(tmp_cwd / "README.md", "![`echo hi`](hi.svg)\n")
+        age(readme)
+        index.scan(readme)
+        os.utime(readme)
+        monkeypatch.setattr(search_index_module, "scan_file", lambda text: pytest.fail("should not have scanned"))
+        index.scan(readme)
+        assert index.num_reused == 1
+
+    def test_changed_file_is_rescanned(self, index, tmp_cwd):
+        readme = write(tmp_cwd / "README.md", "![`echo hi`](hi.svg)\n")
+        age(readme)
+        index.scan(readme)
+        write(readme, "![`echo bye`](bye.svg)\n")
+        assert [item["match"]["cmd"] for item in index.scan(readme)] == ["echo bye"]
+        assert index.num_scanned == 2
+
+
+class TestScanAll:
+    """Tests for SearchIndex.scan_all()."""
+
+    def test_results_are_in_order(self, index, tmp_cwd):
+        files = [write(tmp_cwd / f"{i}.md", f"![`echo {i}`]({i}.svg)\n") for i in range(3)]
+        age(files[1])
+        index.scan(files[1])
+        write(files[2], "![`echo changed`](2.svg)\n")
+        with ThreadPoolExecutor(2) as pool:
+            found = index.scan_all(files, pool)
+        assert [[item["match"]["cmd"] for item in file_found] for file_found in found] == [
+            ["echo 0"],
+            ["echo 1"],
+            ["echo changed"],
+        ]
+        assert (index.num_reused, index.num_scanned) == (1, 3)
+
+    def test_same_contents_are_not_rescanned(self, index, tmp_cwd, monkeypatch):
+        readme = write(tmp_cwd / "README.md", "![`echo hi`](hi.svg)\n")
+        first = index.scan(readme)
+        monkeypatch.setattr(search_index_module, "scan_file", lambda text: pytest.fail("should not have scanned"))
+        assert index.scan_all([readme]) == [first]
+        assert index.files[str(readme)]["found"] == first
+
+
+class TestIndexFile:
+    """Tests for index_file()."""
+
+    def test_entry(self, tmp_cwd):
+        readme = write(tmp_cwd / "README.md", "![`echo hi`](hi.svg)\n")
+        entry = search_index_module.index_file(readme)
+        assert entry["size"] == readme.stat().st_size
+        assert entry["sha256"] == hashlib.sha256(readme.read_bytes()).hexdigest()
+        assert [item["match"]["cmd"] for item in entry["found"]] == ["echo hi"]
+
+    def test_unchanged_checksum(self, tmp_cwd):
+        readme = write(tmp_cwd / "README.md", "![`echo hi`](hi.svg)\n")
+        checksum = hashlib.sha256(readme.read_bytes()).hexdigest()
+        assert search_index_module.index_file(readme, checksum)["found"] is None
+
+    def test_files_without_markers_are_not_scanned(self, tmp_cwd, monkeypatch):
+        readme = write(tmp_cwd / "README.md", "# Just docs\n")
+        monkeypatch.setattr(search_index_module, "scan_file", lambda text: pytest.fail("should not have scanned"))
+        assert search_index_module.index_file(readme)["found"] == []
+
+
+class TestSave:
+    """Tests for SearchIndex.save()."""
+
+    def test_saved_index_is_reused(self, index, tmp_cwd):
+        readme = write(tmp_cwd / "README.md", "![`echo hi`](hi.svg)\n")
+        age(readme)
+        index.scan(readme)
+        index.save([readme])
+        reloaded = SearchIndex(tmp_cwd / "cache")
+        reloaded.scan(readme)
+        assert reloaded.num_reused == 1
+        assert (tmp_cwd / "cache" / ".gitignore").exists()
+
+    def test_files_no_longer_searched_are_dropped(self, index, tmp_cwd):
+        one = write(tmp_cwd / "one.md", "![`echo one`](one.svg)\n")
+        two = write(tmp_cwd / "two.md", "![`echo two`](two.svg)\n")
+        index.scan(one)
+        index.scan(two)
+        index.save([one])
+        assert list(SearchIndex(tmp_cwd / "cache").files) == [str(one)]
+
+    def test_other_versions_are_ignored(self, index, tmp_cwd):
+        readme = write(tmp_cwd / "README.md", "![`echo hi`](hi.svg)\n")
+        index.scan(readme)
+        index.save([readme])
+        index_fn = tmp_cwd / "cache" / search_index_module.SEARCH_INDEX_FILENAME
+        index_fn.write_text(json.dumps({**json.loads(index_fn.read_text()), "version": "0.0.1"}))
+        assert SearchIndex(tmp_cwd / "cache").files == {}
+
+    def test_corrupt_index_is_ignored(self, tmp_cwd):
+        write(tmp_cwd / "cache" / search_index_module.SEARCH_INDEX_FILENAME, "{not json")
+        assert SearchIndex(tmp_cwd / "cache").files == {}
+
+    def test_config_json_cant_hold_is_not_saved(self, index, tmp_cwd):
+        readme = write(tmp_cwd / "README.md", "<!-- RICH-CODEX\nwhen: 2022-01-01\n-->\n![`echo hi`](hi.svg)\n")
+        index.scan(readme)
+        index.save([readme])
+        assert SearchIndex(tmp_cwd / "cache").files == {}
+
+    def test_nothing_to_save(self, index, tmp_cwd):
+        index.save([])
+        assert not (tmp_cwd / "cache").exists()
@@ -0,0 +1,99 @@
+"""Tests for rich_codex.shell_session."""
+
+import os
+import subprocess
+
+import pytest
+
+from rich_codex.shell_session import ShellSession, ShellSessions
+
+
+@pytest.fixture
+def session(tmp_cwd):
+    """Start a shell session in the temporary working directory."""
+    shell_session = ShellSession(tmp_cwd, dict(os.environ))
+    yield shell_session
+    shell_session.close()
+
+
+@pytest.fixture
+def sessions():
+    """Make a set of shell sessions, closing them after the test."""
+    shell_sessions = ShellSessions()
+    yield shell_sessions
+    shell_sessions.close()
+
+
+class TestShellSession:
+    """Tests for ShellSession.run()."""
+
+    def test_output_and_exit_code(self, session):
+        assert session.run("echo hello; exit 3") == (b"hello\n", 3)
+
+    def test_output_without_trailing_newline(self, session):
+        assert session.run("printf 'no newline'") == (b"no newline", 0)
+
+    def test_stderr_is_captured(self, session):
+        assert session.run("echo oh no >&2") == (b"oh no\n", 0)
+
+    def test_commands_run_in_the_same_shell(self, session):
+        assert session.run("echo $$") == session.run("echo $$")
+
+    def test_commands_dont_change_the_session(self, session):
+        session.run("cd / && export RC_TEST_VAR=leaked")
+        assert session.run("pwd; echo ${RC_TEST_VAR:-unset}") == (f"{os.getcwd()}\nunset\n".encode(), 0)
+
+    def test_commands_that_dont_parse(self, session):
+        output, exit_code = session.run("echo (")
+        assert exit_code != 0
+        assert session.run("echo still-running") == (b"still-running\n", 0)
+
+    def test_commands_get_no_input(self, session):
+        assert session.run("cat; echo next") == (b"next\n", 0)
+
+    def test_background_jobs_dont_write_to_the_next_command(self, session):
+        assert session.run("sleep 0.2 && echo late &") == (b"", 0)
+        assert session.run("sleep 0.5; echo second") == (b"second\n", 0)
+        assert list(session.fifo_dir.iterdir()) == []
+
+    def test_timeout_kills_the_session(self, session):
+        with pytest.raises(subprocess.TimeoutExpired) as e:
+            session.run("echo before-timeout && sleep 30", timeout=0.5)
+        assert e.value.output == b"before-timeout\n"
+        assert not session.alive
+        assert not session.fifo_dir.exists()
+
+    def test_shell_exiting(self, session):
+        assert session.run("echo bye; kill -9 $$; sleep 30") == (b"bye\n", None)
+        assert not session.alive
+
+
+class TestShellSessions:
+    """Tests for ShellSessions.run()."""
+
+    def test_sessions_are_reused(self, sessions, tmp_cwd):
+        env = dict(os.environ)
+        first = sessions.run("echo $$", tmp_cwd, env)
+        assert sessions.run("echo $$", tmp_cwd, env) == first
+        assert sessions.num_started == 1
+
+    def test_session_for_each_working_dir_and_env(self, sessions, tmp_cwd):
+        (tmp_cwd / "other").mkdir()
+        env = dict(os.environ)
+        assert sessions.run("pwd", tmp_cwd / "other", env) == (f"{tmp_cwd / 'other'}\n".encode(), 0)
+        assert sessions.run("echo $RC_TEST_VAR", tmp_cwd, {**env, "RC_TEST_VAR": "one"}) == (b"one\n", 0)
+        assert sessions.run("echo $RC_TEST_VAR", tmp_cwd, {**env, "RC_TEST_VAR": "two"}) == (b"two\n", 0)
+        assert sessions.num_started == 3
+
+    def test_session_is_restarted_after_a_timeout(self, sessions, tmp_cwd):
+        env = dict(os.environ)
+        with pytest.raises(subprocess.TimeoutExpired):
+            sessions.run("sleep 30", tmp_cwd, env, timeout=0.2)
+        assert sessions.run("echo hi", tmp_cwd, env) == (b"hi\n", 0)
+        assert sessions.num_started == 2
+
+    def test_close(self, sessions, tmp_cwd):
+        sessions.run("echo hi", tmp_cwd, dict(os.environ))
+        [[session]] = sessions._idle.values()
+        sessions.close()
+        assert not session.alive
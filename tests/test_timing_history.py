@@ -0,0 +1,86 @@
+"""Tests for rich_codex.timing_history."""
+
+import pytest
+
+from rich_codex import timing_history as timing_history_module
+from rich_codex.rich_img import RichImg
+from rich_codex.timing_history import TIMING_HISTORY_FILENAME, TimingHistory
+
+
+@pytest.fixture
+def history(tmp_cwd):
+    """Make a timing history in the temporary working directory."""
+    return TimingHistory(tmp_cwd / "cache")
+
+
+def timed_img(command, command_time, render_time=0.0, convert_time=0.0, img_paths=("out.svg",)):
+    """Make an image that looks like it has been generated, taking the given times."""
+    img_obj = RichImg(command=command, img_paths=list(img_paths))
+    img_obj.timings = {"command": command_time, "render": render_time, "convert": convert_time}
+    return img_obj
+
+
+class TestRecord:
+    """Tests for TimingHistory.record() and predict()."""
+
+    def test_predict(self, history):
+        history.record(timed_img("sleep 1", 1.0, 0.25, 0.5))
+        assert history.predict(RichImg(command="sleep 1", img_paths=["other.svg"])) == 1.75
+        assert history.predict(RichImg(command="sleep 2", img_paths=["out.svg"])) is None
+
+    def test_types_of_image_are_timed_separately(self, history):
+        history.record(timed_img("echo hi", 0.1, convert_time=2.0, img_paths=["out.png"]))
+        assert history.predict(RichImg(command="echo hi", img_paths=["out.svg"])) is None
+
+    def test_snippets_and_images_that_werent_run_are_not_recorded(self, history):
+        history.record(RichImg(snippet="hi", img_paths=["out.svg"]))
+        history.record(RichImg(command="echo hi", img_paths=["out.svg"]))
+        assert history.timings == {}
+
+    def test_timings_are_smoothed(self, history):
+        history.record(timed_img("sleep 1", 1.0))
+        history.record(timed_img("sleep 1", 3.0))
+        assert history.predict(RichImg(command="sleep 1", img_paths=["out.svg"])) == 2.0
+
+
+class TestSave:
+    """Tests for TimingHistory.save()."""
+
+    def test_saved_history_is_loaded(self, history, tmp_cwd):
+        history.record(timed_img("sleep 1", 1.0, 0.1234567))
+        history.save()
+        reloaded = TimingHistory(tmp_cwd / "cache")
+        assert reloaded.predict(RichImg(command="sleep 1", img_paths=["out.svg"])) == pytest.approx(1.123)
+        assert (tmp_cwd / "cache" / ".gitignore").exists()
+
+    def test_runs_at_the_same_time_are_merged(self, tmp_cwd):
+        one = TimingHistory(tmp_cwd / "cache")
+        two = TimingHistory(tmp_cwd / "cache")
+        one.record(timed_img("sleep 1", 1.0))
+        two.record(timed_img("sleep 2", 2.0))
+        one.save()
+        two.save()
+        merged = TimingHistory(tmp_cwd / "cache")
+        assert merged.predict(RichImg(command="sleep 1", img_paths=["out.svg"])) == 1.0
+        assert merged.predict(RichImg(command="sleep 2", img_paths=["out.svg"])) == 2.0
+
+    def test_history_is_compacted(self, tmp_cwd, monkeypatch):
+        monkeypatch.setattr(timing_history_module, "COMPACT_RATIO", 2)
+        for command_time in (1.0, 2.0, 3.0):
+            history = TimingHistory(tmp_cwd / "cache")
+            history.record(timed_img("sleep 1", command_time))
+            history.save()
+        lines = (tmp_cwd / "cache" / TIMING_HISTORY_FILENAME).read_text().splitlines()
+        assert len(lines) == 1
+        assert TimingHistory(tmp_cwd / "cache").predict(RichImg(command="sleep 1", img_paths=["out.svg"])) == 2.25
+
+    def test_broken_lines_are_ignored(self, history, tmp_cwd):
+        history.record(timed_img("sleep 1", 1.0))
+        history.save()
+        with open(tmp_cwd / "cache" / TIMING_HISTORY_FILENAME, "a") as fh:
+            fh.write('["cut short", 1.0')
+        assert TimingHistory(tmp_cwd / "cache").predict(RichImg(command="sleep 1", img_paths=["out.svg"])) == 1.0
+
+    def test_nothing_to_save(self, history, tmp_cwd):
+        history.save()
+        assert not (tmp_cwd / "cache").exists()
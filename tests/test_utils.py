@@ -1,6 +1,7 @@
 """Tests for rich_codex.utils."""
 
 import pytest
+from conftest import write
 from git import Repo
 from jsonschema.exceptions import ValidationError
 
@@ -34,6 +35,46 @@ class TestCleanList:
         assert utils.clean_list([]) == []
 
 
+class TestGlobs:
+    """Tests for utils.glob_to_regex() and utils.compile_globs()."""
+
+    @pytest.mark.parametrize(
+        ("pattern", "path", "matches"),
+        [
+            ("*.md", "README.md", True),
+            ("*.md", "docs/README.md", False),
+            ("**/*.md", "README.md", True),
+            ("**/*.md", "docs/deep/README.md", True),
+            ("docs/*.md", "docs/index.md", True),
+            ("docs/*.md", "docs/sub/index.md", False),
+            ("docs/**/*.md", "docs/index.md", True),
+            ("docs/**/*.md", "docs/sub/index.md", True),
+            ("**/node_modules/**", "node_modules", True),
+            ("**/node_modules/**", "a/node_modules/b/c.md", True),
+            ("**/node_modules/**", "node_modules_extra/c.md", False),
+            ("**/.git*", ".github", True),
+            ("**/.git*", "src/.gitignore", True),
+            ("file?.md", "file1.md", True),
+            ("file?.md", "file/.md", False),
+            ("file[0-9].md", "file7.md", True),
+            ("file[!0-9].md", "file7.md", False),
+            ("file[!0-9].md", "filex.md", True),
+            ("file[.md", "file[.md", True),
+            ("a+b(c).md", "a+b(c).md", True),
+        ],
+    )
+    def test_glob_to_regex(self, pattern, path, matches):
+        assert bool(utils.compile_globs([pattern]).fullmatch(path)) is matches
+
+    def test_any_pattern_can_match(self):
+        matcher = utils.compile_globs(["*.md", "*.mdx"])
+        assert matcher.fullmatch("page.mdx")
+        assert not matcher.fullmatch("page.txt")
+
+    def test_no_patterns(self):
+        assert utils.compile_globs([]) is None
+
+
 class TestParseExtraEnv:
     """Tests for utils.parse_extra_env()."""
 
@@ -147,6 +188,115 @@ class TestCheckGitStatus:
         assert "file.txt" in msg
 
 
+class TestCheckGitStatusScoped:
+    """Tests for utils.check_git_status() with paths."""
+
+    @pytest.fixture
+    def repo(self, tmp_cwd):
+        repo = Repo.init(tmp_cwd)
+        for name in ["README.md", "img/one.svg", "other.txt"]:
+            write(tmp_cwd / name, "hello")
+        repo.index.add(["README.md", "img/one.svg", "other.txt"])
+        repo.index.commit("initial", author_date="2022-01-01T00:00:00", commit_date="2022-01-01T00:00:00")
+        return repo
+
+    def test_changes_elsewhere_are_ignored(self, repo, tmp_cwd):
+        (tmp_cwd / "other.txt").write_text("changed")
+        (tmp_cwd / "untracked.txt").write_text("hello")
+        assert utils.check_git_status(["README.md", "img"]) == (True, "Git repo looks good.")
+
+    def test_changes_in_directory(self, repo, tmp_cwd):
+        (tmp_cwd / "img" / "one.svg").write_text("changed")
+        (tmp_cwd / "img" / "two.svg").write_text("new")
+        ok, msg = utils.check_git_status(["README.md", "img"])
+        assert ok is False
+        assert msg == "Found uncommitted changes: ['img/one.svg', 'img/two.svg']"
+
+    def test_renamed_file(self, repo, tmp_cwd):
+        repo.index.move(["README.md", "index.md"])
+        ok, msg = utils.check_git_status(["index.md"])
+        assert ok is False
+        assert msg == "Found uncommitted changes: ['index.md']"
+
+    def test_paths_from_a_subdirectory(self, repo, tmp_cwd, monkeypatch):
+        (tmp_cwd / "img" / "one.svg").write_text("changed")
+        monkeypatch.chdir(tmp_cwd / "img")
+        ok, msg = utils.check_git_status(["one.svg"])
+        assert ok is False
+        assert "img/one.svg" in msg
+
+    def test_whole_repo(self, repo, tmp_cwd):
+        (tmp_cwd / "other.txt").write_text("changed")
+        assert utils.check_git_status(["."])[0] is False
+
+    def test_paths_outside_the_repo(self, repo, tmp_cwd):
+        assert utils.check_git_status([tmp_cwd.parent]) == (True, "No files to check in the git repo.")
+
+
+class TestChangedFiles:
+    """Tests for utils.changed_files()."""
+
+    @pytest.fixture
+    def repo(self, tmp_cwd):
+        repo = Repo.init(tmp_cwd)
+        for name in ["README.md", "docs/usage.md", "docs/old.md"]:
+            write(tmp_cwd / name, "hello")
+        repo.index.add(["README.md", "docs/usage.md", "docs/old.md"])
+        repo.index.commit("initial", author_date="2022-01-01T00:00:00", commit_date="2022-01-01T00:00:00")
+        return repo
+
+    def test_no_changes(self, repo):
+        assert utils.changed_files("HEAD") == set()
+
+    def test_changed_and_untracked_files(self, repo, tmp_cwd):
+        (tmp_cwd / "README.md").write_text("changed")
+        write(tmp_cwd / "docs" / "new.md", "new")
+        assert utils.changed_files("HEAD") == {tmp_cwd / "README.md", tmp_cwd / "docs" / "new.md"}
+
+    def test_committed_changes(self, repo, tmp_cwd):
+        (tmp_cwd / "README.md").write_text("changed")
+        repo.index.add(["README.md"])
+        repo.index.commit("change", author_date="2022-01-02T00:00:00", commit_date="2022-01-02T00:00:00")
+        assert utils.changed_files("HEAD") == set()
+        assert utils.changed_files("HEAD~1") == {tmp_cwd / "README.md"}
+
+    def test_renamed_files_are_listed_under_both_names(self, repo, tmp_cwd):
+        repo.index.move(["docs/old.md", "docs/renamed.md"])
+        assert utils.changed_files("HEAD") == {tmp_cwd / "docs" / "old.md", tmp_cwd / "docs" / "renamed.md"}
+
+    def test_from_a_subdirectory(self, repo, tmp_cwd, monkeypatch):
+        (tmp_cwd / "README.md").write_text("changed")
+        monkeypatch.chdir(tmp_cwd / "docs")
+        assert utils.changed_files("HEAD") == {tmp_cwd / "README.md"}
+
+    def test_unknown_ref(self, repo):
+        with pytest.raises(ValueError, match="Couldn't find changes since 'not-a-branch'"):
+            utils.changed_files("not-a-branch")
+
+    def test_not_a_git_repo(self, tmp_cwd):
+        with pytest.raises(ValueError, match="Does not appear to be a git repository"):
+            utils.changed_files("HEAD")
+
+
+class TestBufferedLogs:
+    """Tests for utils.buffered_logs() and utils.replay_logs()."""
+
+    def test_records_are_held_back_then_replayed(self, caplog):
+        records = []
+        with utils.buffered_logs(records):
+            utils.log.info("held back")
+        assert "held back" not in caplog.text
+        assert [r.getMessage() for r in records] == ["held back"]
+        utils.replay_logs(records)
+        assert "held back" in caplog.text
+
+    def test_logging_is_normal_outside_the_context(self, caplog):
+        with utils.buffered_logs([]):
+            pass
+        utils.log.info("straight through")
+        assert "straight through" in caplog.text
+
+
 class TestValidateConfig:
     """Tests for utils.validate_config()."""
 
@@ -184,3 +334,50 @@ class TestValidateConfig:
             utils.validate_config(schema, config, "test.yml")
         # anyOf errors carry sub-errors, which are printed as an indented list
         assert "*" in str(excinfo.value)
+
+    def test_validator_is_reused(self, schema):
+        assert utils.get_validator(schema) is utils.get_validator(schema)
+
+    def test_validator_for_another_schema(self, schema):
+        other = {"type": "object", "properties": {"name": {"type": "string"}}}
+        assert utils.get_validator(other) is not utils.get_validator(schema)
+        assert utils.get_validator(other).schema == other
+
+    def test_refs_are_inlined(self):
+        schema = {"$defs": {"width": {"type": "integer"}}, "properties": {"width": {"$ref": "#/$defs/width"}}}
+        validator = utils.get_validator(schema)
+        assert validator.schema["properties"]["width"] == {"type": "integer"}
+        assert not validator.is_valid({"width": "wide"})
+
+
+class TestValidateOutputs:
+    """Tests for utils.validate_outputs()."""
+
+    def test_all_valid(self, schema):
+        outputs = [
+            ({"command": "echo one", "img_paths": ["one.svg"]}, "a.md", 1),
+            ({"snippet": "two", "img_paths": ["two.svg"]}, "b.md", 5),
+        ]
+        assert utils.validate_outputs(schema, outputs) == [None, None]
+
+    def test_errors_are_reported_for_each_output(self, schema):
+        outputs = [
+            ({"command": "echo one", "img_paths": ["one.svg"]}, "a.md", 1),
+            ({"command": "echo two", "img_paths": ["two.jpg"], "terminal_width": "wide"}, "b.md", 5),
+            ({"img_paths": ["three.svg"]}, "c.md", 9),
+        ]
+        errors = utils.validate_outputs(schema, outputs)
+        assert errors[0] is None
+        assert "'b.md' line 5 was invalid" in str(errors[1])
+        assert "'c.md' line 9 was invalid" in str(errors[2])
+
+    def test_messages_match_validate_config(self, schema):
+        config = {"command": "echo two", "img_paths": ["two.jpg"], "terminal_width": "wide", "nonsense": True}
+        with pytest.raises(ValidationError) as excinfo:
+            utils.validate_config(schema, {"outputs": [config]}, "b.md", 5)
+        valid = {"command": "echo one", "img_paths": ["one.svg"]}
+        errors = utils.validate_outputs(schema, [(valid, "a.md", 1), (config, "b.md", 5)])
+        assert str(errors[1]) == str(excinfo.value)
+
+    def test_no_outputs(self, schema):
+        assert utils.validate_outputs(schema, []) == []